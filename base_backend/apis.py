@@ -1,5 +1,8 @@
+from rest_framework import serializers
 from rest_framework.renderers import JSONRenderer
 
+from base_backend.images import derivative_urls, derivatives_column
+
 
 class DefaultApiResponse(object):
     def __init__(self, user=None, **kwargs):
@@ -38,3 +41,38 @@ class CustomJSONRenderer(JSONRenderer):
         response = super(CustomJSONRenderer, self).render(response_data, accepted_media_type, renderer_context)
 
         return response
+
+
+class QueryPlanMixin(object):
+    """
+    Lets a viewset declare how its queryset is loaded for each action.
+    query_plans maps an action name (or 'default') to a callable that takes the base queryset and returns it
+    with the select_related/prefetch_related/annotations its serializer needs, usually the serializer's
+    setup_eager_loading. Map an action to None to skip the default plan.
+    """
+    query_plans = {}
+
+    def get_query_plan(self):
+        return self.query_plans.get(self.action, self.query_plans.get('default'))
+
+    def get_queryset(self):
+        queryset = super(QueryPlanMixin, self).get_queryset()
+        plan = self.get_query_plan()
+        return plan(queryset) if plan else queryset
+
+
+class ImageSizesField(serializers.ReadOnlyField):
+    """
+    the urls of an image field's original and generated derivatives (see base_backend.images.derivative_urls),
+    absolute when the request is in the serializer's context. ex: main_sizes = ImageSizesField(source='main')
+    """
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        url = value.url
+        request = self.context.get('request')
+        # recorded next to the field when the derivatives were written, a deferred record reads as none
+        sizes = value.instance.__dict__.get(derivatives_column(value.field.name)) or ''
+        return derivative_urls(request.build_absolute_uri(url) if request is not None else url, sizes.split())
+
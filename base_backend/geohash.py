@@ -0,0 +1,101 @@
+"""
+Geohash encoding, used as a spatial index that works on a plain MySQL index (no GIS extension):
+points that are close share a common geohash prefix, so a radius query becomes a handful of
+`geohash >= 'prefix' AND geohash < 'prefix~'` range scans followed by an exact distance check. ranges rather than
+`LIKE 'prefix%'`: a LIKE on a case insensitive column (sqlite) or collation can't use the index.
+"""
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS = 6378137.0  # meters, same as tracking_funcs.measure
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+
+def encode(latitude: float, longitude: float, precision: int = 9) -> str:
+    """
+    encodes a point to a geohash
+    :param latitude: the latitude in degrees
+    :param longitude: the longitude in degrees
+    :param precision: the geohash length, 9 characters is a ~5m cell
+    :return: the geohash
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash = []
+    bits, bit_count, even = 0, 0, True
+    while len(geohash) < precision:
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            interval[0] = middle
+        else:
+            bits = bits * 2
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(geohash)
+
+
+def prefix_range(prefix: str) -> tuple:
+    """
+    :param prefix: a geohash prefix
+    :return: (low, high), the geohashes starting with the prefix are >= low and < high
+    """
+    # '~' sorts after every BASE32 character
+    return prefix, prefix + '~'
+
+
+def cell_size(precision: int) -> tuple:
+    """
+    :return: the (latitude, longitude) size in degrees of a cell for the given precision
+    """
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def bounding_boxes(latitude: float, longitude: float, radius: float) -> list:
+    """
+    the smallest latitude/longitude boxes containing the circle: one box, or two when the circle crosses the
+    ±180° meridian, split on it (the longitudes wrap). the latitudes are clamped to ±90°, a circle reaching a pole
+    spans every longitude.
+    :param latitude: the center latitude
+    :param longitude: the center longitude
+    :param radius: the radius in meters
+    :return: [(min_latitude, min_longitude, max_latitude, max_longitude)]
+    """
+    d_lat = radius / METERS_PER_DEGREE
+    min_lat, max_lat = max(latitude - d_lat, -90.0), min(latitude + d_lat, 90.0)
+    cos_lat = math.cos(math.radians(latitude))
+    d_lon = 180.0 if cos_lat < 1e-6 or min_lat == -90.0 or max_lat == 90.0 else \
+        min(radius / (METERS_PER_DEGREE * cos_lat), 180.0)
+    min_lon, max_lon = longitude - d_lon, longitude + d_lon
+    if d_lon >= 180.0:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    if min_lon < -180.0:
+        return [(min_lat, min_lon + 360.0, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+    if max_lon > 180.0:
+        return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon - 360.0)]
+    return [(min_lat, min_lon, max_lat, max_lon)]
+
+
+def covering_cells(min_latitude, min_longitude, max_latitude, max_longitude, max_cells=16, max_precision=9) -> list:
+    """
+    the geohash prefixes covering a box, using the finest precision that needs at most `max_cells` cells
+    :return: a list of geohash prefixes
+    """
+    cells = ['']
+    for precision in range(1, max_precision + 1):
+        lat_step, lon_step = cell_size(precision)
+        lat_cells = range(int((min_latitude + 90) // lat_step), int((max_latitude + 90) // lat_step) + 1)
+        lon_cells = range(int((min_longitude + 180) // lon_step), int((max_longitude + 180) // lon_step) + 1)
+        if len(lat_cells) * len(lon_cells) > max_cells:
+            break
+        # dict.fromkeys: the cells past the 90/180 edges fold back on the last ones
+        cells = list(dict.fromkeys(encode(min(-90 + (i + 0.5) * lat_step, 90.0),
+                                          min(-180 + (j + 0.5) * lon_step, 180.0), precision)
+                                   for i in lat_cells for j in lon_cells))
+    return cells
@@ -0,0 +1,240 @@
+"""
+the uploads pipeline: the uploads are stored by content (see base_backend.storage), and their derivatives
+(smaller WebP copies for the list screens) are generated by a pool of worker threads, off the request path.
+a derivative of <dir>/<name>.<ext> is stored as <dir>/derivatives/<name>.<size>.webp. only the generated sizes are
+served, they are recorded once written: in the images manifests, and next to the image fields (<field>_derivatives),
+so their urls are built without touching the disk.
+the generate_image_derivatives command (re)generates the missing ones.
+"""
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+
+from base_backend import storage
+
+logger = logging.getLogger(__name__)
+
+# size name -> bounding box, the aspect ratio is kept
+DERIVATIVES = {
+    'thumbnail': (200, 200),
+    'medium': (800, 800),
+}
+DERIVATIVES_DIRECTORY = 'derivatives'
+DERIVATIVES_FORMAT = 'webp'
+
+_executor = None
+
+
+def add_to_manifest(manifest, directory, file, name=None):
+    """
+    stores the uploaded file in the directory (see base_backend.storage), records it in the owner's images
+    manifest (recipe.RecipeImage, restaurants.RestaurantImage), then schedules its derivatives, regenerated when
+    the name held another content. a file with the content of another image of the manifest is not written,
+    that image is returned instead.
+    :param manifest: the owner's related manager of images, ex: recipe.pictures
+    :param directory: the owner's media directory
+    :param file: the uploaded file
+    :param name: the file name, defaults to the uploaded file's name
+    :return: the image
+    """
+    name = name or os.path.basename(file.name)
+    path = os.path.join(directory, name)
+    duplicates = []
+
+    def accept(sha256):
+        duplicates.extend(manifest.filter(sha256=sha256).exclude(name=name)[:1])
+        return not duplicates
+
+    sha256 = storage.store_file(file, path, accept)
+    if duplicates:
+        return duplicates[0]
+    image = manifest.filter(name=name).first()
+    replaced = image is not None and image.sha256 != sha256
+    if image is None or replaced:
+        # the sizes of the former content aren't served while the new ones are generated
+        image, _ = manifest.update_or_create(name=name, defaults={'sha256': sha256, 'derivatives': ''})
+    schedule_derivatives(path, overwrite=replaced, record=partial(record_sizes, manifest.model, 'derivatives',
+                                                                  pk=image.pk))
+    return image
+
+
+def derivative_name(name, size) -> str:
+    """
+    :param name: the path (or url) of the original
+    :param size: a key of DERIVATIVES
+    :return: the path (or url) of its derivative
+    """
+    directory, base = os.path.split(name)
+    stem = os.path.splitext(base)[0]
+    return '/'.join(filter(None, (directory, DERIVATIVES_DIRECTORY,
+                                  '{}.{}.{}'.format(stem, size, DERIVATIVES_FORMAT))))
+
+
+def derivative_urls(url, sizes=()) -> dict:
+    """
+    :param url: the url of the original
+    :param sizes: the generated sizes, see generated_sizes
+    :return: size -> url for the generated sizes, with the original under 'original'
+    """
+    urls = {size: derivative_name(url, size) for size in DERIVATIVES if size in sizes}
+    urls['original'] = url
+    return urls
+
+
+def generated_sizes(path) -> list:
+    """
+    :param path: the original's path
+    :return: the sizes whose derivative is on the disk
+    """
+    return [size for size in DERIVATIVES if os.path.isfile(derivative_name(path, size))]
+
+
+def derivatives_column(field) -> str:
+    """
+    :param field: the name of an image field
+    :return: the name of the field recording its generated sizes
+    """
+    return field + '_derivatives'
+
+
+def record_sizes(model, column, sizes, **lookup):
+    """
+    records the generated sizes of an image
+    :param model: a manifest model (column 'derivatives'), or a model with image fields (see derivatives_column)
+    :param column: the field recording the sizes
+    :param sizes: the generated sizes
+    :param lookup: the image's row, ex: pk=... for a manifest, image=<name> for an image field: a row whose
+    image was replaced since is left alone
+    """
+    model.objects.filter(**lookup).update(**{column: ' '.join(sizes)})
+
+
+def make_derivatives(path, overwrite=False) -> list:
+    """
+    writes the derivatives of the image at path
+    :param path: the original's path
+    :param overwrite: regenerate the existing derivatives
+    :return: the paths of the written derivatives
+    """
+    from PIL import Image
+
+    targets = {size: derivative_name(path, size) for size in DERIVATIVES}
+    targets = {size: target for size, target in targets.items() if overwrite or not os.path.exists(target)}
+    if not targets:
+        return []
+    os.makedirs(os.path.join(os.path.dirname(path), DERIVATIVES_DIRECTORY), exist_ok=True)
+    written = []
+    with Image.open(path) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        for size, target in targets.items():
+            copy = image.copy()
+            copy.thumbnail(DERIVATIVES[size])
+            copy.save(target, DERIVATIVES_FORMAT.upper(), quality=getattr(settings, 'IMAGE_DERIVATIVES_QUALITY', 80))
+            written.append(target)
+    return written
+
+
+def _make_derivatives_safely(path, overwrite=False, record=None):
+    try:
+        make_derivatives(path, overwrite)
+    except Exception:
+        # not an image, or removed meanwhile: only the original is served
+        logger.exception('could not generate the derivatives of %s', path)
+        return
+    if record is not None:
+        record(list(DERIVATIVES))
+
+
+def _derive_in_worker(*args):
+    # the workers hold their own connections, closed like the requests' once too old
+    close_old_connections()
+    try:
+        _make_derivatives_safely(*args)
+    finally:
+        close_old_connections()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMAGE_DERIVATIVES_WORKERS', 2),
+                                       thread_name_prefix='derivatives')
+    return _executor
+
+
+def schedule_derivatives(*paths, overwrite=False, record=None):
+    """
+    generates the derivatives of the images once the current transaction commits, in the worker pool,
+    or right away when the IMAGE_DERIVATIVES_ASYNC setting is off
+    :param paths: the originals' paths
+    :param overwrite: regenerate the existing derivatives, when the originals' contents changed
+    :param record: called with the generated sizes once they are written, see record_sizes
+    """
+    def submit():
+        for path in paths:
+            if getattr(settings, 'IMAGE_DERIVATIVES_ASYNC', True):
+                get_executor().submit(_derive_in_worker, path, overwrite, record)
+            else:
+                _make_derivatives_safely(path, overwrite, record)
+
+    transaction.on_commit(submit)
+
+
+def schedule_field_derivatives(model, field, file):
+    """
+    schedules the derivatives of the file of an image field, their sizes are recorded next to it
+    :param model: the model class
+    :param field: the name of the ImageField, see derivatives_column
+    :param file: the field's file
+    """
+    schedule_derivatives(file.path, record=partial(record_sizes, model, derivatives_column(field),
+                                                   **{field: file.name}))
+
+
+def track_image_fields(model, *fields):
+    """
+    schedules the derivatives of the files uploaded to the model's image fields when an instance is saved
+    :param model: the model class
+    :param fields: the names of its ImageFields, each with a <field>_derivatives CharField, see derivatives_column
+    """
+    from django.db.models.signals import post_init, pre_save, post_save
+
+    def file_names(instance) -> dict:
+        # read raw: the deferred fields aren't loaded
+        values = {field: instance.__dict__.get(field) for field in fields}
+        return {field: getattr(value, 'name', value) for field, value in values.items()}
+
+    def mark_names(sender, instance, **kwargs):
+        instance._image_names = file_names(instance)
+
+    def mark_uploads(sender, instance, raw, **kwargs):
+        # a new upload isn't committed to the storage until the field's pre_save, unless it was saved through
+        # the field's file (instance.image.save(...)) which renames it
+        names = getattr(instance, '_image_names', {})
+        instance._uploaded_images = [] if raw else [
+            field for field, name in file_names(instance).items()
+            if name and (not getattr(instance, field)._committed or name != names.get(field))]
+
+    def derive_uploads(sender, instance, **kwargs):
+        uploaded = getattr(instance, '_uploaded_images', ())
+        if uploaded:
+            # the sizes of the former files aren't served while the new ones are generated
+            cleared = {derivatives_column(field): '' for field in uploaded}
+            model.objects.filter(pk=instance.pk).update(**cleared)
+            for column, value in cleared.items():
+                setattr(instance, column, value)
+            for field in uploaded:
+                schedule_field_derivatives(model, field, getattr(instance, field))
+        instance._uploaded_images = []
+        instance._image_names = file_names(instance)
+
+    post_init.connect(mark_names, sender=model, weak=False, dispatch_uid='mark_names_{}'.format(model.__name__))
+    pre_save.connect(mark_uploads, sender=model, weak=False, dispatch_uid='mark_uploads_{}'.format(model.__name__))
+    post_save.connect(derive_uploads, sender=model, weak=False,
+                      dispatch_uid='derive_uploads_{}'.format(model.__name__))
@@ -2,24 +2,27 @@
 Messaging module is for sending notifications over firebase messaging service
 it supports per user notification using the notification token and
 per topic notification using the topic name.
-requires the firebase credentials to be initialized first.
+notifications are not sent right away: they are written to the notifications outbox, in the same transaction
+as the change that triggers them, and sent by the send_notifications worker (see notifications.dispatch).
 ENJOY!
 """
+import json
 
 from django.conf import settings
-from firebase_admin import messaging
-import logging
 
-logger = logging.getLogger(__name__)
 
+def _outbox_message(message: dict, token: str = None, topic: str = None):
+    # imported here: the notifications app imports base_backend
+    from notifications.models import OutboxMessage
 
-def notify_user(notifications_token: str, message: dict):
-    """
-    Notifies a user using his notifications token (provided from the apps)
-    :param notifications_token: the user's notification token
-    :param message: the message should be a dict normal use case consists of two keys (title,message)
-    :return: None
-    """
+    return OutboxMessage(token=token, topic=topic, payload=json.dumps(message))
+
+
+def _enqueue(message: dict, token: str = None, topic: str = None):
+    _outbox_message(message, token, topic).save()
+
+
+def _check_user_message(notifications_token: str, message: dict):
     if notifications_token == '' or notifications_token is None:
         raise ValueError('notifications_token must not be empty, you should provide the user\'s notification token')
 
@@ -32,9 +35,43 @@ def notify_user(notifications_token: str, message: dict):
     if message['title'] is None:
         message['title'] = settings.APP_NAME
 
-    msg = messaging.Message(data=message, token=notifications_token)
-    response = messaging.send(msg)
-    logger.info(response)
+
+def notify_user(notifications_token: str, message: dict):
+    """
+    Notifies a user using his notifications token (provided from the apps)
+    :param notifications_token: the user's notification token
+    :param message: the message should be a dict normal use case consists of two keys (title,message)
+    :return: None
+    """
+    _check_user_message(notifications_token, message)
+    _enqueue(message, token=notifications_token)
+
+
+def notify_users(notifications: list):
+    """
+    Notifies several users at once, their messages are written to the outbox in one insert
+    :param notifications: [(notification token, message)], see notify_user. the empty tokens are skipped
+    :return: None
+    """
+    from notifications.models import OutboxMessage
+
+    notifications = [(token, message) for token, message in notifications if token]
+    for token, message in notifications:
+        _check_user_message(token, message)
+    OutboxMessage.objects.bulk_create([_outbox_message(message, token=token) for token, message in notifications])
+
+
+def notify_account(user, message: dict):
+    """
+    Notifies a user account with its notification token, the accounts without one are skipped.
+    like notify_user, the outbox row is written in the current transaction: nothing is sent for a rolled back write
+    :param user: the user to notify, may be None
+    :param message: the message should be a dict normal use case consists of two keys (title,message)
+    :return: None
+    """
+    if user is None or not user.notification_token:
+        return
+    notify_user(user.notification_token, message)
 
 
 def notify_topic(message: dict, topic: str):
@@ -48,6 +85,4 @@ def _notify_topic(message: dict, topic):
     :param topic: a topic name, topics are to be initialized from the receiving apps (users subscribe to topics)
     :return: None
     """
-    msg = messaging.Message(data=message, topic=topic)
-    response = messaging.send(msg)
-    logger.info(response)
+    _enqueue(message, topic=topic)
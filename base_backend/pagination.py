@@ -0,0 +1,83 @@
+"""
+Pagination for the api.
+pagination is opt-in: a list endpoint keeps returning a plain list unless the client sends `page_size`
+(or follows a `next` link, which carries `page`/`cursor`), so the mobile apps released before
+pagination keep working.
+feed-like endpoints use keyset (cursor) pagination on (created_at, id), admin-like lists use page numbers.
+"""
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from rest_framework import pagination
+from rest_framework.response import Response
+
+
+class OptInPaginationMixin(ABC):
+    page_size_query_param = 'page_size'
+
+    @abstractmethod
+    def get_opt_in_query_params(self):
+        """
+        :return: the query params that ask for a page
+        """
+
+    def is_requested(self, request) -> bool:
+        return any(param in request.query_params for param in self.get_opt_in_query_params())
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.is_requested(request):
+            return None
+        return super(OptInPaginationMixin, self).paginate_queryset(queryset, request, view=view)
+
+
+class PageNumberPagination(OptInPaginationMixin, pagination.PageNumberPagination):
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 100)
+
+    def get_opt_in_query_params(self):
+        return self.page_size_query_param, self.page_query_param
+
+
+class RequiredPageNumberPagination(PageNumberPagination):
+    """
+    for endpoints added after pagination, which have no legacy client to keep working and are always paginated
+    """
+
+    def is_requested(self, request) -> bool:
+        return True
+
+
+class FeedCursorPagination(OptInPaginationMixin, pagination.CursorPagination):
+    ordering = ('-created_at', '-id')
+    max_page_size = getattr(settings, 'API_MAX_FEED_PAGE_SIZE', 50)
+
+    def get_opt_in_query_params(self):
+        return self.page_size_query_param, self.cursor_query_param
+
+
+class RequiredFeedCursorPagination(FeedCursorPagination):
+    """
+    the cursor pagination of the feed-like endpoints added after pagination, always paginated
+    """
+
+    def is_requested(self, request) -> bool:
+        return True
+
+
+class PaginatedActionsMixin:
+    """
+    viewset mixin for custom list-like actions, to paginate them the same way as `list`
+    """
+
+    def list_response(self, queryset, pagination_class=None):
+        """
+        serializes the queryset, paginated if the client asked for it
+        :param queryset: the objects to list
+        :param pagination_class: overrides the viewset's pagination class, for actions that are not ordered
+        by creation date and can't use the cursor pagination
+        :return: the response
+        """
+        paginator = pagination_class() if pagination_class else self.paginator
+        page = paginator.paginate_queryset(queryset, self.request, view=self) if paginator else None
+        if page is not None:
+            return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(queryset, many=True).data)
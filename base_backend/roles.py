@@ -0,0 +1,70 @@
+"""
+Role lookup: the names of the groups a user belongs to.
+they are loaded once per user instance (request.user lives as long as the request). with ROLES_CACHE, the alias of
+a cache shared by every worker process (memcached, redis...), they are shared across requests for
+ROLES_CACHE_TIMEOUT seconds, adding, removing, renaming or deleting groups drops them once committed, see the
+m2m_changed and Group receivers in restaurants.models. a per process cache (locmem) would keep granting a revoked
+role on the other processes.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+ROLES_KEY = 'roles:{}'
+
+
+def _timeout() -> int:
+    return getattr(settings, 'ROLES_CACHE_TIMEOUT', 60)
+
+
+def _cache():
+    alias = getattr(settings, 'ROLES_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def get_roles(user) -> frozenset:
+    """
+    :param user: a user, anonymous users have no roles
+    :return: the names of the user's groups
+    """
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, '_roles', None)
+    if roles is not None:
+        return roles
+    prefetched = getattr(user, '_prefetched_objects_cache', {}).get('groups')
+    if prefetched is not None:
+        roles = frozenset(group.name for group in prefetched)
+    else:
+        cache = _cache()
+        roles = cache.get(ROLES_KEY.format(user.pk)) if cache is not None else None
+        if roles is None:
+            roles = frozenset(user.groups.values_list('name', flat=True))
+            if cache is not None:
+                cache.set(ROLES_KEY.format(user.pk), roles, _timeout())
+    user._roles = roles
+    return roles
+
+
+def has_role(user, *names) -> bool:
+    """
+    :return: True if the user belongs to at least one of the groups
+    """
+    return not get_roles(user).isdisjoint(names)
+
+
+def invalidate_roles(*users) -> None:
+    """
+    drops the cached roles of the given users, now and once the current transaction commits: a request reading
+    them meanwhile would cache them as they were before it
+    :param users: users or user ids
+    """
+    for user in users:
+        if hasattr(user, '_roles'):
+            del user._roles
+    cache = _cache()
+    if cache is None:
+        return
+    keys = [ROLES_KEY.format(getattr(user, 'pk', user)) for user in users]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
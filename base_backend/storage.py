@@ -0,0 +1,162 @@
+"""
+content addressed media storage: every distinct content is stored once, as a blob named after its sha256 under
+MEDIA_BLOBS_ROOT, and the files of the uploads tree are hard links to the blobs.
+the names, paths and urls of the uploads don't change, so the image fields, the media directories of the recipes
+and restaurants and their manifests work as before. a blob's reference count is its links count: removing or
+replacing an upload drops a reference, and a blob left with its own link only is garbage, see collect_garbage.
+when the uploads can't be linked (another file system), they are copied and only the blob is shared.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+
+
+def get_blobs_root() -> str:
+    # must be on the file system of MEDIA_ROOT to be linked from it
+    return getattr(settings, 'MEDIA_BLOBS_ROOT', None) or os.path.join(settings.MEDIA_ROOT, '.blobs')
+
+
+def blob_path(sha256, extension='') -> str:
+    """
+    :param sha256: the hex digest of the content
+    :param extension: the extension of the file, kept so the blob can be served with the right type
+    :return: the path of the blob, spread in two levels of directories
+    """
+    return os.path.join(get_blobs_root(), sha256[:2], sha256[2:4], sha256 + extension.lower())
+
+
+def get_file_mode(mode=None) -> int:
+    """
+    :param mode: the permissions of the stored files, FILE_UPLOAD_PERMISSIONS by default
+    :return: the permissions, readable by the web server when none are set
+    """
+    if mode is None:
+        mode = settings.FILE_UPLOAD_PERMISSIONS
+    # the temporary files are created 0600, they would stay so
+    return 0o644 if mode is None else mode
+
+
+def store_blob(file, extension='', mode=None) -> (str, str):
+    """
+    streams the file chunk by chunk to a temporary file while hashing it, and keeps it as a blob unless an
+    identical one is already stored
+    :param file: a django File (uploaded file, ContentFile...)
+    :param extension: see blob_path
+    :param mode: see get_file_mode, the links to the blob share them
+    :return: (sha256 hex digest, path of the blob)
+    """
+    digest = hashlib.sha256()
+    temporary_directory = os.path.join(get_blobs_root(), 'tmp')
+    os.makedirs(temporary_directory, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=temporary_directory)
+    try:
+        with os.fdopen(descriptor, 'wb') as destination:
+            for chunk in file.chunks():
+                digest.update(chunk)
+                destination.write(chunk)
+        sha256 = digest.hexdigest()
+        path = blob_path(sha256, extension)
+        if os.path.exists(path):
+            # a fresh modification time keeps the garbage collector away until it is linked
+            os.utime(path)
+            os.chmod(path, get_file_mode(mode))
+        else:
+            os.chmod(temporary, get_file_mode(mode))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return sha256, path
+
+
+def link_blob(blob, path, replace=True):
+    """
+    makes path a hard link to the blob
+    :param blob: the blob's path
+    :param path: the upload's path
+    :param replace: replace the file at path if any, atomically. otherwise FileExistsError is raised when there is one
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    temporary = os.path.join(directory, '.link-' + uuid.uuid4().hex)
+    try:
+        os.link(blob, temporary)
+    except OSError:
+        # copied with its permissions
+        shutil.copy(blob, temporary)
+    try:
+        if replace:
+            os.replace(temporary, path)
+        else:
+            # fails when path exists, unlike a rename
+            os.link(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def store_file(file, path, accept=None) -> str:
+    """
+    stores the file as a blob and links it at path, replacing the file at path if any
+    :param file: a django File
+    :param path: the upload's path
+    :param accept: called with the digest, the file is not linked at path when it returns False
+    :return: the sha256 hex digest of the content
+    """
+    sha256, blob = store_blob(file, os.path.splitext(path)[1])
+    if accept is None or accept(sha256):
+        link_blob(blob, path)
+    return sha256
+
+
+def iter_blobs():
+    """
+    :return: the paths of the stored blobs
+    """
+    root = get_blobs_root()
+    for directory, directories, names in os.walk(root):
+        if directory == root:
+            directories[:] = [name for name in directories if name != 'tmp']
+        for name in names:
+            yield os.path.join(directory, name)
+
+
+def collect_garbage(grace=24 * 3600, dry_run=False) -> (int, int):
+    """
+    removes the blobs no upload links to anymore
+    :param grace: seconds a blob is kept after its last use, an upload being stored may not be linked yet
+    :param dry_run: only count them
+    :return: (number of removed blobs, number of freed bytes)
+    """
+    removed, freed, deadline = 0, 0, time.time() - grace
+    for path in iter_blobs():
+        stat = os.stat(path)
+        if stat.st_nlink == 1 and stat.st_mtime < deadline:
+            removed, freed = removed + 1, freed + stat.st_size
+            if not dry_run:
+                os.remove(path)
+    return removed, freed
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    a FileSystemStorage whose files are links to content addressed blobs, see the module's doc.
+    the names are chosen as usual, two uploads of the same file get two names sharing one blob.
+    """
+
+    def _save(self, name, content):
+        sha256, blob = store_blob(content, os.path.splitext(name)[1], self.file_permissions_mode)
+        while True:
+            try:
+                link_blob(blob, self.path(name), replace=False)
+                return name
+            except FileExistsError:
+                # taken since save chose it, another one is chosen as FileSystemStorage does
+                name = self.get_available_name(name)
@@ -0,0 +1,31 @@
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryCountTestMixin:
+    """
+    TestCase mixin to catch N+1 regressions: the number of queries an endpoint runs must not depend
+    on the number of objects it returns.
+    """
+
+    def count_queries(self, function) -> int:
+        with CaptureQueriesContext(connection) as context:
+            function()
+        return len(context.captured_queries)
+
+    def assertConstantQueries(self, function, grow, times=3):
+        """
+        runs `function`, calls `grow` to add more objects `times` times, and checks that `function`
+        still runs the same number of queries after each step.
+        :param function: the code under test, usually a request to a list endpoint
+        :param grow: adds objects to whatever `function` lists
+        :param times: how many times to grow the data set
+        :return: the (constant) number of queries
+        """
+        expected = self.count_queries(function)
+        for step in range(times):
+            grow()
+            count = self.count_queries(function)
+            self.assertEqual(count, expected, 'query count went from {} to {} after growing the data set {} time(s)'
+                             .format(expected, count, step + 1))
+        return expected
@@ -72,3 +72,21 @@ def measure(latitude1, longitude1, latitude2, longitude2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     d = r * c
     return d * 1000  # meters
+
+
+def measure_many(latitudes1, longitudes1, latitudes2, longitudes2):
+    """
+    vectorized measure(): the distance in meters between each pair of points, in one numpy pass.
+    the arguments are sequences of the same length, a scalar is broadcast (e.g. one restaurant against many orders)
+    :return: a numpy array of distances in meters
+    """
+    import numpy as np
+    r = 6378.137  # Radius of earth in KM
+    latitude1 = np.radians(np.asarray(latitudes1, dtype=np.float64))
+    longitude1 = np.radians(np.asarray(longitudes1, dtype=np.float64))
+    latitude2 = np.radians(np.asarray(latitudes2, dtype=np.float64))
+    longitude2 = np.radians(np.asarray(longitudes2, dtype=np.float64))
+    a = np.sin((latitude2 - latitude1) / 2) ** 2 + \
+        np.cos(latitude1) * np.cos(latitude2) * np.sin((longitude2 - longitude1) / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return r * c * 1000  # meters
@@ -13,7 +13,7 @@ from django.db import models
 from django.db.models import Q, Func
 from django.shortcuts import get_object_or_404
 
-from base_backend import get_password_reset_table, get_otp_verification_table
+from base_backend import get_password_reset_table, get_otp_verification_table, storage
 from restaurant.settings import EMAIL_HOST_USER
 
 
@@ -213,9 +213,13 @@ def api_errors_extractor(form_errors):
 
 
 def handle_uploaded_file(file, directory):
-    with open(directory, 'wb+') as destination:
-        for chunk in file.chunks():
-            destination.write(chunk)
+    """
+    stores the uploaded file by content and links it at the path, see base_backend.storage
+    :param file: the uploaded file
+    :param directory: the destination path
+    :return: the sha256 hex digest of the content
+    """
+    return storage.store_file(file, directory)
 
 
 def send_email(subject: str, email: str, message: str) -> int:
@@ -1,3 +1,4 @@
-from django.contrib import admin
-
 # Register your models here.
+from base_backend.admin import register_app_models
+
+register_app_models(app_name='notifications')
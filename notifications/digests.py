@@ -0,0 +1,153 @@
+"""
+Notification digests: the events a user is notified of, like the comments on their restaurant, are not pushed one by
+one. an event is counted in the digest of its kind and target, one UPDATE in the transaction of the change, and the
+digest is due NOTIFICATIONS_DIGEST_WINDOW seconds after its first event.
+the send_notifications worker flushes the due digests in batches: their recipients are resolved in bulk, and each
+gets one message summing its digests ("12 new comments on your restaurant") through the outbox. a user is notified
+once per NOTIFICATIONS_DIGEST_INTERVAL seconds at most, the digests of a user notified more recently wait, and keep
+counting the new events.
+"""
+from collections import namedtuple, defaultdict, Counter
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from base_backend.messaging import notify_users
+from notifications.models import Digest, DigestRecipient
+
+# model: the model of the targets, recipient: the path to the notified user from a target,
+# one and many: the (title, message) of one event, and of several with their number
+Kind = namedtuple('Kind', ['model', 'recipient', 'one', 'many'])
+
+RESTAURANT_COMMENT = 'comment-restaurant'
+MENU_COMMENT = 'comment-menu'
+DELIVERY_COMMENT = 'comment-delivery'
+
+KINDS = {
+    RESTAURANT_COMMENT: Kind('restaurants.Restaurant', 'main_user',
+                             ('New comment', 'Someone commented on your restaurant'),
+                             ('New comments', '{} new comments on your restaurant')),
+    MENU_COMMENT: Kind('restaurants.Menu', 'offered_by__main_user',
+                       ('New comment', 'Someone commented on your menu'),
+                       ('New comments', '{} new comments on your menus')),
+    DELIVERY_COMMENT: Kind('delivery.DeliveryGuy', 'owner',
+                           ('New comment', 'Someone commented on your delivery'),
+                           ('New comments', '{} new comments on your deliveries')),
+}
+
+
+def _window() -> int:
+    return getattr(settings, 'NOTIFICATIONS_DIGEST_WINDOW', 300)
+
+
+def _interval() -> int:
+    return getattr(settings, 'NOTIFICATIONS_DIGEST_INTERVAL', 900)
+
+
+def add_event(kind: str, target_id: int):
+    """
+    counts an event in the digest of its target, the digest is created by the first event
+    :param kind: one of KINDS
+    :param target_id: the id of the restaurant, menu... the event is about
+    """
+    digests = Digest.objects.filter(kind=kind, target_id=target_id)
+    if digests.update(count=F('count') + 1):
+        return
+    now = timezone.now()
+    try:
+        with transaction.atomic():
+            Digest.objects.create(kind=kind, target_id=target_id, count=1, created_at=now,
+                                  due_at=now + timedelta(seconds=_window()))
+    except IntegrityError:
+        # created by a concurrent event
+        digests.update(count=F('count') + 1)
+
+
+def digest_message(counts: dict) -> dict:
+    """
+    :param counts: kind -> number of events
+    :return: the message summing them, the title of the kind with the most events
+    """
+    parts = []
+    for kind, count in sorted(counts.items(), key=lambda item: -item[1]):
+        title, message = KINDS[kind].one if count == 1 else KINDS[kind].many
+        parts.append((title, message.format(count)))
+    return {'title': parts[0][0], 'message': ', '.join(message for _, message in parts)}
+
+
+def _recipients(digests) -> dict:
+    """
+    :return: digest pk -> the id of the user to notify, the digests of deleted targets are left out
+    """
+    targets = defaultdict(set)
+    for digest in digests:
+        targets[digest.kind].add(digest.target_id)
+    users = {}
+    for kind, ids in targets.items():
+        model = apps.get_model(KINDS[kind].model)
+        for target_id, user_id in model.objects.filter(pk__in=ids).values_list('pk', KINDS[kind].recipient):
+            users[kind, target_id] = user_id
+    return {digest.pk: users[digest.kind, digest.target_id] for digest in digests
+            if users.get((digest.kind, digest.target_id)) is not None}
+
+
+def flush_batch(batch_size=500) -> dict:
+    """
+    notifies the recipients of a batch of due digests
+    :return: how many users were notified, and how many digests were postponed and dropped (their target is gone)
+    """
+    from restaurants.models import User
+
+    counts = {'notified': 0, 'postponed': 0, 'dropped': 0}
+    with transaction.atomic():
+        now = timezone.now()
+        digests = list(Digest.objects.select_for_update(skip_locked=True).filter(due_at__lte=now)
+                       .order_by('due_at', 'pk')[:batch_size])
+        if not digests:
+            return counts
+        recipients = _recipients(digests)
+        by_user = defaultdict(list)
+        for digest in digests:
+            by_user[recipients.get(digest.pk)].append(digest)
+        counts['dropped'] = len(by_user.pop(None, []))
+        tokens = dict(User.objects.filter(pk__in=list(by_user)).values_list('pk', 'notification_token'))
+        notified_at = dict(DigestRecipient.objects.filter(user__in=list(by_user)).values_list('user', 'notified_at'))
+        postponed, notified, messages = [], [], []
+        for user_id, user_digests in by_user.items():
+            if user_id in notified_at and now < notified_at[user_id] + timedelta(seconds=_interval()):
+                for digest in user_digests:
+                    digest.due_at = notified_at[user_id] + timedelta(seconds=_interval())
+                postponed += user_digests
+                continue
+            events = Counter()
+            for digest in user_digests:
+                events[digest.kind] += digest.count
+            messages.append((tokens.get(user_id), digest_message(events)))
+            notified.append(user_id)
+        notify_users(messages)
+        Digest.objects.bulk_update(postponed, ['due_at'])
+        postponed_pks = {digest.pk for digest in postponed}
+        Digest.objects.filter(pk__in=[digest.pk for digest in digests if digest.pk not in postponed_pks]).delete()
+        DigestRecipient.objects.filter(user__in=notified).update(notified_at=now)
+        DigestRecipient.objects.bulk_create([DigestRecipient(user_id=user_id, notified_at=now)
+                                             for user_id in notified if user_id not in notified_at])
+        counts['notified'], counts['postponed'] = len(notified), len(postponed)
+    return counts
+
+
+def flush_due(batch_size=500) -> dict:
+    """
+    flushes batches until no digest is due
+    :return: the totals of flush_batch
+    """
+    totals = {'notified': 0, 'postponed': 0, 'dropped': 0}
+    while True:
+        counts = flush_batch(batch_size)
+        for key, value in counts.items():
+            totals[key] += value
+        if not any(counts.values()):
+            return totals
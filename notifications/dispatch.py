@@ -0,0 +1,105 @@
+"""
+Drains the notifications outbox.
+due messages are claimed in batches (SELECT ... FOR UPDATE SKIP LOCKED, so several workers can run side by side)
+with a lease: their next attempt is pushed NOTIFICATIONS_LEASE seconds away, and the claim is committed before
+they are sent through the configured transport, so no row stays locked during the network calls. a worker that
+dies while sending leaves them to be claimed again once the lease has expired.
+a failed message is retried with an exponential backoff (NOTIFICATIONS_RETRY_DELAY seconds, doubled at each attempt)
+and becomes a dead letter after NOTIFICATIONS_MAX_ATTEMPTS attempts.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from notifications.models import OutboxMessage
+from notifications.transports import get_transport
+
+logger = logging.getLogger(__name__)
+
+
+def _max_attempts() -> int:
+    return getattr(settings, 'NOTIFICATIONS_MAX_ATTEMPTS', 5)
+
+
+def _retry_delay() -> int:
+    return getattr(settings, 'NOTIFICATIONS_RETRY_DELAY', 30)
+
+
+def _lease() -> int:
+    return getattr(settings, 'NOTIFICATIONS_LEASE', 300)
+
+
+def retry_at(attempts: int, now=None):
+    """
+    :param attempts: the number of failed attempts so far
+    :return: when the message should be tried again
+    """
+    return (now or timezone.now()) + timedelta(seconds=_retry_delay() * 2 ** (attempts - 1))
+
+
+def claim_batch(size: int) -> list:
+    """
+    leases due messages to the caller, the other workers skip them until the lease expires
+    :param size: the most messages to claim
+    :return: the claimed messages
+    """
+    with transaction.atomic():
+        now = timezone.now()
+        messages = list(OutboxMessage.objects.select_for_update(skip_locked=True)
+                        .filter(status=OutboxMessage.PENDING, next_attempt_at__lte=now)
+                        .order_by('next_attempt_at', 'pk')[:size])
+        for message in messages:
+            message.next_attempt_at = now + timedelta(seconds=_lease())
+        OutboxMessage.objects.bulk_update(messages, ['next_attempt_at'])
+    return messages
+
+
+def dispatch_batch(transport=None) -> dict:
+    """
+    sends one batch of due messages
+    :param transport: the transport to use, the configured one if not given
+    :return: how many messages were sent, retried and dead lettered
+    """
+    transport = transport or get_transport()
+    counts = {'sent': 0, 'retried': 0, 'dead': 0}
+    messages = claim_batch(transport.batch_size)
+    if not messages:
+        return counts
+    try:
+        errors = transport.send(messages)
+    except Exception as exception:
+        # the whole batch failed (network, credentials...), it is retried like a failed message
+        logger.exception('could not send %s notification(s)', len(messages))
+        errors = [str(exception) or type(exception).__name__] * len(messages)
+    now = timezone.now()
+    for message, error in zip(messages, errors):
+        message.attempts += 1
+        if error is None:
+            message.status, message.sent_at = OutboxMessage.SENT, now
+            counts['sent'] += 1
+        elif message.attempts >= _max_attempts():
+            message.status, message.last_error = OutboxMessage.DEAD, error
+            counts['dead'] += 1
+        else:
+            message.next_attempt_at, message.last_error = retry_at(message.attempts, now), error
+            counts['retried'] += 1
+    OutboxMessage.objects.bulk_update(messages, ['status', 'attempts', 'sent_at', 'next_attempt_at', 'last_error'])
+    return counts
+
+
+def dispatch_pending(transport=None) -> dict:
+    """
+    sends batches until no message is due
+    :return: the totals of dispatch_batch
+    """
+    transport = transport or get_transport()
+    totals = {'sent': 0, 'retried': 0, 'dead': 0}
+    while True:
+        counts = dispatch_batch(transport)
+        for key, value in counts.items():
+            totals[key] += value
+        if not any(counts.values()):
+            return totals
@@ -0,0 +1,35 @@
+"""
+the notifications worker: flushes the due digests (notifications.digests) to the outbox, and drains the outbox
+written by base_backend.messaging
+runs forever, polling every --interval seconds when nothing is due, or drains once and exits with --once
+(for a cron job). several workers can run at the same time.
+"""
+import time
+
+from django.core.management import BaseCommand
+
+from notifications.digests import flush_due
+from notifications.dispatch import dispatch_pending
+from notifications.transports import get_transport
+
+
+class Command(BaseCommand):
+    help = 'Send the due notification digests and the pending push notifications of the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='drain the outbox once and exit')
+        parser.add_argument('-i', '--interval', type=float, default=1.0,
+                            help='seconds to wait when no notification is due')
+
+    def handle(self, *args, **options):
+        transport = get_transport()
+        while True:
+            flushed = flush_due()
+            if any(flushed.values()):
+                print('{notified} digest(s) notified, {postponed} postponed, {dropped} dropped'.format(**flushed))
+            counts = dispatch_pending(transport)
+            if any(counts.values()):
+                print('{sent} sent, {retried} to retry, {dead} dead letters'.format(**counts))
+            if options['once']:
+                return
+            time.sleep(options['interval'])
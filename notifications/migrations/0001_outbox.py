@@ -0,0 +1,35 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:17
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('token', models.CharField(blank=True, max_length=255, null=True)),
+                ('topic', models.CharField(blank=True, max_length=255, null=True)),
+                ('payload', models.TextField()),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('S', 'Sent'), ('D', 'Dead letter')], default='P', max_length=1)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='outboxmessage',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='notificatio_status_6d08f9_idx'),
+        ),
+    ]
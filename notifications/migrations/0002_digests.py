@@ -0,0 +1,43 @@
+# Generated by Django 3.0.14 on 2026-10-18 10:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0024_restaurant_image_sha256'),
+        ('notifications', '0001_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Digest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=30)),
+                ('target_id', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('due_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DigestRecipient',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('notified_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='digest',
+            index=models.Index(fields=['due_at'], name='notificatio_due_at_7d21bc_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='digest',
+            unique_together={('kind', 'target_id')},
+        ),
+    ]
@@ -1,3 +1,66 @@
+import json
+
 from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from base_backend.models import BaseModel
+
+
+class OutboxMessage(BaseModel):
+    """
+    a push notification waiting to be sent.
+    base_backend.messaging writes them in the same transaction as the change that triggers them, and the
+    send_notifications worker drains them (see notifications.dispatch), so a request never waits for firebase.
+    """
+    PENDING, SENT, DEAD = 'P', 'S', 'D'
+    STATUS = ((PENDING, _('Pending')), (SENT, _('Sent')), (DEAD, _('Dead letter')))
+
+    token = models.CharField(max_length=255, null=True, blank=True)
+    topic = models.CharField(max_length=255, null=True, blank=True)
+    payload = models.TextField()
+    status = models.CharField(max_length=1, default=PENDING, choices=STATUS)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    @property
+    def message(self) -> dict:
+        return json.loads(self.payload)
+
+    def __str__(self):
+        return "{} to {}".format(self.get_status_display(), self.token or self.topic)
+
+
+class Digest(models.Model):
+    """
+    the events of a kind on a target (the comments of a restaurant...) waiting to be notified together, once
+    due_at has passed. the events coming until then are counted in the same row. see notifications.digests
+    """
+    kind = models.CharField(max_length=30)
+    target_id = models.IntegerField()
+    count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    due_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('kind', 'target_id')
+        indexes = [models.Index(fields=['due_at'])]
+
+    def __str__(self):
+        return "{} {} on {}".format(self.count, self.kind, self.target_id)
+
+
+class DigestRecipient(models.Model):
+    """
+    when a user was last notified of digests, to notify each user once per NOTIFICATIONS_DIGEST_INTERVAL at most
+    """
+    user = models.OneToOneField('restaurants.User', on_delete=models.CASCADE, primary_key=True, related_name='+')
+    notified_at = models.DateTimeField()
 
-# Create your models here.
+    def __str__(self):
+        return "{} notified at {}".format(self.user_id, self.notified_at)
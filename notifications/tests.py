@@ -1,3 +1,205 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from base_backend.messaging import notify_user, notify_topic
+from base_backend.testing import QueryCountTestMixin
+from notifications import dispatch, digests
+from notifications.models import OutboxMessage, Digest, DigestRecipient
+from notifications.transports import FakeTransport
+from rating.models import CommentRestaurant, CommentMenu
+from restaurants.models import User, Client, City, Wilaya, Restaurant, Order, Menu, MealType, OfferType
+
+
+@override_settings(NOTIFICATIONS_TRANSPORT='notifications.transports.FakeTransport', NOTIFICATIONS_MAX_ATTEMPTS=3,
+                   NOTIFICATIONS_RETRY_DELAY=10)
+class OutboxTestCase(TestCase):
+    def setUp(self) -> None:
+        FakeTransport.reset()
+
+    def make_due(self):
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+
+    def test_notifications_are_queued_not_sent(self):
+        notify_user('token', {'title': None, 'message': 'hello'})
+        notify_topic({'title': 'news', 'message': 'hello'}, 'all')
+        self.assertEqual(FakeTransport.sent, [])
+        messages = list(OutboxMessage.objects.order_by('pk'))
+        self.assertEqual([(message.token, message.topic) for message in messages], [('token', None), (None, 'all')])
+        self.assertEqual(messages[0].message, {'title': 'DZ Chief', 'message': 'hello'})
+
+    def test_dispatch_sends_the_due_messages(self):
+        for i in range(3):
+            notify_user('token {}'.format(i), {'title': 'test', 'message': 'hello'})
+        self.assertEqual(dispatch.dispatch_pending(), {'sent': 3, 'retried': 0, 'dead': 0})
+        self.assertEqual([message.token for message in FakeTransport.sent], ['token 0', 'token 1', 'token 2'])
+        self.assertFalse(OutboxMessage.objects.exclude(status=OutboxMessage.SENT).exists())
+        self.assertEqual(dispatch.dispatch_pending(), {'sent': 0, 'retried': 0, 'dead': 0})
+
+    def test_failed_messages_back_off_then_become_dead_letters(self):
+        FakeTransport.failing.add('bad')
+        notify_user('bad', {'title': 'test', 'message': 'hello'})
+        notify_user('good', {'title': 'test', 'message': 'hello'})
+
+        self.assertEqual(dispatch.dispatch_pending(), {'sent': 1, 'retried': 1, 'dead': 0})
+        message = OutboxMessage.objects.get(token='bad')
+        self.assertEqual(message.attempts, 1)
+        self.assertAlmostEqual((message.next_attempt_at - timezone.now()).total_seconds(), 10, delta=2)
+
+        # not due yet
+        self.assertEqual(dispatch.dispatch_pending(), {'sent': 0, 'retried': 0, 'dead': 0})
+
+        self.make_due()
+        start = timezone.now()
+        self.assertEqual(dispatch.dispatch_pending(), {'sent': 0, 'retried': 1, 'dead': 0})
+        self.assertGreaterEqual(OutboxMessage.objects.get(token='bad').next_attempt_at, start + timedelta(seconds=20))
+
+        self.make_due()
+        self.assertEqual(dispatch.dispatch_pending(), {'sent': 0, 'retried': 0, 'dead': 1})
+        message = OutboxMessage.objects.get(token='bad')
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.DEAD, 3))
+        self.assertEqual(message.last_error, 'refused by the fake transport')
+
+    def test_transport_failures_are_retried(self):
+        notify_user('token', {'title': 'test', 'message': 'hello'})
+        with mock.patch.object(FakeTransport, 'send', side_effect=ConnectionError('unreachable')), \
+                self.assertLogs('notifications.dispatch', 'ERROR'):
+            self.assertEqual(dispatch.dispatch_batch(), {'sent': 0, 'retried': 1, 'dead': 0})
+        message = OutboxMessage.objects.get()
+        self.assertEqual((message.status, message.attempts, message.last_error),
+                         (OutboxMessage.PENDING, 1, 'unreachable'))
+
+    def test_claimed_messages_are_leased(self):
+        notify_user('token', {'title': 'test', 'message': 'hello'})
+        claimed = []
+
+        def send(messages):
+            # another worker doesn't claim them while they are sent
+            claimed.extend(dispatch.claim_batch(10))
+            return [None] * len(messages)
+
+        with mock.patch.object(FakeTransport, 'send', side_effect=send):
+            self.assertEqual(dispatch.dispatch_batch(), {'sent': 1, 'retried': 0, 'dead': 0})
+        self.assertEqual(claimed, [])
+        # a worker died while sending: they are claimed again once the lease has expired
+        notify_user('token', {'title': 'test', 'message': 'hello'})
+        self.assertEqual(len(dispatch.claim_batch(10)), 1)
+        self.assertEqual(dispatch.claim_batch(10), [])
+        self.make_due()
+        self.assertEqual(len(dispatch.claim_batch(10)), 1)
+
+    def test_worker_command(self):
+        notify_user('token', {'title': 'test', 'message': 'hello'})
+        call_command('send_notifications', '--once')
+        self.assertEqual(len(FakeTransport.sent), 1)
+
+    def test_order_creation_only_writes_to_the_outbox(self):
+        owner = User.objects.create(username="TesterRestaurantOwner", phone="+213899136334", user_type="O",
+                                    notification_token="owner token")
+        client = Client.objects.create(owner=User.objects.create(username="Tester", phone="+213899136333",
+                                                                 user_type="C"))
+        city = City.objects.create(wilaya=Wilaya.objects.create(name="test", matricule=1, code_postal=10), name="test",
+                                   code_postal=19)
+        restaurant = Restaurant.objects.create(name="test", registre_commerce="rc", id_fiscale="if", latitude=36.75,
+                                               longitude=3.05, main_user=owner, address="dfqsdfqsdfqsdf", city=city,
+                                               images="outbox")
+        Order.objects.create(number=1, client=client, restaurant=restaurant)
+        self.assertEqual(FakeTransport.sent, [])
+        self.assertEqual(OutboxMessage.objects.get().token, "owner token")
+
+
+@override_settings(NOTIFICATIONS_TRANSPORT='notifications.transports.FakeTransport', NOTIFICATIONS_DIGEST_WINDOW=60,
+                   NOTIFICATIONS_DIGEST_INTERVAL=600)
+class DigestTestCase(QueryCountTestMixin, TestCase):
+    def setUp(self) -> None:
+        FakeTransport.reset()
+        self.owner = User.objects.create(username="TesterRestaurantOwner", phone="+213899136334", user_type="O",
+                                         notification_token="owner token")
+        self.client_profile = Client.objects.create(owner=User.objects.create(username="Tester", phone="+213899136333",
+                                                                              user_type="C"))
+        city = City.objects.create(wilaya=Wilaya.objects.create(name="test", matricule=1, code_postal=10), name="test",
+                                   code_postal=19)
+        self.restaurant = Restaurant.objects.create(name="test", registre_commerce="rc", id_fiscale="if",
+                                                    latitude=36.75, longitude=3.05, main_user=self.owner,
+                                                    address="dfqsdfqsdfqsdf", city=city, images="digests")
+        self.menu = Menu.objects.create(number=1, name="test", description="test", price=100.0,
+                                        offered_by=self.restaurant, type=MealType.objects.create(type="test"),
+                                        offer=OfferType.objects.create(type="test"))
+
+    def comment(self, count, target=None):
+        for _ in range(count):
+            if isinstance(target, Menu):
+                CommentMenu.objects.create(client=self.client_profile, menu=target, comment="good")
+            else:
+                CommentRestaurant.objects.create(client=self.client_profile, restaurant=self.restaurant,
+                                                 comment="good")
+
+    def make_due(self):
+        Digest.objects.update(due_at=timezone.now())
+
+    def flush(self):
+        counts = digests.flush_due()
+        dispatch.dispatch_pending()
+        return counts
+
+    def test_comments_are_coalesced_per_recipient(self):
+        self.comment(12)
+        self.comment(1, self.menu)
+        self.assertFalse(OutboxMessage.objects.exists())
+        self.assertEqual(Digest.objects.get(kind=digests.RESTAURANT_COMMENT).count, 12)
+
+        # not due before the window ends
+        self.assertEqual(self.flush(), {'notified': 0, 'postponed': 0, 'dropped': 0})
+        self.make_due()
+        self.assertEqual(self.flush(), {'notified': 1, 'postponed': 0, 'dropped': 0})
+        self.assertEqual([(message.token, message.message) for message in FakeTransport.sent], [
+            ("owner token", {'title': 'New comments',
+                             'message': '12 new comments on your restaurant, Someone commented on your menu'})])
+        self.assertFalse(Digest.objects.exists())
+
+    def test_recipients_are_rate_limited(self):
+        self.comment(1)
+        self.make_due()
+        self.flush()
+        self.assertEqual(FakeTransport.sent[0].message,
+                         {'title': 'New comment', 'message': 'Someone commented on your restaurant'})
+
+        # notified less than NOTIFICATIONS_DIGEST_INTERVAL ago: the digest waits and keeps counting
+        self.comment(2)
+        self.make_due()
+        self.assertEqual(self.flush(), {'notified': 0, 'postponed': 1, 'dropped': 0})
+        self.comment(1)
+        self.assertEqual(Digest.objects.get().count, 3)
+        self.assertEqual(len(FakeTransport.sent), 1)
+
+        DigestRecipient.objects.update(notified_at=timezone.now() - timedelta(seconds=600))
+        self.make_due()
+        call_command('send_notifications', '--once')
+        self.assertEqual(FakeTransport.sent[1].message['message'], '3 new comments on your restaurant')
+
+    def test_recipients_are_notified_in_a_fixed_number_of_queries(self):
+        def flush(recipients):
+            for _ in range(recipients):
+                number = Restaurant.objects.count()
+                owner = User.objects.create(username="owner {}".format(number), phone="+21379913633{}".format(number),
+                                            user_type="O", notification_token="token {}".format(number))
+                restaurant = Restaurant.objects.create(
+                    name="test", registre_commerce="rc {}".format(number), id_fiscale="if {}".format(number),
+                    latitude=36.75, longitude=3.05, main_user=owner, address="test", city=self.restaurant.city,
+                    images="digests {}".format(number))
+                CommentRestaurant.objects.create(client=self.client_profile, restaurant=restaurant, comment="good")
+            self.make_due()
+            return self.count_queries(digests.flush_batch)
+
+        self.assertEqual(flush(1), flush(3))
+        self.assertEqual(OutboxMessage.objects.count(), 4)
+
+    def test_digests_of_deleted_targets_are_dropped(self):
+        self.comment(1)
+        Digest.objects.update(target_id=0)
+        self.make_due()
+        self.assertEqual(self.flush(), {'notified': 0, 'postponed': 0, 'dropped': 1})
+        self.assertEqual(FakeTransport.sent, [])
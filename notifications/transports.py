@@ -0,0 +1,63 @@
+"""
+Transports deliver a batch of OutboxMessage, the one in use is set by NOTIFICATIONS_TRANSPORT.
+send() returns one entry per message: None when it was delivered, the error message otherwise.
+"""
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class BaseTransport(ABC):
+    # the most messages send() accepts at once
+    batch_size = 500
+
+    @abstractmethod
+    def send(self, messages) -> list:
+        """
+        :param messages: the OutboxMessage to deliver
+        :return: per message, None when it was delivered, the error message otherwise
+        """
+
+
+class FirebaseTransport(BaseTransport):
+    """
+    sends the batch in one firebase call with messaging.send_each
+    """
+
+    def send(self, messages) -> list:
+        from firebase_admin import messaging
+
+        response = messaging.send_each([
+            messaging.Message(data=message.message, token=message.token or None, topic=message.topic or None)
+            for message in messages
+        ])
+        return [None if result.success else str(result.exception) for result in response.responses]
+
+
+class FakeTransport(BaseTransport):
+    """
+    keeps the messages in memory instead of sending them, for tests and local development.
+    messages to a token (or topic) in `failing` are refused.
+    """
+    sent = []
+    failing = set()
+
+    def send(self, messages) -> list:
+        errors = []
+        for message in messages:
+            if (message.token or message.topic) in self.failing:
+                errors.append('refused by the fake transport')
+            else:
+                FakeTransport.sent.append(message)
+                errors.append(None)
+        return errors
+
+    @classmethod
+    def reset(cls):
+        cls.sent = []
+        cls.failing = set()
+
+
+def get_transport() -> BaseTransport:
+    return import_string(getattr(settings, 'NOTIFICATIONS_TRANSPORT', 'notifications.transports.FirebaseTransport'))()
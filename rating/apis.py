@@ -1,99 +1,114 @@
-from rest_framework import permissions
+from rest_framework import permissions, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
-from base_backend.utils import RequestDataFixer
+from base_backend.pagination import FeedCursorPagination, RequiredFeedCursorPagination, PaginatedActionsMixin
+from rating import reviews
 from rating.models import CommentRestaurant, RateRestaurant, LikeRestaurant, CommentMenu, RateMenu, LikeMenu, \
     CommentDelivery, RateDelivery, LikeDelivery
 from rating.serializers import RestaurantCommentSerializer, RestaurantRateSerializer, RestaurantLikeSerializer, \
     MenuCommentSerializer, MenuRateSerializer, MenuLikeSerializer, DeliveryCommentSerializer, DeliveryRateSerializer, \
-    DeliveryLikeSerializer
+    DeliveryLikeSerializer, TargetQuerySerializer, TargetIdsQuerySerializer
 
 
-class CommentRestaurantViewSet(ModelViewSet):
-    serializer_class = RestaurantCommentSerializer
+class ReviewViewSet(PaginatedActionsMixin, ModelViewSet):
+    """
+    the likes, comments or rates of one kind of target, see rating.reviews. the viewsets of REVIEWS subclass it
+    """
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    queryset = CommentRestaurant.objects.all()
+    pagination_class = FeedCursorPagination
+    # the reviewed field of the model
+    target_field = None
+
+    def get_target_query(self, required):
+        query = TargetQuerySerializer.for_target(self.target_field, required)(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        return query.validated_data.get(self.target_field)
+
+    def get_queryset(self):
+        if self.action == 'list':
+            # the reviews of a target when it is given, the legacy clients list them all
+            target_id = self.get_target_query(required=False)
+            if target_id is not None:
+                return reviews.target_reviews(self.queryset.model, self.target_field, target_id)
+        return self.queryset.select_related('client__owner')
+
+    def perform_create(self, serializer):
+        serializer.save(client=self.request.user.client)
+
+    @action(['get'], detail=False, url_path='reviews')
+    def target_reviews(self, request, *args, **kwargs):
+        """
+        the reviews of a target, newest first, a page at a time
+        """
+        queryset = reviews.target_reviews(self.queryset.model, self.target_field, self.get_target_query(required=True))
+        return self.list_response(queryset, pagination_class=RequiredFeedCursorPagination)
+
+    @action(['get'], detail=False, url_path='mine', permission_classes=[permissions.IsAuthenticated])
+    def mine(self, request, *args, **kwargs):
+        """
+        the authenticated client's reviews of the targets of a list screen, in one query
+        """
+        query = TargetIdsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(reviews.client_reviews(self.queryset.model, self.target_field, request.user.client,
+                                               query.validated_data['ids']))
+
+
+class LikeReviewViewSet(ReviewViewSet):
+    """
+    a like can be repeated: creating it again returns the existing one
+    """
+
+    def like_response(self, like, created):
+        return Response(self.get_serializer(like).data,
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
     def create(self, request, *args, **kwargs):
-        fixer = RequestDataFixer(request=request)
-        return super(CommentRestaurantViewSet, self).create(fixer, *args, **kwargs)
-
-
-class RateRestaurantViewSet(ModelViewSet):
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    serializer_class = RestaurantRateSerializer
-    queryset = RateRestaurant.objects.all()
-
-    def create(self, request, *args, **kwargs):
-        fixer = RequestDataFixer(request=request)
-        return super(RateRestaurantViewSet, self).create(fixer, *args, **kwargs)
-
-
-class LikeRestaurantViewSet(ModelViewSet):
-    serializer_class = RestaurantLikeSerializer
-    queryset = LikeRestaurant.objects.all()
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-
-    def create(self, request, *args, **kwargs):
-        fixer = RequestDataFixer(request=request)
-        return super(LikeRestaurantViewSet, self).create(fixer, *args, **kwargs)
-
-
-class CommentMenuViewSet(ModelViewSet):
-    serializer_class = MenuCommentSerializer
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    queryset = CommentMenu.objects.all()
-
-    def create(self, request, *args, **kwargs):
-        fixer = RequestDataFixer(request=request)
-        return super(CommentMenuViewSet, self).create(fixer, *args, **kwargs)
-
-
-class RateMenuViewSet(ModelViewSet):
-    serializer_class = MenuRateSerializer
-    queryset = RateMenu.objects.all()
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-
-    def create(self, request, *args, **kwargs):
-        fixer = RequestDataFixer(request=request)
-        return super(RateMenuViewSet, self).create(fixer, *args, **kwargs)
-
-
-class LikeMenuViewSet(ModelViewSet):
-    queryset = LikeMenu.objects.all()
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    serializer_class = MenuLikeSerializer
-
-    def create(self, request, *args, **kwargs):
-        fixer = RequestDataFixer(request=request)
-        return super(LikeMenuViewSet, self).create(fixer, *args, **kwargs)
-
-
-class CommentDeliveryViewSet(ModelViewSet):
-    serializer_class = DeliveryCommentSerializer
-    queryset = CommentDelivery.objects.all()
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-
-    def create(self, request, *args, **kwargs):
-        fixer = RequestDataFixer(request=request)
-        return super(CommentDeliveryViewSet, self).create(fixer, *args, **kwargs)
-
-
-class RateDeliveryViewSet(ModelViewSet):
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-    queryset = RateDelivery.objects.all()
-    serializer_class = DeliveryRateSerializer
-
-    def create(self, request, *args, **kwargs):
-        fixer = RequestDataFixer(request=request)
-        return super(RateDeliveryViewSet, self).create(fixer, *args, **kwargs)
-
-
-class LikeDeliveryViewSet(ModelViewSet):
-    serializer_class = DeliveryLikeSerializer
-    queryset = LikeDelivery.objects.all()
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
-
-    def create(self, request, *args, **kwargs):
-        fixer = RequestDataFixer(request=request)
-        return super(LikeDeliveryViewSet, self).create(fixer, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        like, created = reviews.like(self.queryset.model, self.target_field, request.user.client,
+                                     serializer.validated_data[self.target_field].pk)
+        return self.like_response(like, created)
+
+    @action(['put', 'delete'], detail=False, url_path=r'target/(?P<target_id>[0-9]+)',
+            permission_classes=[permissions.IsAuthenticated])
+    def toggle(self, request, target_id, *args, **kwargs):
+        """
+        PUT likes the target, DELETE unlikes it, both idempotent
+        """
+        if request.method == 'DELETE':
+            reviews.unlike(self.queryset.model, self.target_field, request.user.client, target_id)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        serializer = self.get_serializer(data={self.target_field: target_id})
+        serializer.is_valid(raise_exception=True)
+        like, created = reviews.like(self.queryset.model, self.target_field, request.user.client, int(target_id))
+        return self.like_response(like, created)
+
+
+# basename -> (url prefix, model, serializer, reviewed field), a viewset per entry
+REVIEWS = {
+    'like-restaurant': ('likes/restaurant', LikeRestaurant, RestaurantLikeSerializer, 'restaurant'),
+    'like-menu': ('likes/menu', LikeMenu, MenuLikeSerializer, 'menu'),
+    'like-delivery': ('likes/delivery', LikeDelivery, DeliveryLikeSerializer, 'delivery'),
+    'comment-restaurant': ('comments/restaurant', CommentRestaurant, RestaurantCommentSerializer, 'restaurant'),
+    'comment-menu': ('comments/menu', CommentMenu, MenuCommentSerializer, 'menu'),
+    'comment-delivery': ('comments/delivery', CommentDelivery, DeliveryCommentSerializer, 'delivery'),
+    'rate-restaurant': ('rate/restaurant', RateRestaurant, RestaurantRateSerializer, 'restaurant'),
+    'rate-menu': ('rate/menu', RateMenu, MenuRateSerializer, 'menu'),
+    'rate-delivery': ('rate/delivery', RateDelivery, DeliveryRateSerializer, 'delivery'),
+}
+
+
+def review_viewset(model, serializer_class, target_field):
+    base = LikeReviewViewSet if model in (LikeRestaurant, LikeMenu, LikeDelivery) else ReviewViewSet
+    return type(model.__name__ + 'ViewSet', (base,), {
+        'queryset': model.objects.all(),
+        'serializer_class': serializer_class,
+        'target_field': target_field,
+    })
+
+
+# basename -> (url prefix, viewset)
+VIEWSETS = {basename: (prefix, review_viewset(*review)) for basename, (prefix, *review) in REVIEWS.items()}
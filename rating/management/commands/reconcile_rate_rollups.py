@@ -0,0 +1,72 @@
+"""
+repairs the rating rollups (RestaurantRateRollup, MenuRateRollup, DeliveryRateRollup): creates the missing ones and
+recomputes the drifted ones from the rates, and their recent rates with --recent. they are maintained incrementally by the rating receivers in
+rating.models, and can drift when the rates are written without signals (bulk operations, raw sql, manual fixes).
+run it from a cron job.
+"""
+import math
+
+from django.core.management import BaseCommand
+
+from rating.models import RATE_ROLLUPS
+from rating.rollups import rollup_expressions, create_missing_rollups, rebuild_recent_rates, \
+    refresh_recent_rates
+
+
+def same(value, true_value) -> bool:
+    if isinstance(value, float) and isinstance(true_value, float):
+        return math.isclose(value, true_value, abs_tol=1e-6)
+    return value == true_value
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stars rollups of the restaurants, menus and delivery guys and fix the drifted ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report the drifted rollups')
+        parser.add_argument('--recent', action='store_true', help='rewrite the recent rates of every rollup too')
+        parser.add_argument('-b', '--batch-size', type=int, default=500, help='number of rollups per batch')
+
+    def reconcile(self, model, expressions, batch_size, dry_run):
+        """
+        compares the rollups to their true values batch by batch, and writes back the drifted ones
+        :return: (number of checked rollups, pks of the drifted rollups)
+        """
+        fields = list(expressions)
+        queryset = model.objects.annotate(**{'true_' + field: expression for field, expression in expressions.items()}) \
+            .only('pk', *fields).order_by('pk')
+        checked, drifted, last_pk = 0, [], 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            checked += len(batch)
+            fixed = []
+            for row in batch:
+                if not all(same(getattr(row, field), getattr(row, 'true_' + field)) for field in fields):
+                    for field in fields:
+                        setattr(row, field, getattr(row, 'true_' + field))
+                    fixed.append(row)
+            if fixed and not dry_run:
+                model.objects.bulk_update(fixed, fields)
+            drifted += [row.pk for row in fixed]
+        return checked, drifted
+
+    def handle(self, *args, **options):
+        for rate_model, (rollup_model, target_field) in RATE_ROLLUPS.items():
+            name = '{} rollup(s)'.format(target_field)
+            if not options['dry_run']:
+                missing = create_missing_rollups(rate_model, rollup_model, target_field)
+                for target_id in missing:
+                    refresh_recent_rates(rate_model, rollup_model, target_field, target_id)
+                if missing:
+                    print('{} {} created'.format(len(missing), name))
+            checked, drifted = self.reconcile(rollup_model, rollup_expressions(rate_model, target_field),
+                                              options['batch_size'], options['dry_run'])
+            print('{} {} checked, {} {}{}'.format(
+                checked, name, len(drifted), 'drifted' if options['dry_run'] else 'repaired',
+                ': ' + ', '.join(str(pk) for pk in drifted) if drifted else ''))
+            if options['recent'] and not options['dry_run']:
+                print('{} {} recent rates rewritten'.format(
+                    rebuild_recent_rates(rate_model, rollup_model, target_field), name))
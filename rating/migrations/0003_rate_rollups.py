@@ -0,0 +1,83 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from rating.rollups import rollup_expressions, create_missing_rollups
+
+
+def build_rollups(apps, schema_editor):
+    for rate, rollup, target_field in (('RateRestaurant', 'RestaurantRateRollup', 'restaurant'),
+                                       ('RateMenu', 'MenuRateRollup', 'menu'),
+                                       ('RateDelivery', 'DeliveryRateRollup', 'delivery')):
+        rate_model, rollup_model = apps.get_model('rating', rate), apps.get_model('rating', rollup)
+        create_missing_rollups(rate_model, rollup_model, target_field)
+        rollup_model.objects.update(**rollup_expressions(rate_model, target_field))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0002_auto_20200418_1325'),
+        ('restaurants', '0024_restaurant_image_sha256'),
+        ('rating', '0002_auto_20200709_1652'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryRateRollup',
+            fields=[
+                ('stars_count', models.IntegerField(default=0)),
+                ('stars_sum', models.FloatField(default=0)),
+                ('stars_avg', models.FloatField(blank=True, null=True)),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('delivery', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rate_rollup', serialize=False, to='delivery.DeliveryGuy')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='MenuRateRollup',
+            fields=[
+                ('stars_count', models.IntegerField(default=0)),
+                ('stars_sum', models.FloatField(default=0)),
+                ('stars_avg', models.FloatField(blank=True, null=True)),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('menu', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rate_rollup', serialize=False, to='restaurants.Menu')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='RestaurantRateRollup',
+            fields=[
+                ('stars_count', models.IntegerField(default=0)),
+                ('stars_sum', models.FloatField(default=0)),
+                ('stars_avg', models.FloatField(blank=True, null=True)),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('restaurant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rate_rollup', serialize=False, to='restaurants.Restaurant')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='restaurantraterollup',
+            index=models.Index(fields=['-stars_avg'], name='rating_rest_stars_a_9b9f7f_idx'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
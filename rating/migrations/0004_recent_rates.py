@@ -0,0 +1,50 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:54
+
+from django.db import migrations, models
+
+from rating.rollups import rebuild_recent_rates
+
+
+def build_recent_rates(apps, schema_editor):
+    for rate, rollup, target_field in (('RateRestaurant', 'RestaurantRateRollup', 'restaurant'),
+                                       ('RateMenu', 'MenuRateRollup', 'menu'),
+                                       ('RateDelivery', 'DeliveryRateRollup', 'delivery')):
+        rebuild_recent_rates(apps.get_model('rating', rate), apps.get_model('rating', rollup), target_field)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rating', '0003_rate_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryraterollup',
+            name='recent_rates',
+            field=models.TextField(default='[]'),
+        ),
+        migrations.AddField(
+            model_name='menuraterollup',
+            name='recent_rates',
+            field=models.TextField(default='[]'),
+        ),
+        migrations.AddField(
+            model_name='restaurantraterollup',
+            name='recent_rates',
+            field=models.TextField(default='[]'),
+        ),
+        migrations.AddIndex(
+            model_name='ratedelivery',
+            index=models.Index(fields=['delivery', '-created_at', '-id'], name='rating_rate_deliver_24f027_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ratemenu',
+            index=models.Index(fields=['menu', '-created_at', '-id'], name='rating_rate_menu_id_687a0e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='raterestaurant',
+            index=models.Index(fields=['restaurant', '-created_at', '-id'], name='rating_rate_restaur_c7eb85_idx'),
+        ),
+        migrations.RunPython(build_recent_rates, migrations.RunPython.noop),
+    ]
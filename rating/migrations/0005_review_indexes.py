@@ -0,0 +1,88 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:56
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def delete_duplicate_likes(apps, schema_editor):
+    # a client's repeated likes of a target, the first one is kept
+    for like, target_field in (('LikeRestaurant', 'restaurant'), ('LikeMenu', 'menu'), ('LikeDelivery', 'delivery')):
+        model = apps.get_model('rating', like)
+        duplicates = model.objects.order_by().values('client', target_field).annotate(count=Count('pk')) \
+            .filter(count__gt=1).values_list('client', target_field)
+        for client_id, target_id in duplicates:
+            likes = model.objects.filter(client=client_id, **{target_field: target_id}).order_by('pk')
+            likes.exclude(pk=likes.values_list('pk', flat=True)[0]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('delivery', '0002_auto_20200418_1325'),
+        ('restaurants', '0024_restaurant_image_sha256'),
+        ('rating', '0004_recent_rates'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_likes, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='likedelivery',
+            unique_together={('client', 'delivery')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='likemenu',
+            unique_together={('client', 'menu')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='likerestaurant',
+            unique_together={('client', 'restaurant')},
+        ),
+        migrations.AddIndex(
+            model_name='commentdelivery',
+            index=models.Index(fields=['delivery', '-created_at', '-id'], name='rating_comm_deliver_bcd693_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commentdelivery',
+            index=models.Index(fields=['client', 'delivery'], name='rating_comm_client__62d3ea_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commentmenu',
+            index=models.Index(fields=['menu', '-created_at', '-id'], name='rating_comm_menu_id_c0cd02_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commentmenu',
+            index=models.Index(fields=['client', 'menu'], name='rating_comm_client__032fef_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commentrestaurant',
+            index=models.Index(fields=['restaurant', '-created_at', '-id'], name='rating_comm_restaur_073384_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='commentrestaurant',
+            index=models.Index(fields=['client', 'restaurant'], name='rating_comm_client__7c1293_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='likedelivery',
+            index=models.Index(fields=['delivery', '-created_at', '-id'], name='rating_like_deliver_a6abb1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='likemenu',
+            index=models.Index(fields=['menu', '-created_at', '-id'], name='rating_like_menu_id_8fdd09_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='likerestaurant',
+            index=models.Index(fields=['restaurant', '-created_at', '-id'], name='rating_like_restaur_753c12_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ratedelivery',
+            index=models.Index(fields=['client', 'delivery'], name='rating_rate_client__bf50eb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ratemenu',
+            index=models.Index(fields=['client', 'menu'], name='rating_rate_client__3fc61b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='raterestaurant',
+            index=models.Index(fields=['client', 'restaurant'], name='rating_rate_client__b2a7f1_idx'),
+        ),
+    ]
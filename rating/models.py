@@ -1,11 +1,14 @@
-from django.db import models
+import json
+
+from django.db import models, transaction
 
 # Create your models here.
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, post_init
 from django.dispatch import receiver
 
-from base_backend.messaging import notify_user
-from base_backend.models import BaseModel, do_nothing
+from base_backend.models import BaseModel, do_nothing, cascade
+from notifications import digests
+from rating import rollups
 
 
 class AbstractBaseReview(BaseModel):
@@ -61,57 +64,212 @@ class BaseRestaurantReviews:
 class RateDelivery(AbstractBaseRate, BaseDeliveryReviews):
     delivery = models.ForeignKey('delivery.DeliveryGuy', on_delete=do_nothing, related_name="rates")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['delivery', '-created_at', '-id']),
+            models.Index(fields=['client', 'delivery']),
+        ]
+
 
 class RateRestaurant(AbstractBaseRate, BaseRestaurantReviews):
     restaurant = models.ForeignKey('restaurants.Restaurant', on_delete=do_nothing, related_name="rates")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['restaurant', '-created_at', '-id']),
+            models.Index(fields=['client', 'restaurant']),
+        ]
+
 
 class RateMenu(AbstractBaseRate, BaseMenuReviews):
     menu = models.ForeignKey('restaurants.Menu', on_delete=do_nothing, related_name="rates")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['menu', '-created_at', '-id']),
+            models.Index(fields=['client', 'menu']),
+        ]
+
+
+class BaseRateRollup(models.Model):
+    """
+    the stars of a target's rates: their number, sum and average, and how many rates gave each number of stars.
+    kept up to date by the receivers below, repaired by the reconcile_rate_rollups command. see rating.rollups
+    """
+    stars_count = models.IntegerField(default=0)
+    stars_sum = models.FloatField(default=0)
+    # null until the target is rated, like Avg
+    stars_avg = models.FloatField(null=True, blank=True)
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
+    # the latest RATING_RECENT_RATES rates, newest first, as serialized by rollups.recent_rates
+    recent_rates = models.TextField(default='[]')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def histogram(self) -> dict:
+        return {stars: getattr(self, field) for stars, field in enumerate(rollups.HISTOGRAM_FIELDS, 1)}
+
+    @property
+    def recent(self) -> list:
+        return json.loads(self.recent_rates)
+
+    @property
+    def summary(self) -> dict:
+        return {'count': self.stars_count, 'average': self.stars_avg, 'histogram': self.histogram}
+
+    def __str__(self):
+        return "{} rates of {}: {}".format(self.stars_count, self.pk, self.stars_avg)
+
+
+class RestaurantRateRollup(BaseRateRollup):
+    restaurant = models.OneToOneField('restaurants.Restaurant', on_delete=cascade, primary_key=True,
+                                      related_name='rate_rollup')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-stars_avg']),
+        ]
+
+
+class MenuRateRollup(BaseRateRollup):
+    menu = models.OneToOneField('restaurants.Menu', on_delete=cascade, primary_key=True, related_name='rate_rollup')
+
+
+class DeliveryRateRollup(BaseRateRollup):
+    delivery = models.OneToOneField('delivery.DeliveryGuy', on_delete=cascade, primary_key=True,
+                                    related_name='rate_rollup')
+
+
+# rate model -> (its rollup model, the rated field)
+RATE_ROLLUPS = {
+    RateRestaurant: (RestaurantRateRollup, 'restaurant'),
+    RateMenu: (MenuRateRollup, 'menu'),
+    RateDelivery: (DeliveryRateRollup, 'delivery'),
+}
+
 
 class CommentDelivery(BaseComment, BaseDeliveryReviews):
     delivery = models.ForeignKey('delivery.DeliveryGuy', on_delete=do_nothing, related_name="comments")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['delivery', '-created_at', '-id']),
+            models.Index(fields=['client', 'delivery']),
+        ]
+
 
 class CommentRestaurant(BaseComment, BaseRestaurantReviews):
     restaurant = models.ForeignKey('restaurants.Restaurant', on_delete=do_nothing, related_name="comments")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['restaurant', '-created_at', '-id']),
+            models.Index(fields=['client', 'restaurant']),
+        ]
+
 
 class CommentMenu(BaseComment, BaseMenuReviews):
     menu = models.ForeignKey('restaurants.Menu', on_delete=do_nothing, related_name="comment")
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['menu', '-created_at', '-id']),
+            models.Index(fields=['client', 'menu']),
+        ]
+
 
 class LikeDelivery(BaseLike, BaseDeliveryReviews):
     delivery = models.ForeignKey('delivery.DeliveryGuy', on_delete=do_nothing, related_name="likes")
 
+    class Meta:
+        # a client likes a target once, see rating.reviews.like
+        unique_together = ('client', 'delivery')
+        indexes = [
+            models.Index(fields=['delivery', '-created_at', '-id']),
+        ]
+
 
 class LikeRestaurant(BaseLike, BaseRestaurantReviews):
     restaurant = models.ForeignKey('restaurants.Restaurant', on_delete=do_nothing, related_name="likes")
 
+    class Meta:
+        # a client likes a target once, see rating.reviews.like
+        unique_together = ('client', 'restaurant')
+        indexes = [
+            models.Index(fields=['restaurant', '-created_at', '-id']),
+        ]
+
 
 class LikeMenu(BaseLike, BaseMenuReviews):
     menu = models.ForeignKey('restaurants.Menu', on_delete=do_nothing, related_name="likes")
 
+    class Meta:
+        # a client likes a target once, see rating.reviews.like
+        unique_together = ('client', 'menu')
+        indexes = [
+            models.Index(fields=['menu', '-created_at', '-id']),
+        ]
+
+
+@receiver(post_init, sender=RateRestaurant)
+@receiver(post_init, sender=RateMenu)
+@receiver(post_init, sender=RateDelivery)
+def mark_rate_previous_value(sender, instance, **kwargs):
+    instance.previous_value = (getattr(instance, RATE_ROLLUPS[sender][1] + '_id'), instance.stars)
+
+
+@receiver(post_save, sender=RateRestaurant)
+@receiver(post_save, sender=RateMenu)
+@receiver(post_save, sender=RateDelivery)
+def roll_up_rate(sender, instance, created, **kwargs):
+    rollup_model, field = RATE_ROLLUPS[sender]
+    target_id, stars = instance.previous_value
+    new_target_id = getattr(instance, field + '_id')
+    with transaction.atomic():
+        if created:
+            rollups.update_rollup(rollup_model, new_target_id, added=[instance.stars])
+        elif target_id != new_target_id:
+            rollups.update_rollup(rollup_model, target_id, removed=[stars])
+            rollups.update_rollup(rollup_model, new_target_id, added=[instance.stars])
+        elif stars != instance.stars:
+            rollups.update_rollup(rollup_model, target_id, added=[instance.stars], removed=[stars])
+        # a new comment changes the recent rates too
+        for target in {target_id, new_target_id}:
+            rollups.refresh_recent_rates(sender, rollup_model, field, target)
+    instance.previous_value = (new_target_id, instance.stars)
+
+
+@receiver(post_delete, sender=RateRestaurant)
+@receiver(post_delete, sender=RateMenu)
+@receiver(post_delete, sender=RateDelivery)
+def unroll_rate(sender, instance, **kwargs):
+    rollup_model, field = RATE_ROLLUPS[sender]
+    target_id, stars = instance.previous_value
+    with transaction.atomic():
+        rollups.update_rollup(rollup_model, target_id, removed=[stars])
+        rollups.refresh_recent_rates(sender, rollup_model, field, target_id)
+
 
 @receiver(post_save, sender=CommentRestaurant)
 def notify_restaurant_comment(sender, instance, created, raw, **kwargs):
-    if created:
-        notify_user(instance.restaurant.owner.notification_token,
-                    {'title': 'New comment', 'message': 'Someone commented on your restaurant'})
+    if created and not raw:
+        digests.add_event(digests.RESTAURANT_COMMENT, instance.restaurant_id)
 
 
 @receiver(post_save, sender=CommentDelivery)
 def notify_delivery_comment(sender, instance, created, raw, **kwargs):
-    if created:
-        notify_user(instance.delivery.owner.notification_token,
-                    {'title': 'New comment', 'message': 'Someone commented on your restaurant'})
-    pass
+    if created and not raw:
+        digests.add_event(digests.DELIVERY_COMMENT, instance.delivery_id)
 
 
 @receiver(post_save, sender=CommentMenu)
 def notify_menu_comment(sender, instance, created, raw, **kwargs):
-    if created:
-        notify_user(instance.menu.offered_by.owner.notification_token,
-                    {'title': 'New comment', 'message': 'Someone commented on your restaurant'})
-    pass
\ No newline at end of file
+    if created and not raw:
+        digests.add_event(digests.MENU_COMMENT, instance.menu_id)
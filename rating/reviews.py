@@ -0,0 +1,64 @@
+"""
+the rating engine: the likes, comments and rates of the restaurants, menus and delivery guys are nine tables of the
+same shape (a client, a target, a date), served by the viewsets rating.apis generates from its REVIEWS table.
+a target's reviews are read newest first from the (target, -created_at, -id) indexes, and a client's reviews of a
+list of targets from the (client, target) ones, in one query whatever the number of targets.
+a client likes a target once: like and unlike can be repeated, they upsert and delete on the (client, target)
+unique constraint of the likes tables.
+"""
+from django.db import transaction, IntegrityError
+
+
+def target_reviews(model, target_field, target_id):
+    """
+    :param model: a likes, comments or rates model
+    :param target_field: the reviewed field of the model
+    :param target_id: the reviewed restaurant, menu or delivery guy id
+    :return: the target's reviews with their clients and their users, newest first
+    """
+    return model.objects.filter(**{target_field: target_id}).select_related('client__owner') \
+        .order_by('-created_at', '-id')
+
+
+def client_reviews(model, target_field, client, target_ids) -> dict:
+    """
+    :param model: a likes, comments or rates model
+    :param target_field: the reviewed field of the model
+    :param client: the reviewing Client (instance or id)
+    :param target_ids: the ids of the targets, a list screen's
+    :return: target id -> the stars of the client's latest rate of the target for the rates, whether the client liked
+     or commented it for the likes and comments
+    """
+    target_ids = set(target_ids)
+    reviews = model.objects.filter(client=client, **{target_field + '__in': target_ids}).order_by()
+    if not hasattr(model, 'stars'):
+        reviewed = set(reviews.values_list(target_field, flat=True))
+        return {target_id: target_id in reviewed for target_id in target_ids}
+    stars = dict.fromkeys(target_ids)
+    # the latest rate last, it overwrites the older ones
+    for target_id, value in reviews.order_by('created_at', 'id').values_list(target_field, 'stars'):
+        stars[target_id] = value
+    return stars
+
+
+def like(model, target_field, client, target_id):
+    """
+    :param model: a likes model
+    :return: (the client's like of the target, whether it has been created)
+    """
+    lookup = {'client': client, target_field + '_id': target_id}
+    try:
+        with transaction.atomic():
+            return model.objects.get_or_create(**lookup)
+    except IntegrityError:
+        # liked concurrently
+        return model.objects.get(**lookup), False
+
+
+def unlike(model, target_field, client, target_id) -> bool:
+    """
+    :param model: a likes model
+    :return: whether the client liked the target
+    """
+    deleted, _ = model.objects.filter(client=client, **{target_field: target_id}).delete()
+    return bool(deleted)
@@ -0,0 +1,151 @@
+"""
+the rating rollups: the number, sum, average and histogram of the stars of a restaurant's, a menu's or a delivery
+guy's rates and its latest rates, one row per rated target (RestaurantRateRollup, MenuRateRollup, DeliveryRateRollup),
+so the serializers, the recommendations and the home feed read a column instead of aggregating the rates, and a
+restaurant embeds its latest rates instead of its whole history.
+the receivers of rating.models add a rate to its target's rollup in the transaction writing it, the
+reconcile_rate_rollups command repairs the rollups of the rates written without signals (bulk operations, raw sql).
+"""
+import json
+
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q, OuterRef, Subquery, Count, Sum, Avg, Value, IntegerField, FloatField, \
+    ExpressionWrapper
+from django.db.models.functions import Coalesce, NullIf
+from rest_framework.utils.encoders import JSONEncoder
+
+HISTOGRAM_FIELDS = ('stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5')
+# the fields of the recent rates, those of the rating.serializers rate serializers
+RECENT_FIELDS = ('id', 'stars', 'comment', 'created_at', 'client')
+
+
+def _recent_count() -> int:
+    return getattr(settings, 'RATING_RECENT_RATES', 5)
+
+
+def star_field(stars) -> str:
+    """
+    :param stars: the stars of a rate, a float
+    :return: the histogram column counting it: the stars rounded half up, between 1 and 5
+    """
+    return HISTOGRAM_FIELDS[min(5, max(1, int(stars + 0.5))) - 1]
+
+
+def _star_filter(field) -> Q:
+    # the rates star_field counts in the column
+    stars = HISTOGRAM_FIELDS.index(field) + 1
+    condition = Q()
+    if stars > 1:
+        condition &= Q(stars__gte=stars - 0.5)
+    if stars < 5:
+        condition &= Q(stars__lt=stars + 0.5)
+    return condition
+
+
+def average():
+    return ExpressionWrapper(F('stars_sum') / NullIf(F('stars_count'), 0), output_field=FloatField())
+
+
+def increments(added=(), removed=()) -> dict:
+    """
+    :param added: the stars of the rates added to a target
+    :param removed: the stars of the rates removed from it
+    :return: rollup column -> value to add
+    """
+    values = {'stars_count': len(added) - len(removed), 'stars_sum': sum(added) - sum(removed)}
+    for stars, sign in [(stars, 1) for stars in added] + [(stars, -1) for stars in removed]:
+        field = star_field(stars)
+        values[field] = values.get(field, 0) + sign
+    return {field: value for field, value in values.items() if value}
+
+
+def update_rollup(rollup_model, target_id, added=(), removed=()):
+    """
+    adds the increments to the target's rollup in one atomic UPDATE, concurrent rates can't lose a count, then
+    recomputes its average. the rollup is created by the target's first rate
+    :param rollup_model: RestaurantRateRollup, MenuRateRollup or DeliveryRateRollup
+    :param target_id: the rated restaurant, menu or delivery guy id
+    :param added: the stars of the rates added to the target
+    :param removed: the stars of the rates removed from it
+    """
+    values = increments(added, removed)
+    if not values:
+        return
+    rollup = rollup_model.objects.filter(pk=target_id)
+    with transaction.atomic():
+        if not rollup.update(**{field: F(field) + value for field, value in values.items()}):
+            # without a rollup to remove the rates from, it drifted: reconcile_rate_rollups recomputes it
+            if values.get('stars_count', 0) <= 0:
+                return
+            try:
+                with transaction.atomic():
+                    rollup_model.objects.create(pk=target_id, **values)
+            except IntegrityError:
+                # created by a concurrent rate
+                rollup.update(**{field: F(field) + value for field, value in values.items()})
+        rollup.update(stars_avg=average())
+
+
+def recent_rates(rate_model, target_field, target_id) -> str:
+    """
+    :return: the target's latest rates, newest first, serialized to json
+    """
+    rates = rate_model.objects.filter(**{target_field: target_id}).order_by('-created_at', '-pk') \
+        .values(*RECENT_FIELDS)[:_recent_count()]
+    return json.dumps([dict(rate, **{target_field: target_id}) for rate in rates], cls=JSONEncoder)
+
+
+def refresh_recent_rates(rate_model, rollup_model, target_field, target_id):
+    """
+    rewrites the target's recent rates, from the index on its rates' creation dates
+    """
+    rollup_model.objects.filter(pk=target_id).update(recent_rates=recent_rates(rate_model, target_field, target_id))
+
+
+def rebuild_recent_rates(rate_model, rollup_model, target_field) -> int:
+    """
+    rewrites the recent rates of every rollup, a query per target
+    :return: the number of rollups
+    """
+    targets = list(rollup_model.objects.order_by('pk').values_list('pk', flat=True))
+    for target_id in targets:
+        refresh_recent_rates(rate_model, rollup_model, target_field, target_id)
+    return len(targets)
+
+
+def _aggregate(rate_model, target_field, aggregate, output_field, default):
+    rows = rate_model.objects.filter(**{target_field: OuterRef('pk')}).order_by().values(target_field) \
+        .annotate(value=aggregate).values('value')
+    if default is None:
+        return Subquery(rows, output_field=output_field)
+    return Coalesce(Subquery(rows, output_field=output_field), Value(default), output_field=output_field)
+
+
+def rollup_expressions(rate_model, target_field) -> dict:
+    """
+    the models are parameters so the migrations can pass their historical models
+    :param rate_model: RateRestaurant, RateMenu or RateDelivery
+    :param target_field: the rated field of the rate model
+    :return: rollup column -> expression computing its true value for the outer rollup
+    """
+    expressions = {
+        'stars_count': _aggregate(rate_model, target_field, Count('pk'), IntegerField(), 0),
+        'stars_sum': _aggregate(rate_model, target_field, Sum('stars'), FloatField(), 0.0),
+        'stars_avg': _aggregate(rate_model, target_field, Avg('stars'), FloatField(), None),
+    }
+    for field in HISTOGRAM_FIELDS:
+        expressions[field] = _aggregate(rate_model, target_field, Count('pk', filter=_star_filter(field)),
+                                        IntegerField(), 0)
+    return expressions
+
+
+def create_missing_rollups(rate_model, rollup_model, target_field) -> list:
+    """
+    creates the empty rollups of the rated targets without one, to be filled by rollup_expressions
+    :return: the ids of their targets
+    """
+    missing = list(rate_model.objects.exclude(**{target_field + '__in': rollup_model.objects.values('pk')})
+                   .order_by().values_list(target_field, flat=True).distinct())
+    rollup_model.objects.bulk_create([rollup_model(pk=target_id) for target_id in missing])
+    return missing
@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 
 from rating.models import RateRestaurant, LikeRestaurant, CommentRestaurant, CommentMenu, LikeMenu, RateMenu, \
@@ -5,93 +6,100 @@ from rating.models import RateRestaurant, LikeRestaurant, CommentRestaurant, Com
 from restaurants.serializers import ClientSerializer
 
 
-class RestaurantRateSerializer(serializers.ModelSerializer):
-    # client = ClientSerializer()
+class ReviewSerializer(serializers.ModelSerializer):
+    """
+    a like, comment or rate, by the client of the authenticated user (see rating.apis.ReviewViewSet.perform_create)
+    """
 
     class Meta:
-        model = RateRestaurant
-        fields = ['id', 'stars', 'comment', 'created_at', 'client', 'restaurant']
         extra_kwargs = {
             'created_at': {'read_only': True},
-            'id': {'read_only': True}
+            'id': {'read_only': True},
+            'client': {'read_only': True},
         }
 
 
-class RestaurantLikeSerializer(serializers.ModelSerializer):
-    class Meta:
+class RestaurantRateSerializer(ReviewSerializer):
+    # client = ClientSerializer()
+
+    class Meta(ReviewSerializer.Meta):
+        model = RateRestaurant
+        fields = ['id', 'stars', 'comment', 'created_at', 'client', 'restaurant']
+
+
+class RestaurantLikeSerializer(ReviewSerializer):
+    class Meta(ReviewSerializer.Meta):
         model = LikeRestaurant
         fields = ['restaurant', 'client', 'id', 'created_at']
-        extra_kwargs = {
-            'created_at': {'read_only': True},
-            'id': {'read_only': True}
-        }
 
 
-class RestaurantCommentSerializer(serializers.ModelSerializer):
-    class Meta:
+class RestaurantCommentSerializer(ReviewSerializer):
+    class Meta(ReviewSerializer.Meta):
         model = CommentRestaurant
         fields = ['restaurant', 'client', 'id', 'created_at', 'comment']
-        extra_kwargs = {
-            'created_at': {'read_only': True},
-            'id': {'read_only': True}
-        }
 
 
-class MenuRateSerializer(serializers.ModelSerializer):
-    class Meta:
+class MenuRateSerializer(ReviewSerializer):
+    class Meta(ReviewSerializer.Meta):
         model = RateMenu
         fields = ['id', 'stars', 'comment', 'created_at', 'client', 'menu']
-        extra_kwargs = {
-            'created_at': {'read_only': True},
-            'id': {'read_only': True}
-        }
 
 
-class MenuLikeSerializer(serializers.ModelSerializer):
-    class Meta:
+class MenuLikeSerializer(ReviewSerializer):
+    class Meta(ReviewSerializer.Meta):
         model = LikeMenu
         fields = ['menu', 'client', 'id', 'created_at']
-        extra_kwargs = {
-            'created_at': {'read_only': True},
-            'id': {'read_only': True}
-        }
 
 
-class MenuCommentSerializer(serializers.ModelSerializer):
-    class Meta:
+class MenuCommentSerializer(ReviewSerializer):
+    class Meta(ReviewSerializer.Meta):
         model = CommentMenu
         fields = ['menu', 'client', 'id', 'created_at', 'comment']
-        extra_kwargs = {
-            'created_at': {'read_only': True},
-            'id': {'read_only': True}
-        }
 
 
-class DeliveryRateSerializer(serializers.ModelSerializer):
-    class Meta:
+class DeliveryRateSerializer(ReviewSerializer):
+    class Meta(ReviewSerializer.Meta):
         model = RateDelivery
         fields = ['id', 'stars', 'comment', 'created_at', 'client', 'delivery']
-        extra_kwargs = {
-            'created_at': {'read_only': True},
-            'id': {'read_only': True}
-        }
 
 
-class DeliveryLikeSerializer(serializers.ModelSerializer):
-    class Meta:
+class DeliveryLikeSerializer(ReviewSerializer):
+    class Meta(ReviewSerializer.Meta):
         model = LikeDelivery
         fields = ['delivery', 'client', 'id', 'created_at']
-        extra_kwargs = {
-            'created_at': {'read_only': True},
-            'id': {'read_only': True}
-        }
 
 
-class DeliveryCommentSerializer(serializers.ModelSerializer):
-    class Meta:
+class DeliveryCommentSerializer(ReviewSerializer):
+    class Meta(ReviewSerializer.Meta):
         model = CommentDelivery
         fields = ['delivery', 'client', 'id', 'created_at', 'comment']
-        extra_kwargs = {
-            'created_at': {'read_only': True},
-            'id': {'read_only': True}
-        }
+
+
+class TargetQuerySerializer(serializers.Serializer):
+    """
+    the reviewed target of a listing, its field is added per target by for_target
+    """
+
+    def create(self, validated_data):
+        pass
+
+    def update(self, instance, validated_data):
+        pass
+
+    @classmethod
+    def for_target(cls, target_field, required=True):
+        return type(cls.__name__, (cls,), {target_field: serializers.IntegerField(min_value=1, required=required)})
+
+
+class TargetIdsQuerySerializer(serializers.Serializer):
+    """
+    the targets of a list screen, as repeated ids: ?ids=1&ids=2
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), min_length=1,
+                                max_length=getattr(settings, 'RATING_MAX_LOOKUP_IDS', 100))
+
+    def create(self, validated_data):
+        pass
+
+    def update(self, instance, validated_data):
+        pass
@@ -1,3 +1,167 @@
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from rating.models import RateRestaurant, RateMenu, RestaurantRateRollup, MenuRateRollup, CommentRestaurant, \
+    LikeRestaurant
+from restaurants import feed
+from restaurants.models import City, Client, MealType, Menu, OfferType, Restaurant, User, Wilaya
+
+
+class RateRollupTestCase(TestCase):
+    def setUp(self) -> None:
+        owner = User.objects.create(username="TesterRestaurantOwner", first_name="tester_name",
+                                    last_name="tester_name", phone="+213899136334", user_type="O")
+        self.client_profile = Client.objects.create(
+            owner=User.objects.create(username="Tester", first_name="tester_name", last_name="tester_name",
+                                      phone="+213899136333", user_type="C"))
+        city = City.objects.create(wilaya=Wilaya.objects.create(name="test", matricule=1, code_postal=10),
+                                   name="test", code_postal=19)
+        self.restaurants = [
+            Restaurant.objects.create(name="test {}".format(i), registre_commerce="rc{}".format(i),
+                                      id_fiscale="if{}".format(i), latitude=15.03, longitude=5.02, main_user=owner,
+                                      address="dfqsdfqsdfqsdf", city=city, images="rollup-{}".format(i))
+            for i in range(3)]
+        self.menu = Menu.objects.create(number=1, name="test", description="test", price=100.0,
+                                        offered_by=self.restaurants[0], type=MealType.objects.create(type="test"),
+                                        offer=OfferType.objects.create(type="test"))
+
+    def rate(self, restaurant, *stars):
+        return [RateRestaurant.objects.create(client=self.client_profile, restaurant=restaurant, stars=value)
+                for value in stars]
+
+    def assertRollup(self, rollup_model, target, count, total, histogram):
+        rollup = rollup_model.objects.get(pk=target.pk)
+        self.assertEqual((rollup.stars_count, rollup.stars_sum), (count, total))
+        self.assertEqual(rollup.stars_avg, total / count if count else None)
+        self.assertEqual(rollup.histogram, histogram)
+
+    def test_rollups_follow_the_rates(self):
+        rates = self.rate(self.restaurants[0], 5, 4, 4.5)
+        self.assertRollup(RestaurantRateRollup, self.restaurants[0], 3, 13.5, {1: 0, 2: 0, 3: 0, 4: 1, 5: 2})
+
+        rates[0].stars = 1
+        rates[0].save()
+        self.assertRollup(RestaurantRateRollup, self.restaurants[0], 3, 9.5, {1: 1, 2: 0, 3: 0, 4: 1, 5: 1})
+
+        rates[1].restaurant = self.restaurants[1]
+        rates[1].save()
+        self.assertRollup(RestaurantRateRollup, self.restaurants[0], 2, 5.5, {1: 1, 2: 0, 3: 0, 4: 0, 5: 1})
+        self.assertRollup(RestaurantRateRollup, self.restaurants[1], 1, 4, {1: 0, 2: 0, 3: 0, 4: 1, 5: 0})
+
+        RateRestaurant.objects.get(pk=rates[1].pk).delete()
+        self.assertRollup(RestaurantRateRollup, self.restaurants[1], 0, 0, {1: 0, 2: 0, 3: 0, 4: 0, 5: 0})
+
+        RateMenu.objects.create(client=self.client_profile, menu=self.menu, stars=2)
+        self.assertRollup(MenuRateRollup, self.menu, 1, 2, {1: 0, 2: 1, 3: 0, 4: 0, 5: 0})
+
+    def test_reconcile_repairs_the_rollups(self):
+        self.rate(self.restaurants[0], 5, 3)
+        RateRestaurant.objects.bulk_create([RateRestaurant(client=self.client_profile, restaurant=self.restaurants[1],
+                                                           stars=2)])
+        RestaurantRateRollup.objects.filter(pk=self.restaurants[0].pk).update(stars_count=7, stars_5=0)
+
+        call_command('reconcile_rate_rollups')
+        self.assertRollup(RestaurantRateRollup, self.restaurants[0], 2, 8, {1: 0, 2: 0, 3: 1, 4: 0, 5: 1})
+        self.assertRollup(RestaurantRateRollup, self.restaurants[1], 1, 2, {1: 0, 2: 1, 3: 0, 4: 0, 5: 0})
+
+    def test_consumers_read_the_rollups(self):
+        self.rate(self.restaurants[1], 5, 4)
+        self.rate(self.restaurants[2], 2)
+        RateMenu.objects.create(client=self.client_profile, menu=self.menu, stars=3)
+        self.assertEqual(feed.build_pool(feed.RECOMMENDED)[:2], [self.restaurants[1].pk, self.restaurants[2].pk])
+
+        response = self.client.get('/api/restaurants/recommended-offers/')
+        self.assertEqual([restaurant['rate'] for restaurant in response.data], [4.5, 2, None])
+        self.assertEqual(response.data[2]['menus'][0]['rate'], 3)
+
+    @override_settings(RATING_RECENT_RATES=2)
+    def test_restaurants_embed_their_latest_rates(self):
+        rates = self.rate(self.restaurants[0], 5, 4, 3)
+        rates[1].comment = "good"
+        rates[1].save()
+
+        response = self.client.get('/api/restaurants/{}/'.format(self.restaurants[0].pk))
+        self.assertEqual([(rate['id'], rate['comment']) for rate in response.data['rates']],
+                         [(rates[2].pk, None), (rates[1].pk, "good")])
+        self.assertEqual(response.data['rates'][0]['restaurant'], self.restaurants[0].pk)
+        self.assertEqual(response.data['rates_summary'],
+                         {'count': 3, 'average': 4, 'histogram': {1: 0, 2: 0, 3: 1, 4: 1, 5: 1}})
+
+        RateRestaurant.objects.get(pk=rates[2].pk).delete()
+        response = self.client.get('/api/restaurants/{}/'.format(self.restaurants[0].pk))
+        self.assertEqual([rate['id'] for rate in response.data['rates']], [rates[1].pk, rates[0].pk])
+
+        response = self.client.get('/api/restaurants/{}/'.format(self.restaurants[1].pk))
+        self.assertEqual((response.data['rates'], response.data['rates_summary']['count']), ([], 0))
+
+    def test_reviews_are_paginated_per_restaurant(self):
+        rates = self.rate(self.restaurants[0], 5, 4, 3)
+        self.rate(self.restaurants[1], 2)
+
+        response = self.client.get('/rating/api/rate/restaurant/reviews/', {'restaurant': self.restaurants[0].pk,
+                                                                             'page_size': 2})
+        self.assertEqual([rate['id'] for rate in response.data['results']], [rates[2].pk, rates[1].pk])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([rate['id'] for rate in response.data['results']], [rates[0].pk])
+        self.assertIsNone(response.data['next'])
+
+        self.assertEqual(self.client.get('/rating/api/rate/restaurant/reviews/').status_code, 400)
+
+
+class ReviewApiTestCase(TestCase):
+    def setUp(self) -> None:
+        owner = User.objects.create(username="TesterRestaurantOwner", first_name="tester_name",
+                                    last_name="tester_name", phone="+213899136334", user_type="O")
+        self.user = User.objects.create(username="Tester", first_name="tester_name", last_name="tester_name",
+                                        phone="+213899136333", user_type="C")
+        self.client_profile = Client.objects.create(owner=self.user)
+        city = City.objects.create(wilaya=Wilaya.objects.create(name="test", matricule=1, code_postal=10),
+                                   name="test", code_postal=19)
+        self.restaurants = [
+            Restaurant.objects.create(name="test {}".format(i), registre_commerce="rc{}".format(i),
+                                      id_fiscale="if{}".format(i), latitude=15.03, longitude=5.02, main_user=owner,
+                                      address="dfqsdfqsdfqsdf", city=city, images="reviews-{}".format(i))
+            for i in range(3)]
+        self.client.force_login(self.user)
+
+    def test_reviews_are_created_for_the_user_client(self):
+        response = self.client.post('/rating/api/comments/restaurant/',
+                                    {'restaurant': self.restaurants[0].pk, 'comment': 'good', 'client': 0})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(CommentRestaurant.objects.get().client, self.client_profile)
+
+    def test_listing_is_filtered_by_target(self):
+        for restaurant in self.restaurants[:2]:
+            CommentRestaurant.objects.create(client=self.client_profile, restaurant=restaurant, comment='good')
+        response = self.client.get('/rating/api/comments/restaurant/', {'restaurant': self.restaurants[1].pk})
+        self.assertEqual([comment['restaurant'] for comment in response.data], [self.restaurants[1].pk])
+        self.assertEqual(len(self.client.get('/rating/api/comments/restaurant/').data), 2)
+
+    def test_likes_are_idempotent(self):
+        url = '/rating/api/likes/restaurant/target/{}/'.format(self.restaurants[0].pk)
+        self.assertEqual(self.client.put(url).status_code, 201)
+        self.assertEqual(self.client.put(url).status_code, 200)
+        self.assertEqual(self.client.post('/rating/api/likes/restaurant/',
+                                          {'restaurant': self.restaurants[0].pk}).status_code, 200)
+        self.assertEqual(LikeRestaurant.objects.count(), 1)
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(LikeRestaurant.objects.exists())
+
+    def test_my_reviews_of_a_list_in_one_query(self):
+        LikeRestaurant.objects.create(client=self.client_profile, restaurant=self.restaurants[1])
+        RateRestaurant.objects.create(client=self.client_profile, restaurant=self.restaurants[0], stars=2)
+        RateRestaurant.objects.create(client=self.client_profile, restaurant=self.restaurants[0], stars=4)
+        ids = {'ids': [restaurant.pk for restaurant in self.restaurants]}
+
+        self.client.get('/rating/api/likes/restaurant/mine/', ids)
+        with self.assertNumQueries(4):
+            # the session, its user and the client, then the likes
+            response = self.client.get('/rating/api/likes/restaurant/mine/', ids)
+        self.assertEqual(response.data, {self.restaurants[0].pk: False, self.restaurants[1].pk: True,
+                                         self.restaurants[2].pk: False})
+        response = self.client.get('/rating/api/rate/restaurant/mine/', ids)
+        self.assertEqual(response.data, {self.restaurants[0].pk: 4, self.restaurants[1].pk: None,
+                                         self.restaurants[2].pk: None})
+        self.assertEqual(self.client.get('/rating/api/rate/restaurant/mine/').status_code, 400)
@@ -1,17 +1,26 @@
-from django.db.models import Avg, Sum
+from django.core.exceptions import ObjectDoesNotExist
 from django.shortcuts import get_list_or_404
 from rest_framework import permissions, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, NotFound
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
 from base_backend import permissions as my_perms
+from base_backend.apis import QueryPlanMixin
+from base_backend.pagination import FeedCursorPagination, RequiredPageNumberPagination
+from recipe import leaderboard, facets, viewer
+from recipe.details import get_recipe_details
 from recipe.models import Step, Recipe, IngredientType, Ingredient, QuantityMeasure, Like, Comment, StarsRate, Contains, \
     Participant, CustomContains
 from recipe.serializers import StepSerializer, RecipeSerializer, IngredientTypeSerializer, IngredientSerializer, \
     QuantityMeasureSerializer, LikeSerializer, CommentSerializer, StarsRateSerializer, ContainsSerializer, \
-    ParticipantSerializer, CustomContainsSerializer
+    ParticipantSerializer, CustomContainsSerializer, StepsBulkWriteSerializer, CustomContainsBulkWriteSerializer, \
+    RecipeDetailsSerializer, IngredientsLookupSerializer, RecipeMatchSerializer, RecipeFilterSerializer, \
+    RecipeSummarySerializer, RecipeIdsSerializer, RecipeDetailsQuerySerializer, LeaderboardQuerySerializer, \
+    RankQuerySerializer
+from search import ingredients
 
 
 class StepViewSet(ModelViewSet):
@@ -58,10 +67,119 @@ class StepViewSet(ModelViewSet):
         return super(StepViewSet, self).get_serializer(many=False, *args, **kwargs)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(QueryPlanMixin, ModelViewSet):
     serializer_class = RecipeSerializer
     queryset = Recipe.objects.all().order_by('-created_at')
+    query_plans = {
+        'default': RecipeSerializer.setup_eager_loading,
+        'bulk_steps': lambda queryset: queryset.select_related('published_by__profile'),
+        'bulk_ingredients': lambda queryset: queryset.select_related('published_by__profile'),
+    }
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = FeedCursorPagination
+
+    def add_viewer_state(self, recipes):
+        """
+        adds the viewer's state of each recipe under viewer_state when asked with ?include=viewer_state
+        :param recipes: the serialized recipes of a list
+        :return: recipes
+        """
+        include = ','.join(self.request.query_params.getlist('include')).split(',')
+        if 'viewer_state' in include:
+            states = viewer.get_viewer_state(self.request.user, [recipe['id'] for recipe in recipes])
+            for recipe in recipes:
+                recipe['viewer_state'] = states[recipe['id']]
+        return recipes
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.add_viewer_state(self.get_serializer(page, many=True).data))
+        return Response(self.add_viewer_state(self.get_serializer(queryset, many=True).data))
+
+    @action(detail=False, url_path='viewer-state', permission_classes=[permissions.IsAuthenticated])
+    def viewer_state(self, request, *args, **kwargs):
+        """
+        whether the user liked and rated each recipe of ?ids (repeated) and the stars, for a feed at once
+        """
+        query = RecipeIdsSerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(viewer.get_viewer_state(request.user, query.validated_data['ids']))
+
+    def bulk_write(self, write_serializer_class, items, item_serializer_class):
+        """
+        applies the bulk write of the request to the recipe's items, see RecipeItemsBulkWriteSerializer
+        :return: the number of created, updated and deleted items and the recipe's items after the write
+        """
+        recipe = self.get_object()
+        if recipe.published_by.profile.owner_id != self.request.user.pk:
+            raise PermissionDenied()
+        serializer = write_serializer_class(data=self.request.data, context={'recipe': recipe})
+        serializer.is_valid(raise_exception=True)
+        counts = serializer.save()
+        counts[items] = item_serializer_class(getattr(recipe, items).order_by('pk'), many=True,
+                                              context=self.get_serializer_context()).data
+        return Response(counts)
+
+    @action(detail=True)
+    def full(self, request, *args, **kwargs):
+        """
+        the recipe with its steps, ingredients and pictures, its author's summary and recipes, and the viewer's
+        like and rate, in a fixed number of queries. ?recipes: the number of the author's recipes, 10 by default
+        """
+        query = RecipeDetailsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        details = get_recipe_details(kwargs[self.lookup_url_kwarg or self.lookup_field], request.user,
+                                     author_recipes=query.validated_data['recipes'])
+        return Response(RecipeDetailsSerializer(details, context=self.get_serializer_context()).data)
+
+    @action(detail=False, url_path='filter')
+    def filter_recipes(self, request, *args, **kwargs):
+        """
+        the recipes filtered on ?wilaya, ?cuisine and ?type and sorted by ?order (popularity, rating, recent),
+        paginated, with the numbers of recipes per cuisine and per wilaya under facets
+        """
+        arguments = RecipeFilterSerializer(data=request.query_params)
+        arguments.is_valid(raise_exception=True)
+        arguments = arguments.get_filter_arguments()
+        queryset = facets.filter_recipes(Recipe.objects.with_counters(), **arguments)
+        paginator = RequiredPageNumberPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        response = paginator.get_paginated_response(self.add_viewer_state(
+            RecipeSummarySerializer(page, many=True, context=self.get_serializer_context()).data))
+        arguments.pop('order')
+        response.data['facets'] = {facet: [dict(id=pk, count=count) for pk, count in counts.items()]
+                                   for facet, counts in facets.facet_counts(**arguments).items()}
+        return response
+
+    @action(detail=False, url_path='by-ingredients')
+    def by_ingredients(self, request, *args, **kwargs):
+        """
+        what can be cooked with ?have (repeated): the recipes missing at most ?missing of their ingredients, and
+        containing every ?require (repeated), by fewest missing ingredients. ?limit: 20 by default
+        """
+        lookup = IngredientsLookupSerializer(data=request.query_params)
+        lookup.is_valid(raise_exception=True)
+        matches = ingredients.lookup(**lookup.validated_data)
+        recipes = Recipe.objects.filter(published_by__profile__owner__is_active=True).with_counters() \
+            .in_bulk([match.recipe_id for match in matches])
+        results = []
+        for match in matches:
+            if match.recipe_id in recipes:
+                recipe = recipes[match.recipe_id]
+                recipe.matched, recipe.missing = match.matched, match.missing
+                results.append(recipe)
+        return Response(self.add_viewer_state(
+            RecipeMatchSerializer(results, many=True, context=self.get_serializer_context()).data))
+
+    @action(detail=True, methods=['post'], url_path='steps/bulk')
+    def bulk_steps(self, request, *args, **kwargs):
+        return self.bulk_write(StepsBulkWriteSerializer, 'steps', StepSerializer)
+
+    @action(detail=True, methods=['post'], url_path='ingredients/bulk')
+    def bulk_ingredients(self, request, *args, **kwargs):
+        return self.bulk_write(CustomContainsBulkWriteSerializer, 'custom_contains', CustomContainsSerializer)
 
     def create(self, request, *args, **kwargs):
         request.data['published_by'] = Participant.objects.get(profile__owner__id=request.data['published_by']).pk
@@ -163,6 +281,7 @@ class LikeViewSet(ModelViewSet):
     serializer_class = LikeSerializer
     queryset = Like.objects.all()
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = FeedCursorPagination
 
     def get_queryset(self):
         if self.action == 'list':
@@ -199,6 +318,7 @@ class CommentViewSet(ModelViewSet):
     serializer_class = CommentSerializer
     queryset = Comment.objects.all()
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = FeedCursorPagination
 
     def get_queryset(self):
         if self.action == 'list':
@@ -225,6 +345,7 @@ class StarsRateViewSet(ModelViewSet):
     serializer_class = StarsRateSerializer
     queryset = StarsRate.objects.all()
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = FeedCursorPagination
 
     def get_queryset(self):
         if self.action == 'list':
@@ -246,8 +367,53 @@ class StarsRateViewSet(ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
 
-class ParticipantViewSet(ModelViewSet):
+class ParticipantViewSet(QueryPlanMixin, ModelViewSet):
     serializer_class = ParticipantSerializer
-    queryset = Participant.objects.all().annotate(avg=Avg('recipes__stars__stars')) \
-        .annotate(sum=Sum('recipes__stars__stars')).order_by('-sum')
+    queryset = leaderboard.board(queryset=Participant.objects.all())
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    query_plans = {'default': ParticipantSerializer.setup_eager_loading}
+
+    def get_ranked_data(self, participants, first_rank):
+        data = self.get_serializer(participants, many=True).data
+        for rank, participant in enumerate(data, first_rank):
+            participant['rank'] = rank
+        return data
+
+    @action(detail=False)
+    def leaderboard(self, request, *args, **kwargs):
+        """
+        the best participants, overall or of a wilaya
+        query params: wilaya (id), limit (defaults to 10, at most 100)
+        """
+        query = LeaderboardQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        participants = leaderboard.top(query.validated_data['limit'], query.validated_data.get('wilaya'),
+                                       self.get_queryset())
+        return Response(self.get_ranked_data(participants, 1))
+
+    @action(detail=True)
+    def rank(self, request, *args, **kwargs):
+        """
+        the participant's rank and its neighbours on the board
+        query params: neighbours (on each side, defaults to 2, at most 20), scope ('wilaya' ranks the participant
+        among the ones of its wilaya)
+        """
+        participant = self.get_object()
+        query = RankQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        try:
+            score = participant.score
+        except ObjectDoesNotExist:
+            raise NotFound('the participant is not on the board yet')
+        scope = query.validated_data.get('scope')
+        wilaya = score.wilaya_id if scope == 'wilaya' else None
+        if wilaya is None and scope == 'wilaya':
+            return Response({'scope': 'the participant has no wilaya'}, status=status.HTTP_400_BAD_REQUEST)
+        position = leaderboard.rank(score, wilaya)
+        above, below = leaderboard.neighbours(score, query.validated_data['neighbours'], wilaya, self.get_queryset())
+        return Response({
+            'rank': position,
+            'participant': self.get_ranked_data([participant], position)[0],
+            'above': self.get_ranked_data(above, position - len(above)),
+            'below': self.get_ranked_data(below, position + 1),
+        })
@@ -0,0 +1,63 @@
+"""
+Recomputes the Recipe counter columns (likes_count, comments_count, stars_count, stars_sum) from the rating
+tables, for the migration that adds them and the reconcile_recipe_counters command, and the participants'
+leaderboard scores and the recipes' facets from the recipes' counters.
+"""
+from django.db.models import OuterRef, Subquery, Count, Sum, Value, IntegerField, FloatField, F, DateTimeField
+from django.db.models.functions import Coalesce
+
+from recipe.managers import _average
+
+
+def _aggregate(model, aggregate, output_field):
+    rows = model.objects.filter(recipe=OuterRef('pk')).order_by().values('recipe').annotate(value=aggregate) \
+        .values('value')
+    return Coalesce(Subquery(rows, output_field=output_field), Value(0), output_field=output_field)
+
+
+def counter_expressions(like_model, comment_model, stars_model) -> dict:
+    """
+    the models are parameters so the migrations can pass their historical models
+    :return: counter column -> expression computing its true value for the outer recipe
+    """
+    return {
+        'likes_count': _aggregate(like_model, Count('pk'), IntegerField()),
+        'comments_count': _aggregate(comment_model, Count('pk'), IntegerField()),
+        'stars_count': _aggregate(stars_model, Count('pk'), IntegerField()),
+        'stars_sum': _aggregate(stars_model, Sum('stars'), FloatField()),
+    }
+
+
+def _sum_recipes(recipe_model, field, output_field):
+    rows = recipe_model.objects.filter(published_by=OuterRef('pk')).order_by().values('published_by') \
+        .annotate(value=Sum(field)).values('value')
+    return Coalesce(Subquery(rows, output_field=output_field), Value(0), output_field=output_field)
+
+
+def score_expressions(recipe_model) -> dict:
+    """
+    the leaderboard scores are the sums of the participant's recipes' counter columns
+    :return: ParticipantScore column -> expression computing its true value for the outer participant
+    """
+    return {
+        'likes_count': _sum_recipes(recipe_model, 'likes_count', IntegerField()),
+        'stars_count': _sum_recipes(recipe_model, 'stars_count', IntegerField()),
+        'stars_sum': _sum_recipes(recipe_model, 'stars_sum', FloatField()),
+    }
+
+
+def facet_expressions(recipe_model) -> dict:
+    """
+    the facets are copied from the recipe, its author's leaderboard score for the wilaya
+    :return: RecipeFacet column -> expression computing its true value for the outer facet
+    """
+    recipe = recipe_model.objects.filter(pk=OuterRef('recipe'))
+    return {
+        'wilaya_id': Subquery(recipe.values('published_by__score__wilaya')[:1], output_field=IntegerField()),
+        'cuisine_id': Subquery(recipe.values('cuisine')[:1], output_field=IntegerField()),
+        'type_id': Subquery(recipe.values('type')[:1], output_field=IntegerField()),
+        'likes_count': Subquery(recipe.values('likes_count')[:1], output_field=IntegerField()),
+        'stars_avg': Subquery(recipe.annotate(value=_average(F('stars_sum'), F('stars_count'))).values('value')[:1],
+                              output_field=FloatField()),
+        'created_at': Subquery(recipe.values('created_at')[:1], output_field=DateTimeField()),
+    }
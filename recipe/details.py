@@ -0,0 +1,76 @@
+"""
+assembles what the recipe page shows, for RecipeDetailView and the recipes/<pk>/full/ api endpoint: the recipe with
+its steps, ingredients and pictures, its author with the author's leaderboard summary, the viewer's like and rate, and
+the author's recipes. the recipe and everything attached to it is one query plus one per prefetched relation,
+the author's recipes one more, whatever their numbers.
+"""
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.db.models import Prefetch, Exists, OuterRef, Subquery
+from django.http import Http404
+
+from recipe.models import Recipe, Step, CustomContains, Like, StarsRate, Comment, ParticipantScore
+
+
+class RecipeDetails:
+    def __init__(self, recipe, author_recipes):
+        self.recipe = recipe
+        self.author_recipes = author_recipes
+
+    @property
+    def author(self):
+        return self.recipe.published_by
+
+    @property
+    def liked(self):
+        return getattr(self.recipe, 'liked', False)
+
+    @property
+    def rate(self):
+        return getattr(self.recipe, 'rate', None)
+
+    @property
+    def author_summary(self) -> dict:
+        """
+        the author's totals, from its leaderboard score, zeros when it has none yet. likes_ and avg are the names
+        the templates use
+        """
+        try:
+            score = self.author.score
+        except ObjectDoesNotExist:
+            score = ParticipantScore(participant=self.author)
+        avg = score.stars_avg
+        return dict(likes_=score.likes_count, stars_sum=score.stars_sum, stars_count=score.stars_count,
+                    avg=round(avg, 1) if avg is not None else None)
+
+
+def get_recipe_details(pk, user, queryset=None, reviews=False, author_recipes=None) -> RecipeDetails:
+    """
+    :param pk: the recipe's pk
+    :param user: the viewer, its like and rate are annotated on the recipe (liked, rate)
+    :param queryset: the recipes the recipe is looked up in, all of them by default
+    :param reviews: prefetch the comments and the stars rates with their users too, for the page
+    :param author_recipes: the number of the author's recipes to load, all of them by default
+    :return: the RecipeDetails, raises Http404 when the recipe is not in the queryset
+    """
+    queryset = Recipe.objects.all() if queryset is None else queryset
+    queryset = queryset.select_related('published_by__profile__owner', 'published_by__score', 'cuisine', 'type') \
+        .prefetch_related(Prefetch('steps', queryset=Step.objects.order_by('number', 'pk')),
+                          Prefetch('custom_contains', queryset=CustomContains.objects.select_related('measure')),
+                          'pictures')
+    if reviews:
+        queryset = queryset.prefetch_related(
+            Prefetch('comments', queryset=Comment.objects.select_related('user__owner')),
+            Prefetch('stars', queryset=StarsRate.objects.select_related('user__owner')))
+    if user.is_authenticated:
+        queryset = queryset.annotate(
+            liked=Exists(Like.objects.filter(recipe=OuterRef('pk'), user__owner=user)),
+            rate=Subquery(StarsRate.objects.filter(recipe=OuterRef('pk'), user__owner=user).values('stars')[:1]))
+    try:
+        recipe = queryset.get(pk=pk)
+    except (Recipe.DoesNotExist, TypeError, ValueError, ValidationError):
+        # a malformed pk is not found either
+        raise Http404('No Recipe matches the given query.')
+
+    others = Recipe.objects.filter(published_by=recipe.published_by_id,
+                                   published_by__profile__owner__is_active=True).with_counters().order_by('-created_at')
+    return RecipeDetails(recipe, list(others[:author_recipes] if author_recipes is not None else others))
@@ -0,0 +1,49 @@
+"""
+filters and sorts the recipes on their facets (RecipeFacet), for the home page filter and the recipes/filter/ api
+endpoint. the wilaya, cuisine and meal type of a recipe and its likes and stars average are columns of one table
+with an index per sort and filter, so the recipes are filtered and sorted without joining the authors' users and
+cities or aggregating the rates, then joined to the recipe by its pk.
+"""
+from django.db.models import Count
+
+from recipe.models import Recipe, RecipeFacet
+
+# the recipes' orderings, on the facets' indexes
+ORDERINGS = {
+    'popularity': ('-facet__likes_count', '-pk'),
+    'rating': ('-facet__stars_avg', '-pk'),
+    'recent': ('-facet__created_at', '-pk'),
+}
+
+
+def _filters(wilaya=None, cuisine=None, meal_type=None) -> dict:
+    filters = dict(wilaya=wilaya, cuisine=cuisine, type=meal_type)
+    return {field: value for field, value in filters.items() if value}
+
+
+def filter_recipes(queryset=None, wilaya=None, cuisine=None, meal_type=None, order=None):
+    """
+    :param queryset: the recipes to filter, all of them with their counters by default
+    :param wilaya: the wilaya of the recipes' authors (instance or id)
+    :param cuisine: a Cuisine (instance or id)
+    :param meal_type: a MealType (instance or id)
+    :param order: a key of ORDERINGS
+    :return: the filtered and sorted queryset
+    """
+    queryset = Recipe.objects.with_counters() if queryset is None else queryset
+    filters = _filters(wilaya, cuisine, meal_type)
+    queryset = queryset.filter(**{'facet__' + field: value for field, value in filters.items()})
+    return queryset.order_by(*ORDERINGS[order]) if order else queryset
+
+
+def facet_counts(wilaya=None, cuisine=None, meal_type=None) -> dict:
+    """
+    the number of recipes per cuisine and per wilaya, each counted with the other filters applied
+    :return: {'cuisine': {id: count}, 'wilaya': {id: count}}, the recipes without one are counted under None
+    """
+    counts = {}
+    for facet, filters in (('cuisine', _filters(wilaya, None, meal_type)),
+                           ('wilaya', _filters(None, cuisine, meal_type))):
+        rows = RecipeFacet.objects.filter(**filters).order_by().values(facet).annotate(count=Count('pk'))
+        counts[facet] = {row[facet]: row['count'] for row in rows}
+    return counts
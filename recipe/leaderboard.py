@@ -0,0 +1,70 @@
+"""
+the participants' leaderboard, read from the ParticipantScore table.
+the scores are kept up to date by the rating receivers of recipe.models, each rate only moves one row of the
+(stars_sum, participant) indexes, so ranking never aggregates the rates: the top of the board is an index scan and
+a participant's rank is a count over the index range of the participants ahead of it.
+ties on stars_sum are broken by the participant id, so every participant has a distinct rank.
+"""
+from django.db.models import Q
+
+from recipe.models import Participant, ParticipantScore
+
+
+
+def _ahead(score, stars_sum='stars_sum', participant='participant_id'):
+    return Q(**{stars_sum + '__gt': score.stars_sum}) | \
+           Q(**{stars_sum: score.stars_sum, participant + '__lt': score.participant_id})
+
+
+def _behind(score, stars_sum='stars_sum', participant='participant_id'):
+    return Q(**{stars_sum + '__lt': score.stars_sum}) | \
+           Q(**{stars_sum: score.stars_sum, participant + '__gt': score.participant_id})
+
+
+def board(wilaya=None, queryset=None):
+    """
+    the participants ordered by their rank
+    :param wilaya: restricts the board to the participants living in this wilaya (instance or id)
+    :param queryset: a Participant queryset to order, defaults to the participants with their scores
+    :return: the ordered queryset
+    """
+    queryset = Participant.objects.with_scores() if queryset is None else queryset
+    if wilaya is not None:
+        queryset = queryset.filter(score__wilaya=wilaya)
+    return queryset.order_by('-score__stars_sum', 'pk')
+
+
+def top(count, wilaya=None, queryset=None):
+    """
+    :param count: the number of participants
+    :param wilaya: see board
+    :param queryset: see board
+    :return: the count best participants
+    """
+    return board(wilaya, queryset)[:count]
+
+
+def rank(score, wilaya=None):
+    """
+    :param score: the ParticipantScore of the participant
+    :param wilaya: ranks the participant among the ones living in this wilaya
+    :return: the 1 based rank of the participant
+    """
+    scores = ParticipantScore.objects.all()
+    if wilaya is not None:
+        scores = scores.filter(wilaya=wilaya)
+    return scores.filter(_ahead(score)).count() + 1
+
+
+def neighbours(score, count, wilaya=None, queryset=None):
+    """
+    :param score: the ParticipantScore of the participant
+    :param count: the number of participants on each side
+    :param wilaya: see board
+    :param queryset: see board
+    :return: (above, below) the participants right before and right after the participant, in rank order
+    """
+    ordered = board(wilaya, queryset)
+    above = list(ordered.filter(_ahead(score, 'score__stars_sum', 'pk')).reverse()[:count])
+    below = list(ordered.filter(_behind(score, 'score__stars_sum', 'pk'))[:count])
+    return above[::-1], below
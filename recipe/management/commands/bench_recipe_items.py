@@ -0,0 +1,65 @@
+"""
+benchmark of the bulk writes of a recipe's steps and ingredients (RecipeItemsBulkWriteSerializer) against saving
+the items one by one, on a recipe of 30 steps and 40 ingredients by default: create them, update them, delete them.
+runs on an existing recipe in a transaction rolled back at the end, nothing is kept.
+"""
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from recipe.models import Recipe, Step, CustomContains
+from recipe.serializers import StepsBulkWriteSerializer, CustomContainsBulkWriteSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare the bulk writes of steps and ingredients with saving them one by one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--steps', type=int, default=30, help='number of steps')
+        parser.add_argument('-i', '--ingredients', type=int, default=40, help='number of ingredients')
+        parser.add_argument('--recipe', type=int, help='the recipe to write to, the first one by default')
+
+    def handle(self, *args, **options):
+        recipe = Recipe.objects.filter(pk=options['recipe']).first() if options['recipe'] else Recipe.objects.first()
+        if recipe is None:
+            raise CommandError('no recipe to write to')
+        steps = [{'number': i, 'description': 'step {}'.format(i)} for i in range(options['steps'])]
+        ingredients = [{'ingredient': 'ingredient {}'.format(i), 'quantity': i} for i in range(options['ingredients'])]
+
+        def one_by_one():
+            created = [Step.objects.create(recipe=recipe, **step) for step in steps] + \
+                      [CustomContains.objects.create(recipe=recipe, **ingredient) for ingredient in ingredients]
+            for item in created:
+                if isinstance(item, Step):
+                    item.description += ' updated'
+                else:
+                    item.quantity += 1
+                item.save()
+            for item in created:
+                item.delete()
+
+        def bulk():
+            for serializer_class, items, update in ((StepsBulkWriteSerializer, steps, 'description'),
+                                                    (CustomContainsBulkWriteSerializer, ingredients, 'quantity')):
+                model = serializer_class.item_serializer.Meta.model
+                write(serializer_class, {'create': items})
+                ids = list(model.objects.filter(recipe=recipe).values_list('pk', flat=True))
+                write(serializer_class, {'update': [{'id': pk, update: 1} for pk in ids]})
+                write(serializer_class, {'delete': ids})
+
+        def write(serializer_class, data):
+            serializer = serializer_class(data=data, context={'recipe': recipe})
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        print('{} steps and {} ingredients, created, updated then deleted:'.format(len(steps), len(ingredients)))
+        for name, function in (('one by one', one_by_one), ('bulk', bulk)):
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    function()
+                    elapsed = (time.perf_counter() - start) * 1000
+                transaction.set_rollback(True)
+            print('  {}: {} queries, {:.1f} ms'.format(name, len(queries.captured_queries), elapsed))
@@ -0,0 +1,69 @@
+"""
+repairs the Recipe counter columns (likes_count, comments_count, stars_count, stars_sum), then the participants'
+leaderboard scores (ParticipantScore) that sum them and the recipes' facets (RecipeFacet) that copy them.
+they are maintained incrementally by the rating receivers in recipe.models, and can drift when the rating
+tables are written without signals (bulk operations, raw sql, manual fixes). run it from a cron job.
+"""
+import math
+
+from django.core.management import BaseCommand
+
+from recipe.counters import counter_expressions, score_expressions, facet_expressions
+from recipe.models import Recipe, Like, Comment, StarsRate, ParticipantScore, RecipeFacet
+
+
+def same(value, true_value) -> bool:
+    if isinstance(value, float) and isinstance(true_value, float):
+        return math.isclose(value, true_value, abs_tol=1e-6)
+    return value == true_value
+
+
+class Command(BaseCommand):
+    help = 'Recompute the likes, comments and stars counters of the recipes, the participants\' scores ' \
+           'and the recipes\' facets and fix the drifted ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report the drifted rows')
+        parser.add_argument('-b', '--batch-size', type=int, default=500, help='number of rows per batch')
+
+    def reconcile(self, model, expressions, batch_size, dry_run):
+        """
+        compares the columns to their true values batch by batch, and writes back the drifted rows
+        :return: (number of checked rows, pks of the drifted rows)
+        """
+        fields = list(expressions)
+        queryset = model.objects.annotate(**{'true_' + field: expression for field, expression in expressions.items()}) \
+            .only('pk', *fields).order_by('pk')
+        checked, drifted, last_pk = 0, [], 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            checked += len(batch)
+            fixed = []
+            for row in batch:
+                if not all(same(getattr(row, field), getattr(row, 'true_' + field)) for field in fields):
+                    for field in fields:
+                        setattr(row, field, getattr(row, 'true_' + field))
+                    fixed.append(row)
+            if fixed and not dry_run:
+                model.objects.bulk_update(fixed, fields)
+            drifted += [row.pk for row in fixed]
+        return checked, drifted
+
+    def handle(self, *args, **options):
+        missing = [RecipeFacet(recipe_id=pk, created_at=created_at)
+                   for pk, created_at in Recipe.objects.filter(facet__isnull=True).values_list('pk', 'created_at')]
+        if missing:
+            if not options['dry_run']:
+                RecipeFacet.objects.bulk_create(missing)
+            print('{} recipe facet(s) {}'.format(len(missing), 'missing' if options['dry_run'] else 'created'))
+        # the scores and the facets are recomputed from the recipes' counters, they have to be repaired first
+        for name, model, expressions in (('recipe(s)', Recipe, counter_expressions(Like, Comment, StarsRate)),
+                                         ('participant score(s)', ParticipantScore, score_expressions(Recipe)),
+                                         ('recipe facet(s)', RecipeFacet, facet_expressions(Recipe))):
+            checked, drifted = self.reconcile(model, expressions, options['batch_size'], options['dry_run'])
+            print('{} {} checked, {} {}{}'.format(
+                checked, name, len(drifted), 'drifted' if options['dry_run'] else 'repaired',
+                ': ' + ', '.join(str(pk) for pk in drifted) if drifted else ''))
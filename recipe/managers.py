@@ -0,0 +1,32 @@
+from django.db import models
+from django.db.models import F, ExpressionWrapper, FloatField
+from django.db.models.functions import NullIf
+
+from base_backend.models import Round
+
+
+def _average(stars_sum, stars_count):
+    # null when there is no rate yet, like Avg
+    return Round(ExpressionWrapper(stars_sum / NullIf(stars_count, 0), output_field=FloatField()), 1,
+                 output_field=FloatField())
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_counters(self):
+        """
+        exposes the counter columns under the names the templates use: avg (rounded stars average),
+        likes_ and comments_, without joining the likes, comments and stars tables.
+        """
+        return self.annotate(avg=_average(F('stars_sum'), F('stars_count')), likes_=F('likes_count'),
+                             comments_=F('comments_count'))
+
+
+class ParticipantQuerySet(models.QuerySet):
+    def with_scores(self):
+        """
+        annotates the participants' totals over their recipes from their leaderboard score: likes_, stars_sum,
+        stars_count and avg (rounded stars average), joining the score table only.
+        """
+        return self.annotate(likes_=F('score__likes_count'), stars_sum=F('score__stars_sum'),
+                             stars_count=F('score__stars_count')) \
+            .annotate(avg=_average(F('stars_sum'), F('stars_count')))
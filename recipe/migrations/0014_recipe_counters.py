@@ -0,0 +1,42 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:21
+
+from django.db import migrations, models
+
+from recipe.counters import counter_expressions
+
+
+def count_ratings(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    Recipe.objects.update(**counter_expressions(apps.get_model('recipe', 'Like'), apps.get_model('recipe', 'Comment'),
+                                                apps.get_model('recipe', 'StarsRate')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0013_customcontains_measure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='comments_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='likes_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='stars_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='stars_sum',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from recipe.counters import score_expressions
+
+
+def build_scores(apps, schema_editor):
+    Participant = apps.get_model('recipe', 'Participant')
+    ParticipantScore = apps.get_model('recipe', 'ParticipantScore')
+    ParticipantScore.objects.bulk_create(
+        ParticipantScore(participant_id=pk, wilaya_id=wilaya_id)
+        for pk, wilaya_id in Participant.objects.values_list('pk', 'profile__owner__lives_in__wilaya'))
+    scores = score_expressions(apps.get_model('recipe', 'Recipe'))
+    ParticipantScore.objects.update(**{field: expression for field, expression in scores.items()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0022_order_totals'),
+        ('recipe', '0014_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipantScore',
+            fields=[
+                ('participant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='score', serialize=False, to='recipe.Participant')),
+                ('stars_sum', models.FloatField(default=0)),
+                ('stars_count', models.IntegerField(default=0)),
+                ('likes_count', models.IntegerField(default=0)),
+                ('wilaya', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='restaurants.Wilaya')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='participantscore',
+            index=models.Index(fields=['-stars_sum', 'participant'], name='recipe_part_stars_s_9eb2ba_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participantscore',
+            index=models.Index(fields=['wilaya', '-stars_sum', 'participant'], name='recipe_part_wilaya__914baa_idx'),
+        ),
+        migrations.RunPython(build_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from recipe.counters import facet_expressions
+
+
+def build_facets(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    RecipeFacet = apps.get_model('recipe', 'RecipeFacet')
+    RecipeFacet.objects.bulk_create(RecipeFacet(recipe_id=pk, created_at=created_at)
+                                    for pk, created_at in Recipe.objects.values_list('pk', 'created_at'))
+    RecipeFacet.objects.update(**facet_expressions(Recipe))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0024_restaurant_image_sha256'),
+        ('recipe', '0017_recipe_image_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeFacet',
+            fields=[
+                ('recipe', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='facet', serialize=False, to='recipe.Recipe')),
+                ('likes_count', models.IntegerField(default=0)),
+                ('stars_avg', models.FloatField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('cuisine', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='restaurants.Cuisine')),
+                ('type', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='restaurants.MealType')),
+                ('wilaya', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='restaurants.Wilaya')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='recipefacet',
+            index=models.Index(fields=['wilaya', 'cuisine', '-created_at'], name='recipe_reci_wilaya__78aa5f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipefacet',
+            index=models.Index(fields=['cuisine', '-created_at'], name='recipe_reci_cuisine_b1c072_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipefacet',
+            index=models.Index(fields=['-created_at'], name='recipe_reci_created_639579_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipefacet',
+            index=models.Index(fields=['wilaya', 'cuisine', '-likes_count'], name='recipe_reci_wilaya__2f1402_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipefacet',
+            index=models.Index(fields=['cuisine', '-likes_count'], name='recipe_reci_cuisine_41b600_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipefacet',
+            index=models.Index(fields=['-likes_count'], name='recipe_reci_likes_c_82b89c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipefacet',
+            index=models.Index(fields=['wilaya', 'cuisine', '-stars_avg'], name='recipe_reci_wilaya__fc6b20_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipefacet',
+            index=models.Index(fields=['cuisine', '-stars_avg'], name='recipe_reci_cuisine_2c2603_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipefacet',
+            index=models.Index(fields=['-stars_avg'], name='recipe_reci_stars_a_f8afe4_idx'),
+        ),
+        migrations.RunPython(build_facets, migrations.RunPython.noop),
+    ]
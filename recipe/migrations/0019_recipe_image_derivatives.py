@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0018_recipe_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipeimage',
+            name='derivatives',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0019_recipe_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='main_derivatives',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='step',
+            name='image_derivatives',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
@@ -2,10 +2,14 @@ import os
 
 from django.contrib.auth.models import Group
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models import F, prefetch_related_objects, DEFERRED
+from django.db.models.signals import post_save, post_delete, post_init
 from django.dispatch import receiver
 
+from base_backend import images
 from base_backend.models import BaseModel, do_nothing, cascade
+from recipe import viewer
+from recipe.managers import RecipeQuerySet, ParticipantQuerySet
 from recipe.utils import generate_participant_code
 
 from restaurant.settings import MEDIA_ROOT, MEDIA_URL, HOST_NAME
@@ -15,6 +19,8 @@ class Participant(BaseModel):
     profile = models.OneToOneField('restaurants.Client', on_delete=do_nothing, related_name='profile', unique=True)
     participant_id = models.CharField(max_length=150, unique=True)
 
+    objects = ParticipantQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
         if not self.pk:
             self.participant_id = generate_participant_code()
@@ -30,6 +36,8 @@ class Step(BaseModel):
     description = models.TextField()
     recipe = models.ForeignKey("Recipe", on_delete=cascade, related_name='steps')
     image = models.ImageField(null=True, blank=True, upload_to='step')
+    # the generated sizes of base_backend.images.DERIVATIVES, space separated
+    image_derivatives = models.CharField(max_length=100, blank=True, default='', editable=False)
 
     def __str__(self):
         return "step {} of the recipe {}: {}".format(self.number, self.recipe.id, self.recipe.food_name)
@@ -44,27 +52,53 @@ class Recipe(BaseModel):
     type = models.ForeignKey('restaurants.MealType', on_delete=do_nothing, null=True, related_name='recipe_type')
     media = models.CharField(max_length=255, unique=True, null=True, blank=True)
     main = models.ImageField(blank=True, null=True, upload_to="recipe/main")
+    # the generated sizes of base_backend.images.DERIVATIVES, space separated
+    main_derivatives = models.CharField(max_length=100, blank=True, default='', editable=False)
+    # kept up to date by the Like, Comment and StarsRate receivers, repaired by reconcile_recipe_counters
+    likes_count = models.IntegerField(default=0, editable=False)
+    comments_count = models.IntegerField(default=0, editable=False)
+    stars_count = models.IntegerField(default=0, editable=False)
+    stars_sum = models.FloatField(default=0, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         unique_together = ('published_by', 'food_name')
 
+    @property
+    def stars_avg(self):
+        return self.stars_sum / self.stars_count if self.stars_count else None
+
     @staticmethod
     def get_media(recipes):
-        for i in range(len(recipes)):
-            recipes[i].images = []
-            images_paths = os.listdir(recipes[i].media)
-            for image in images_paths:
-                recipes[i].images.append(MEDIA_URL + "recipe/" + str(recipes[i].pk) + "/" + image)
+        prefetch_related_objects(recipes, 'pictures')
+        for recipe in recipes:
+            recipe.images = [MEDIA_URL + picture.path for picture in recipe.pictures.all()]
         return recipes
 
     @property
     def pictures_urls(self):
-        images = []
-        paths = os.listdir(self.media)
-        for path in paths:
-            path = path.replace('\\', '%5C', 1) if path.startswith('\\') else path
-            images.append(HOST_NAME + MEDIA_URL + "recipe/" + str(self.pk) + "/" + path)
-        return images
+        """
+        read from the RecipeImage manifest, prefetch 'pictures' when listing recipes
+        """
+        return [picture.url for picture in self.pictures.all()]
+
+    @property
+    def pictures_sizes(self):
+        """
+        the pictures' urls per size, see base_backend.images.derivative_urls
+        """
+        return [picture.urls for picture in self.pictures.all()]
+
+    def add_picture(self, file, name=None):
+        """
+        streams the uploaded file to the recipe's media directory, adds it to the manifest and schedules its
+        derivatives. a file with the content of one of the recipe's pictures is dropped.
+        :param file: the uploaded file
+        :param name: the file name, defaults to the uploaded file's name
+        :return: the RecipeImage
+        """
+        return images.add_to_manifest(self.pictures, self.media, file, name)
 
     @property
     def get_photo(self):
@@ -77,6 +111,39 @@ class Recipe(BaseModel):
         return "{} {} belongs to {}".format(self.id, self.food_name, self.published_by.profile.owner.id)
 
 
+class RecipeImage(BaseModel):
+    """
+    a picture of the recipe's media directory, the manifest spares listing the directory to build the urls.
+    written by Recipe.add_picture, the index_media command indexes the files written without it
+    """
+    recipe = models.ForeignKey('Recipe', on_delete=cascade, related_name='pictures')
+    name = models.CharField(max_length=255)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    # the generated sizes of base_backend.images.DERIVATIVES, space separated
+    derivatives = models.CharField(max_length=100, blank=True, default='')
+
+    class Meta:
+        unique_together = ('recipe', 'name')
+        ordering = ('name',)
+
+    @property
+    def path(self):
+        # the pictures uploaded from windows were named with a leading backslash
+        name = self.name.replace('\\', '%5C', 1) if self.name.startswith('\\') else self.name
+        return "recipe/" + str(self.recipe_id) + "/" + name
+
+    @property
+    def url(self):
+        return HOST_NAME + MEDIA_URL + self.path
+
+    @property
+    def urls(self):
+        return images.derivative_urls(self.url, self.derivatives.split())
+
+    def __str__(self):
+        return self.name
+
+
 class IngredientType(BaseModel):
     type = models.CharField(max_length=150, unique=True)
 
@@ -153,6 +220,65 @@ class StarsRate(BaseRating):
         return "the user {} rated the recipe {}".format(self.user.id, self.recipe.id)
 
 
+class ParticipantScore(models.Model):
+    """
+    the leaderboard, one row per participant with the totals of its recipes' rates and likes.
+    kept up to date by the rating receivers below, so ranking the participants is a walk down the
+    (stars_sum, participant) index instead of an aggregation over every rate. see recipe.leaderboard
+    """
+    participant = models.OneToOneField('Participant', on_delete=cascade, primary_key=True, related_name='score')
+    wilaya = models.ForeignKey('restaurants.Wilaya', on_delete=models.SET_NULL, null=True, blank=True)
+    stars_sum = models.FloatField(default=0)
+    stars_count = models.IntegerField(default=0)
+    likes_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-stars_sum', 'participant']),
+            models.Index(fields=['wilaya', '-stars_sum', 'participant']),
+        ]
+
+    @property
+    def stars_avg(self):
+        return self.stars_sum / self.stars_count if self.stars_count else None
+
+    def __str__(self):
+        return "participant {} scored {}".format(self.participant_id, self.stars_sum)
+
+
+class RecipeFacet(models.Model):
+    """
+    the columns the recipes are filtered and sorted on, in one table: the wilaya of the recipe's author, its cuisine
+    and meal type, and its likes and stars average. kept up to date by the receivers below, repaired by
+    reconcile_recipe_counters. see recipe.facets
+    """
+    recipe = models.OneToOneField('Recipe', on_delete=cascade, primary_key=True, related_name='facet')
+    wilaya = models.ForeignKey('restaurants.Wilaya', on_delete=models.SET_NULL, null=True, blank=True,
+                               related_name='+')
+    cuisine = models.ForeignKey('restaurants.Cuisine', on_delete=do_nothing, null=True, blank=True, related_name='+')
+    type = models.ForeignKey('restaurants.MealType', on_delete=do_nothing, null=True, blank=True, related_name='+')
+    likes_count = models.IntegerField(default=0)
+    stars_avg = models.FloatField(null=True, blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        # per sort: filtered on the wilaya (and the cuisine), on the cuisine, or not filtered
+        indexes = [
+            models.Index(fields=['wilaya', 'cuisine', '-created_at']),
+            models.Index(fields=['cuisine', '-created_at']),
+            models.Index(fields=['-created_at']),
+            models.Index(fields=['wilaya', 'cuisine', '-likes_count']),
+            models.Index(fields=['cuisine', '-likes_count']),
+            models.Index(fields=['-likes_count']),
+            models.Index(fields=['wilaya', 'cuisine', '-stars_avg']),
+            models.Index(fields=['cuisine', '-stars_avg']),
+            models.Index(fields=['-stars_avg']),
+        ]
+
+    def __str__(self):
+        return "facets of the recipe {}".format(self.recipe_id)
+
+
 @receiver(post_save, sender=Recipe)
 def make_recipe_media_directory(instance, *args, **kwargs):
     if not instance.media:
@@ -160,3 +286,123 @@ def make_recipe_media_directory(instance, *args, **kwargs):
         # os.makedirs(os.path.join(MEDIA_ROOT, 'step', str(instance.pk)), exist_ok=True)
         instance.media = os.path.join(MEDIA_ROOT, 'recipe', str(instance.pk) + "/")
         instance.save()
+
+
+SCORE_FIELDS = ('stars_sum', 'stars_count', 'likes_count')
+# RecipeFacet column -> the Recipe counter columns it is computed from
+FACET_COUNTER_FIELDS = {
+    'likes_count': {'likes_count'},
+    'stars_avg': {'stars_count', 'stars_sum'},
+}
+
+
+def update_recipe_counters(recipe_id, **increments):
+    """
+    adds the increments to the recipe's counter columns in one atomic UPDATE, concurrent rates can't lose a count,
+    to its author's leaderboard score, and copies them to the recipe's facets
+    :param recipe_id: the recipe id
+    :param increments: counter column -> value to add
+    """
+    from recipe.counters import facet_expressions
+
+    Recipe.objects.filter(pk=recipe_id).update(**{field: F(field) + value for field, value in increments.items()})
+    score_increments = {field: F(field) + value for field, value in increments.items() if field in SCORE_FIELDS}
+    if score_increments:
+        ParticipantScore.objects.filter(participant__in=Recipe.objects.filter(pk=recipe_id).values('published_by')) \
+            .update(**score_increments)
+    facet_fields = [field for field, counters in FACET_COUNTER_FIELDS.items() if counters & set(increments)]
+    if facet_fields:
+        expressions = facet_expressions(Recipe)
+        RecipeFacet.objects.filter(recipe=recipe_id).update(**{field: expressions[field] for field in facet_fields})
+
+
+@receiver(post_save, sender=Recipe)
+def sync_recipe_facet(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created:
+        wilaya = ParticipantScore.objects.filter(participant=instance.published_by_id).values_list('wilaya', flat=True)
+        RecipeFacet.objects.create(recipe=instance, wilaya_id=next(iter(wilaya), None), cuisine_id=instance.cuisine_id,
+                                   type_id=instance.type_id, created_at=instance.created_at)
+    else:
+        RecipeFacet.objects.filter(recipe=instance).update(cuisine_id=instance.cuisine_id, type_id=instance.type_id)
+
+
+@receiver(post_save, sender=Like)
+def count_like(sender, instance, created, **kwargs):
+    if created:
+        update_recipe_counters(instance.recipe_id, likes_count=1)
+
+
+@receiver(post_delete, sender=Like)
+def uncount_like(sender, instance, **kwargs):
+    update_recipe_counters(instance.recipe_id, likes_count=-1)
+
+
+@receiver([post_save, post_delete], sender=Like)
+def invalidate_liked_recipes(sender, instance, **kwargs):
+    # the liked recipes are cached per user, the like's client is the user's profile
+    viewer.invalidate_clients_liked_recipes(instance.user_id)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        update_recipe_counters(instance.recipe_id, comments_count=1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    update_recipe_counters(instance.recipe_id, comments_count=-1)
+
+
+@receiver(post_init, sender=StarsRate)
+def mark_stars_rate_previous_value(sender, instance, **kwargs):
+    instance.previous_value = (instance.recipe_id, instance.stars)
+
+
+@receiver(post_save, sender=StarsRate)
+def count_stars_rate(sender, instance, created, **kwargs):
+    recipe_id, stars = instance.previous_value
+    if created:
+        update_recipe_counters(instance.recipe_id, stars_count=1, stars_sum=instance.stars)
+    elif recipe_id != instance.recipe_id:
+        update_recipe_counters(recipe_id, stars_count=-1, stars_sum=-stars)
+        update_recipe_counters(instance.recipe_id, stars_count=1, stars_sum=instance.stars)
+    elif stars != instance.stars:
+        update_recipe_counters(instance.recipe_id, stars_sum=instance.stars - stars)
+    instance.previous_value = (instance.recipe_id, instance.stars)
+
+
+@receiver(post_delete, sender=StarsRate)
+def uncount_stars_rate(sender, instance, **kwargs):
+    recipe_id, stars = instance.previous_value
+    update_recipe_counters(recipe_id, stars_count=-1, stars_sum=-stars)
+
+
+@receiver(post_save, sender=Participant)
+def create_participant_score(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        lives_in = instance.profile.owner.lives_in
+        ParticipantScore.objects.create(participant=instance, wilaya_id=lives_in.wilaya_id if lives_in else None)
+
+
+@receiver(post_init, sender='restaurants.User')
+def mark_user_previous_city(sender, instance, **kwargs):
+    # read from the loaded fields, a deferred city would be loaded by a query per user
+    instance.previous_lives_in_id = instance.__dict__.get('lives_in_id', DEFERRED)
+
+
+@receiver(post_save, sender='restaurants.User')
+def move_participant_score(sender, instance, created, **kwargs):
+    lives_in_id = instance.__dict__.get('lives_in_id', DEFERRED)
+    # a city loaded after a deferred one is moved to, whatever it was
+    if not created and lives_in_id is not DEFERRED and instance.previous_lives_in_id != lives_in_id:
+        wilaya_id = instance.lives_in.wilaya_id if instance.lives_in else None
+        ParticipantScore.objects.filter(participant__profile__owner=instance).update(wilaya_id=wilaya_id)
+        RecipeFacet.objects.filter(recipe__published_by__profile__owner=instance).update(wilaya_id=wilaya_id)
+    instance.previous_lives_in_id = lives_in_id
+
+
+images.track_image_fields(Recipe, 'main')
+images.track_image_fields(Step, 'image')
@@ -1,15 +1,23 @@
-from django.db.models import Avg, Sum
+from django.conf import settings
+from django.db.models import Avg, Sum, OuterRef, Subquery, Count, Value, IntegerField
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from rest_framework import serializers
 
-from base_backend.utils import handle_uploaded_file
+from base_backend.apis import ImageSizesField
+from base_backend.images import schedule_field_derivatives
 from recipe.models import Step, Recipe, IngredientType, Ingredient, QuantityMeasure, Contains, Like, Comment, StarsRate, \
     Participant, CustomContains
+from search import indexer
 
 
 class StepSerializer(serializers.ModelSerializer):
+    image_sizes = ImageSizesField(source='image')
+
     class Meta:
         model = Step
-        fields = ['number', 'description', 'recipe', 'id', 'image']
+        fields = ['number', 'description', 'recipe', 'id', 'image', 'image_sizes']
         extra_kwargs = {
             'recipe': {
                 'required': False,
@@ -70,13 +78,15 @@ class RecipeSerializer(serializers.ModelSerializer):
     full_name = serializers.SerializerMethodField()
     user_id = serializers.SerializerMethodField()
     user_image = serializers.SerializerMethodField()
+    main_sizes = ImageSizesField(source='main')
+    pictures_sizes = serializers.ReadOnlyField()
 
-    # TODO: add image fields
     class Meta:
         model = Recipe
         fields = ['published_by', 'food_name', 'cost', 'cuisine', 'type', 'description', 'custom_contains', 'steps',
                   'images', 'likes', 'comments', 'stars', 'stars_avg', 'pictures_urls', 'main', 'id',
-                  'stars_sum', 'cuisine_name', 'type_name', 'full_name', 'user_id', 'user_image']
+                  'stars_sum', 'cuisine_name', 'type_name', 'full_name', 'user_id', 'user_image', 'main_sizes',
+                  'pictures_sizes']
         extra_kwargs = {
             'likes': {'read_only': True},
             'comments': {'read_only': True},
@@ -91,20 +101,29 @@ class RecipeSerializer(serializers.ModelSerializer):
             'user_image': {'read_only': True},
         }
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        the counters are columns of the recipe, the rest is joined or prefetched, so listing recipes runs
+        a fixed number of queries
+        """
+        return queryset.select_related('published_by__profile__owner', 'cuisine', 'type') \
+            .prefetch_related('steps', 'custom_contains', 'pictures')
+
     def get_likes(self, obj):
-        return obj.likes.count()
+        return obj.likes_count
 
     def get_comments(self, obj):
-        return obj.comments.count()
+        return obj.comments_count
 
     def get_stars(self, obj):
-        return obj.stars.count()
+        return obj.stars_count
 
     def get_stars_avg(self, obj):
-        return obj.stars.aggregate(stars_avg=Avg('stars')).get('stars_avg', 0)
+        return obj.stars_avg
 
     def get_stars_sum(self, obj):
-        return obj.stars.aggregate(stars_sum=Sum('stars')).get('stars_sum')
+        return obj.stars_sum if obj.stars_count else None
 
     def get_full_name(self, obj):
         return obj.published_by.profile.owner.full_name
@@ -127,18 +146,274 @@ class RecipeSerializer(serializers.ModelSerializer):
         custom_contains = validated_data.pop('custom_contains') if validated_data.get('custom_contains') else []
         images = validated_data.pop('images') if validated_data.get('images') else []
         # real_participant = Participant.objects.get(profile__owner__id=validated_data.pop('published_by'))
-        recipe = Recipe.objects.create(**validated_data)
-        for step in steps_data:
-            Step.objects.create(recipe=recipe, **step)
-        # for ingredient in contains_data:
-        #     Contains.objects.create(recipe=recipe, **ingredient)
-        for custom_ingredient in custom_contains:
-            CustomContains.objects.create(recipe=recipe, **custom_ingredient)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(**validated_data)
+            steps = Step.objects.bulk_create([Step(recipe=recipe, **step) for step in steps_data])
+            # for ingredient in contains_data:
+            #     Contains.objects.create(recipe=recipe, **ingredient)
+            CustomContains.objects.bulk_create([CustomContains(recipe=recipe, **custom_ingredient)
+                                                for custom_ingredient in custom_contains])
+            # bulk_create doesn't send the signals the ingredients index and the steps' derivatives are kept up
+            # to date by, the recipe's document is reindexed by the recipe's once the steps are committed
+            indexer.schedule(indexer.INGREDIENTS, recipe.pk)
+            for step in steps:
+                if step.image:
+                    schedule_field_derivatives(Step, 'image', step.image)
         for image in images:
-            handle_uploaded_file(image, recipe.media + "\\" + image.name)
+            recipe.add_picture(image)
         return recipe
 
 
+class StepBulkSerializer(StepSerializer):
+    class Meta(StepSerializer.Meta):
+        fields = ['id', 'number', 'description']
+        extra_kwargs = {
+            'id': {'read_only': False, 'required': False},
+        }
+
+
+class CustomContainsBulkSerializer(CustomContainsSerializer):
+    # checked for the whole batch at once by CustomContainsBulkWriteSerializer
+    measure = serializers.IntegerField(source='measure_id', required=False, allow_null=True)
+
+    class Meta(CustomContainsSerializer.Meta):
+        fields = ['id', 'ingredient', 'quantity', 'measure']
+        extra_kwargs = {
+            'id': {'read_only': False, 'required': False},
+        }
+
+
+class RecipeItemsBulkWriteSerializer(serializers.Serializer):
+    """
+    creates, updates and deletes items of the recipe in the context (steps, ingredients) in one request:
+    {"create": [items], "update": [items with their id, partial], "delete": [ids]}
+    the whole batch is validated before anything is written, then each operation runs one query (bulk_create,
+    bulk_update, delete) in one transaction. subclasses set item_serializer, the item's model needs a recipe field,
+    and the search indexes built from the items.
+    """
+    item_serializer = None
+    indexes = ('recipe',)
+
+    create = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    update = serializers.ListField(child=serializers.DictField(), required=False, default=list)
+    delete = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+
+    @property
+    def model(self):
+        return self.item_serializer.Meta.model
+
+    def validate_items(self, data, partial=False):
+        serializer = self.item_serializer(data=data, many=True, partial=partial)
+        if not serializer.is_valid():
+            raise serializers.ValidationError(serializer.errors)
+        return serializer.validated_data
+
+    def validate(self, attrs):
+        recipe = self.context['recipe']
+        creates = self.validate_items(attrs['create'])
+        for item in creates:
+            item.pop('id', None)
+        updates = self.validate_items(attrs['update'], partial=True)
+        if any('id' not in item for item in updates):
+            raise serializers.ValidationError({'update': 'every item needs its id'})
+        update_ids = [item['id'] for item in updates]
+        if len(set(update_ids)) != len(update_ids):
+            raise serializers.ValidationError({'update': 'an item is updated twice'})
+        if set(update_ids) & set(attrs['delete']):
+            raise serializers.ValidationError({'delete': 'an item is both updated and deleted'})
+        existing = self.model.objects.filter(recipe=recipe).in_bulk(update_ids + attrs['delete'])
+        unknown = (set(update_ids) | set(attrs['delete'])) - set(existing)
+        if unknown:
+            raise serializers.ValidationError(
+                'Unknown item(s) of the recipe: {}'.format(', '.join(str(pk) for pk in sorted(unknown))))
+        return dict(create=creates, update=[(existing[item.pop('id')], item) for item in updates],
+                    delete=attrs['delete'])
+
+    def save(self, **kwargs):
+        recipe, model = self.context['recipe'], self.model
+        data = self.validated_data
+        with transaction.atomic():
+            deleted = model.objects.filter(recipe=recipe, pk__in=data['delete']).delete()[0] if data['delete'] else 0
+            if data['update']:
+                fields, now = {'updated_at'}, timezone.now()
+                for instance, attrs in data['update']:
+                    for field, value in attrs.items():
+                        setattr(instance, field, value)
+                    # bulk_update doesn't touch the auto_now fields
+                    instance.updated_at = now
+                    fields.update(attrs)
+                model.objects.bulk_update([instance for instance, _ in data['update']], fields)
+            created = model.objects.bulk_create([model(recipe=recipe, **attrs) for attrs in data['create']])
+            # bulk_update and bulk_create don't send the signals the search indexes are kept up to date by
+            for kind in self.indexes:
+                indexer.schedule(kind, recipe.pk)
+        return dict(created=len(created), updated=len(data['update']), deleted=deleted)
+
+
+class StepsBulkWriteSerializer(RecipeItemsBulkWriteSerializer):
+    item_serializer = StepBulkSerializer
+
+
+class CustomContainsBulkWriteSerializer(RecipeItemsBulkWriteSerializer):
+    item_serializer = CustomContainsBulkSerializer
+    indexes = ('recipe', indexer.INGREDIENTS)
+
+    def validate(self, attrs):
+        attrs = super(CustomContainsBulkWriteSerializer, self).validate(attrs)
+        measures = {item['measure_id'] for item in attrs['create'] + [item for _, item in attrs['update']]
+                    if item.get('measure_id') is not None}
+        unknown = measures - set(QuantityMeasure.objects.in_bulk(measures)) if measures else set()
+        if unknown:
+            raise serializers.ValidationError(
+                'Unknown measure(s): {}'.format(', '.join(str(pk) for pk in sorted(unknown))))
+        return attrs
+
+
+class CustomContainsDetailSerializer(CustomContainsSerializer):
+    measure_name = serializers.ReadOnlyField(source='measure.name')
+
+    class Meta(CustomContainsSerializer.Meta):
+        fields = CustomContainsSerializer.Meta.fields + ['measure_name']
+
+
+class RecipeFullSerializer(RecipeSerializer):
+    custom_contains = CustomContainsDetailSerializer(many=True, read_only=True)
+
+
+class RecipeSummarySerializer(serializers.ModelSerializer):
+    main_sizes = ImageSizesField(source='main')
+    stars_avg = serializers.ReadOnlyField(source='avg')
+    likes = serializers.ReadOnlyField(source='likes_')
+
+    class Meta:
+        model = Recipe
+        fields = ['id', 'food_name', 'main', 'main_sizes', 'stars_avg', 'likes']
+
+
+class RecipeMatchSerializer(RecipeSummarySerializer):
+    """
+    a recipe found by its ingredients, see search.ingredients.lookup
+    """
+    matched = serializers.IntegerField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeSummarySerializer.Meta):
+        fields = RecipeSummarySerializer.Meta.fields + ['matched', 'missing']
+
+
+class IngredientsLookupSerializer(serializers.Serializer):
+    have = serializers.ListField(child=serializers.CharField(max_length=150), max_length=50, required=False,
+                                 default=list)
+    require = serializers.ListField(child=serializers.CharField(max_length=150), max_length=20, required=False,
+                                    default=list)
+    missing = serializers.IntegerField(min_value=0, max_value=50, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    def validate(self, attrs):
+        if not attrs['have'] and not attrs['require']:
+            raise serializers.ValidationError('have or require at least one ingredient')
+        return attrs
+
+    def create(self, validated_data):
+        return None
+
+    def update(self, instance, validated_data):
+        return None
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), min_length=1,
+                                max_length=getattr(settings, 'RECIPE_MAX_LOOKUP_IDS', 100))
+
+    def create(self, validated_data):
+        return None
+
+    def update(self, instance, validated_data):
+        return None
+
+
+class RecipeDetailsQuerySerializer(serializers.Serializer):
+    # the number of the author's recipes, more are cut to max_recipes
+    recipes = serializers.IntegerField(min_value=0, default=10)
+    max_recipes = 50
+
+    def validate_recipes(self, value):
+        return min(value, self.max_recipes)
+
+    def create(self, validated_data):
+        return None
+
+    def update(self, instance, validated_data):
+        return None
+
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    # more are cut to max_limit
+    limit = serializers.IntegerField(min_value=0, default=10)
+    wilaya = serializers.IntegerField(required=False)
+    max_limit = 100
+
+    def validate_limit(self, value):
+        return min(value, self.max_limit)
+
+    def create(self, validated_data):
+        return None
+
+    def update(self, instance, validated_data):
+        return None
+
+
+class RankQuerySerializer(serializers.Serializer):
+    # on each side, more are cut to max_neighbours
+    neighbours = serializers.IntegerField(min_value=0, default=2)
+    scope = serializers.CharField(required=False)
+    max_neighbours = 20
+
+    def validate_neighbours(self, value):
+        return min(value, self.max_neighbours)
+
+    def create(self, validated_data):
+        return None
+
+    def update(self, instance, validated_data):
+        return None
+
+
+class RecipeFilterSerializer(serializers.Serializer):
+    wilaya = serializers.IntegerField(required=False)
+    cuisine = serializers.IntegerField(required=False)
+    type = serializers.IntegerField(required=False)
+    order = serializers.ChoiceField(choices=['popularity', 'rating', 'recent'], default='recent')
+
+    def get_filter_arguments(self) -> dict:
+        data = dict(self.validated_data)
+        data['meal_type'] = data.pop('type', None)
+        return data
+
+    def create(self, validated_data):
+        return None
+
+    def update(self, instance, validated_data):
+        return None
+
+
+class RecipeDetailsSerializer(serializers.Serializer):
+    """
+    the recipe page for the apps, serializes a recipe.details.RecipeDetails
+    """
+    recipe = RecipeFullSerializer(read_only=True)
+    liked = serializers.BooleanField(read_only=True)
+    rate = serializers.IntegerField(read_only=True)
+    author = serializers.SerializerMethodField()
+    author_recipes = RecipeSummarySerializer(many=True, read_only=True)
+
+    def get_author(self, details):
+        owner, summary = details.author.profile.owner, details.author_summary
+        return dict(id=owner.id, participant=details.author.pk, full_name=owner.full_name, username=owner.username,
+                    photo=owner.get_photo, likes=summary['likes_'], stars_sum=summary['stars_sum'],
+                    stars_count=summary['stars_count'], stars_avg=summary['avg'])
+
+
 class IngredientTypeSerializer(serializers.ModelSerializer):
     class Meta:
         model = IngredientType
@@ -202,9 +477,7 @@ class StarsRateSerializer(serializers.ModelSerializer):
 
 
 class ParticipantSerializer(serializers.ModelSerializer):
-    recipes_count = serializers.ReadOnlyField(
-        source='recipes.count'
-    )
+    recipes_count = serializers.SerializerMethodField(read_only=True)
     avg_rate = serializers.SerializerMethodField(read_only=True)
     sum_rate = serializers.SerializerMethodField(read_only=True)
     full_name = serializers.SerializerMethodField(read_only=True)
@@ -215,13 +488,33 @@ class ParticipantSerializer(serializers.ModelSerializer):
     photo = serializers.SerializerMethodField(read_only=True)
     username = serializers.SerializerMethodField(read_only=True)
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        the rates come from the participants' leaderboard scores and the owner's city and wilaya are joined,
+        so listing participants does not aggregate the rates nor query per row
+        """
+        recipes = Recipe.objects.filter(published_by=OuterRef('pk')).order_by().values('published_by') \
+            .annotate(count=Count('pk')).values('count')
+        return queryset.with_scores().select_related('profile__owner__lives_in__wilaya') \
+            .annotate(recipes_count=Coalesce(Subquery(recipes, output_field=IntegerField()), Value(0)))
+
     def get_id(self, obj):
         return obj.profile.owner.id
 
+    def get_recipes_count(self, obj):
+        if hasattr(obj, 'recipes_count'):
+            return obj.recipes_count
+        return obj.recipes.count()
+
     def get_avg_rate(self, obj):
+        if hasattr(obj, 'stars_count'):
+            return obj.stars_sum / obj.stars_count if obj.stars_count else None
         return obj.recipes.aggregate(avg=Avg('stars__stars')).get('avg')
 
     def get_sum_rate(self, obj):
+        if hasattr(obj, 'stars_count'):
+            return obj.stars_sum if obj.stars_count else None
         return obj.recipes.aggregate(sum=Sum('stars__stars')).get('sum')
 
     def get_full_name(self, obj):
@@ -1,5 +1,6 @@
 from django import template
-from django.contrib.auth.models import Group
+
+from base_backend.roles import has_role
 
 register = template.Library()
 
@@ -12,8 +13,7 @@ def has_group(user, group_name):
     :param group_name:
     :return:
     """
-    group = Group.objects.get(name=group_name)
-    return group in user.groups.all()
+    return has_role(user, group_name)
 
 
 @register.filter(name='has_perm')
@@ -1,3 +1,655 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from base_backend import storage
+from base_backend.images import derivative_name
+from base_backend.testing import QueryCountTestMixin
+from recipe import leaderboard, facets, viewer
+from recipe.models import Participant, Recipe, Like, Comment, StarsRate, ParticipantScore, RecipeImage, \
+    QuantityMeasure, Step, CustomContains, RecipeFacet
+from restaurants.models import User, Client, Cuisine, MealType, Wilaya, City
+
+
+class RecipeTestMixin:
+    """
+    creates participants and their recipes
+    """
+    users = 0
+
+    def add_client(self) -> Client:
+        self.users += 1
+        user = User.objects.create(username="tester {}".format(self.users), first_name="tester",
+                                   last_name="tester", phone="+2138991363{:02}".format(self.users), user_type="C",
+                                   is_active=True)
+        return Client.objects.create(owner=user, is_participant=True)
+
+    def add_participant(self) -> Participant:
+        Group.objects.get_or_create(name='participant')
+        client = self.add_client()
+        client.participant = Participant.objects.create(profile=client)
+        client.save()
+        return client.participant
+
+    def add_recipe(self, participant=None, **kwargs) -> Recipe:
+        cuisine, _ = Cuisine.objects.get_or_create(name="test")
+        meal_type, _ = MealType.objects.get_or_create(type="test")
+        # the pictures are listed from the media directory
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        fields = dict(food_name="recipe {}".format(Recipe.objects.count()), cost=10, description="test",
+                      cuisine=cuisine, type=meal_type, media=media)
+        fields.update(kwargs)
+        return Recipe.objects.create(published_by=participant or self.add_participant(), **fields)
+
+
+class RecipeCountersTestCase(RecipeTestMixin, QueryCountTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.recipe = self.add_recipe()
+        self.clients = [self.add_client() for _ in range(3)]
+
+    def assertCounters(self, likes, comments, stars, stars_sum):
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        self.assertEqual((recipe.likes_count, recipe.comments_count, recipe.stars_count, recipe.stars_sum),
+                         (likes, comments, stars, stars_sum))
+
+    def test_counters_follow_the_ratings(self):
+        likes = [Like.objects.create(user=client, recipe=self.recipe) for client in self.clients]
+        Comment.objects.create(user=self.clients[0], recipe=self.recipe, comment="test")
+        rates = [StarsRate.objects.create(user=client, recipe=self.recipe, stars=i + 3)
+                 for i, client in enumerate(self.clients)]
+        self.assertCounters(3, 1, 3, 12)
+
+        rates[0].stars = 1
+        rates[0].save()
+        self.assertCounters(3, 1, 3, 10)
+        self.assertAlmostEqual(Recipe.objects.get(pk=self.recipe.pk).stars_avg, 10 / 3)
+
+        likes[0].delete()
+        Comment.objects.all().delete()
+        StarsRate.objects.get(pk=rates[1].pk).delete()
+        self.assertCounters(2, 0, 2, 6)
+
+    def test_reconcile_repairs_drift(self):
+        # bulk_create skips the receivers
+        Like.objects.bulk_create([Like(user=client, recipe=self.recipe) for client in self.clients])
+        StarsRate.objects.bulk_create([StarsRate(user=client, recipe=self.recipe, stars=4) for client in self.clients])
+        self.assertCounters(0, 0, 0, 0)
+        call_command('reconcile_recipe_counters', '--dry-run')
+        self.assertCounters(0, 0, 0, 0)
+        call_command('reconcile_recipe_counters')
+        self.assertCounters(3, 0, 3, 12)
+
+    def test_api_reads_the_counters(self):
+        StarsRate.objects.create(user=self.clients[0], recipe=self.recipe, stars=4)
+        Like.objects.create(user=self.clients[0], recipe=self.recipe)
+        response = self.client.get('/recipe/api/recipes/{}/'.format(self.recipe.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([response.data[key] for key in ('likes', 'comments', 'stars', 'stars_avg', 'stars_sum')],
+                         [1, 0, 1, 4, 4])
+
+    def test_recipes_list_runs_a_fixed_number_of_queries(self):
+        def grow():
+            recipe = self.add_recipe()
+            Like.objects.create(user=self.clients[0], recipe=recipe)
+            StarsRate.objects.create(user=self.clients[0], recipe=recipe, stars=5)
+
+        self.assertConstantQueries(lambda: self.client.get('/recipe/api/recipes/'), grow)
+
+    def test_participants_ranking(self):
+        StarsRate.objects.create(user=self.clients[0], recipe=self.recipe, stars=2)
+        other = self.add_recipe()
+        for client in self.clients:
+            StarsRate.objects.create(user=client, recipe=other, stars=5)
+        self.add_participant()
+        ranking = list(Participant.objects.with_scores().order_by('-stars_sum'))
+        self.assertEqual([(participant.stars_sum, participant.avg) for participant in ranking[:2]],
+                         [(15, 5), (2, 2)])
+        self.assertIsNone(ranking[2].avg)
+
+
+class LeaderboardTestCase(RecipeTestMixin, QueryCountTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.wilayas = [Wilaya.objects.create(name=name, matricule=i, code_postal=i)
+                        for i, name in enumerate(("alger", "oran"))]
+        self.cities = [City.objects.create(name=wilaya.name, code_postal=0, wilaya=wilaya) for wilaya in self.wilayas]
+        self.recipes = [self.add_recipe() for _ in range(4)]
+        self.participants = [recipe.published_by for recipe in self.recipes]
+        for participant, city in zip(self.participants, (0, 1, 0, 1)):
+            owner = participant.profile.owner
+            owner.lives_in = self.cities[city]
+            owner.save()
+        self.raters = [self.add_client() for _ in range(3)]
+
+    def rate(self, recipe, *stars):
+        return [StarsRate.objects.create(user=client, recipe=recipe, stars=value)
+                for client, value in zip(self.raters, stars)]
+
+    def test_scores_follow_the_rates(self):
+        rates = self.rate(self.recipes[0], 5, 4)
+        Like.objects.create(user=self.raters[0], recipe=self.recipes[0])
+        score = ParticipantScore.objects.get(pk=self.participants[0].pk)
+        self.assertEqual((score.stars_sum, score.stars_count, score.likes_count, score.wilaya),
+                         (9, 2, 1, self.wilayas[0]))
+
+        rates[0].stars = 1
+        rates[0].save()
+        rates[1].delete()
+        self.assertEqual(ParticipantScore.objects.get(pk=self.participants[0].pk).stars_sum, 1)
+
+    def test_rank_and_neighbours(self):
+        for recipe, stars in zip(self.recipes, ((1,), (5, 5), (3, 4), (5, 5))):
+            self.rate(recipe, *stars)
+        # 1 and 3 are tied, the lower id ranks first
+        expected = [self.participants[i] for i in (1, 3, 2, 0)]
+        self.assertEqual(list(leaderboard.top(4)), expected)
+        scores = {score.pk: score for score in ParticipantScore.objects.all()}
+        self.assertEqual([leaderboard.rank(scores[participant.pk]) for participant in expected], [1, 2, 3, 4])
+        above, below = leaderboard.neighbours(scores[self.participants[2].pk], 1)
+        self.assertEqual((above, below), ([self.participants[3]], [self.participants[0]]))
+
+        self.assertEqual(list(leaderboard.top(4, self.wilayas[0])), [self.participants[2], self.participants[0]])
+        self.assertEqual(leaderboard.rank(scores[self.participants[0].pk], self.wilayas[0]), 2)
+
+        # moving follows the participant
+        owner = self.participants[0].profile.owner
+        owner.lives_in = self.cities[1]
+        owner.save()
+        self.assertEqual(leaderboard.rank(ParticipantScore.objects.get(pk=self.participants[0].pk),
+                                          self.wilayas[1].pk), 3)
+
+    def test_api(self):
+        self.rate(self.recipes[2], 5)
+        response = self.client.get('/recipe/api/participants/leaderboard/', {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row['participant_id'], row['rank'], row['sum_rate']) for row in response.data],
+                         [(self.participants[2].participant_id, 1, 5), (self.participants[0].participant_id, 2, None)])
+
+        response = self.client.get('/recipe/api/participants/{}/rank/'.format(self.participants[0].pk),
+                                   {'scope': 'wilaya'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['rank'], 2)
+        self.assertEqual([row['rank'] for row in response.data['above']], [1])
+        self.assertEqual(response.data['below'], [])
+
+    def test_api_validates_the_queries(self):
+        url = '/recipe/api/participants/{}/rank/'.format(self.participants[0].pk)
+        self.assertEqual(self.client.get('/recipe/api/participants/leaderboard/', {'limit': -1}).status_code, 400)
+        self.assertEqual(self.client.get('/recipe/api/participants/leaderboard/', {'wilaya': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'neighbours': -1}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'neighbours': 0}).data['above'], [])
+        ParticipantScore.objects.filter(pk=self.participants[0].pk).delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_deferred_cities_arent_loaded(self):
+        with self.assertNumQueries(1):
+            list(User.objects.only('pk', 'username'))
+        # moving a user loaded without its city still moves its score
+        owner = User.objects.only('pk').get(pk=self.participants[0].profile.owner.pk)
+        owner.lives_in = self.cities[1]
+        owner.save()
+        self.assertEqual(ParticipantScore.objects.get(pk=self.participants[0].pk).wilaya, self.wilayas[1])
+
+    def test_list_runs_a_fixed_number_of_queries(self):
+        self.assertConstantQueries(lambda: self.client.get('/recipe/api/participants/leaderboard/'),
+                                   lambda: self.rate(self.add_recipe(), 3))
+
+    def test_reconcile_repairs_the_scores(self):
+        self.rate(self.recipes[1], 4, 4)
+        ParticipantScore.objects.update(stars_sum=0, stars_count=0)
+        call_command('reconcile_recipe_counters')
+        score = ParticipantScore.objects.get(pk=self.participants[1].pk)
+        self.assertEqual((score.stars_sum, score.stars_count), (8, 2))
+
+
+class RecipeImagesTestCase(RecipeTestMixin, TestCase):
+    def setUp(self) -> None:
+        # the uploads and their blobs
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root, MEDIA_BLOBS_ROOT=os.path.join(media_root, '.blobs'))
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.recipe = self.add_recipe()
+
+    def test_uploads_are_indexed(self):
+        self.recipe.add_picture(SimpleUploadedFile("a.jpg", b"image"))
+        self.assertTrue(os.path.isfile(os.path.join(self.recipe.media, "a.jpg")))
+        picture = RecipeImage.objects.get()
+        with mock.patch('os.listdir', side_effect=AssertionError('listed the media directory')):
+            recipe = Recipe.objects.prefetch_related('pictures').get(pk=self.recipe.pk)
+            with self.assertNumQueries(0):
+                self.assertEqual(recipe.pictures_urls, [picture.url])
+        self.assertTrue(recipe.pictures_urls[0].endswith("/recipe/{}/a.jpg".format(self.recipe.pk)))
+
+    def test_index_media(self):
+        self.recipe.add_picture(SimpleUploadedFile("a.jpg", b"image a"))
+        self.recipe.add_picture(SimpleUploadedFile("b.jpg", b"image b"))
+        # copied by hand, and removed by hand
+        with open(os.path.join(self.recipe.media, "c.jpg"), 'wb') as file:
+            file.write(b"image")
+        os.remove(os.path.join(self.recipe.media, "a.jpg"))
+
+        call_command('index_media', '--dry-run')
+        self.assertEqual(sorted(self.recipe.pictures.values_list('name', flat=True)), ["a.jpg", "b.jpg"])
+        call_command('index_media')
+        self.assertEqual(sorted(self.recipe.pictures.values_list('name', flat=True)), ["b.jpg", "c.jpg"])
+
+    def test_duplicates_are_dropped(self):
+        picture = self.recipe.add_picture(SimpleUploadedFile("a.jpg", b"image"))
+        self.assertEqual(self.recipe.add_picture(SimpleUploadedFile("b.jpg", b"image")), picture)
+        self.assertEqual(sorted(os.listdir(self.recipe.media)), ["a.jpg"])
+        self.assertEqual(picture.sha256, hashlib.sha256(b"image").hexdigest())
+
+    @override_settings(IMAGE_DERIVATIVES_ASYNC=False)
+    @mock.patch('base_backend.images.transaction.on_commit', lambda function: function())
+    def test_derivatives(self):
+        content = io.BytesIO()
+        Image.new('RGB', (1600, 1200), 'red').save(content, 'PNG')
+        self.recipe.add_picture(SimpleUploadedFile("a.png", content.getvalue()))
+        with Image.open(os.path.join(self.recipe.media, "derivatives", "a.thumbnail.webp")) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (200, 150)))
+        self.assertTrue(os.path.isfile(os.path.join(self.recipe.media, "derivatives", "a.medium.webp")))
+
+        response = self.client.get('/recipe/api/recipes/{}/'.format(self.recipe.pk))
+        sizes = response.data['pictures_sizes'][0]
+        self.assertTrue(sizes['original'].endswith("/recipe/{}/a.png".format(self.recipe.pk)))
+        self.assertTrue(sizes['thumbnail'].endswith("/recipe/{}/derivatives/a.thumbnail.webp".format(self.recipe.pk)))
+        self.assertEqual(RecipeImage.objects.get().derivatives, "thumbnail medium")
+        self.assertIsNone(response.data['main_sizes'])
+
+    @override_settings(IMAGE_DERIVATIVES_ASYNC=False)
+    @mock.patch('base_backend.images.transaction.on_commit', lambda function: function())
+    def test_only_generated_sizes_are_served(self):
+        # not an image: it never gets derivatives
+        with self.assertLogs('base_backend.images', 'ERROR'):
+            self.recipe.add_picture(SimpleUploadedFile("a.png", b"not an image"))
+            self.recipe.main.save("main.png", ContentFile(b"not an image"))
+        response = self.client.get('/recipe/api/recipes/{}/'.format(self.recipe.pk))
+        self.assertEqual(list(response.data['pictures_sizes'][0]), ['original'])
+        self.assertEqual(list(response.data['main_sizes']), ['original'])
+
+    @override_settings(IMAGE_DERIVATIVES_ASYNC=False)
+    @mock.patch('base_backend.images.transaction.on_commit', lambda function: function())
+    def test_image_fields_sizes_are_recorded(self):
+        content = io.BytesIO()
+        Image.new('RGB', (400, 400), 'red').save(content, 'PNG')
+        self.recipe.main.save("main.png", ContentFile(content.getvalue()))
+        self.assertEqual(Recipe.objects.get(pk=self.recipe.pk).main_derivatives, "thumbnail medium")
+        self.add_recipe()
+        # the urls are built from the records, the disk isn't touched while listing
+        with mock.patch('os.stat', side_effect=AssertionError('touched the disk')):
+            response = self.client.get('/recipe/api/recipes/')
+        sizes = {recipe['id']: recipe['main_sizes'] for recipe in response.data}
+        self.assertTrue(sizes[self.recipe.pk]['thumbnail'].endswith(
+            derivative_name(self.recipe.main.url, 'thumbnail')))
+        self.assertEqual(list(filter(None, sizes.values())), [sizes[self.recipe.pk]])
+        # replaced: the new file's sizes are served once generated
+        with mock.patch('base_backend.images.make_derivatives', side_effect=OSError('failed')), \
+                self.assertLogs('base_backend.images', 'ERROR'):
+            self.recipe.main.save("other.png", ContentFile(content.getvalue()))
+        self.assertEqual(list(self.client.get('/recipe/api/recipes/{}/'.format(self.recipe.pk)).data['main_sizes']),
+                         ['original'])
+
+    @override_settings(IMAGE_DERIVATIVES_ASYNC=False)
+    @mock.patch('base_backend.images.transaction.on_commit', lambda function: function())
+    def test_replaced_pictures_are_derived_again(self):
+        for color in ('red', 'blue'):
+            content = io.BytesIO()
+            Image.new('RGB', (400, 400), color).save(content, 'PNG')
+            self.recipe.add_picture(SimpleUploadedFile("a.png", content.getvalue()))
+        with Image.open(os.path.join(self.recipe.media, "derivatives", "a.thumbnail.webp")) as thumbnail:
+            red, green, blue = thumbnail.convert('RGB').getpixel((0, 0))
+        self.assertGreater(blue, red)
+
+    def test_contents_are_stored_once(self):
+        other = self.add_recipe()
+        self.recipe.add_picture(SimpleUploadedFile("a.jpg", b"image"))
+        other.add_picture(SimpleUploadedFile("b.jpg", b"image"))
+        first, second = os.path.join(self.recipe.media, "a.jpg"), os.path.join(other.media, "b.jpg")
+        self.assertTrue(os.path.samefile(first, second))
+        self.recipe.main.save("main.jpg", ContentFile(b"image"))
+        self.assertTrue(os.path.samefile(first, self.recipe.main.path))
+        self.assertEqual(storage.collect_garbage(grace=0), (0, 0))
+
+        for path in (first, second, self.recipe.main.path):
+            os.remove(path)
+        self.assertEqual(storage.collect_garbage(grace=0), (1, len(b"image")))
+        self.assertEqual(list(storage.iter_blobs()), [])
+
+    @override_settings(FILE_UPLOAD_PERMISSIONS=0o644)
+    def test_uploads_are_readable(self):
+        self.recipe.add_picture(SimpleUploadedFile("a.jpg", b"image"))
+        self.recipe.main.save("main.jpg", ContentFile(b"main"))
+        for path in (os.path.join(self.recipe.media, "a.jpg"), self.recipe.main.path):
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o644)
+
+    def test_uploads_dont_overwrite_a_taken_name(self):
+        name = default_storage.save("taken/a.jpg", ContentFile(b"first"))
+        # taken between the choice of the name and the write
+        other = default_storage._save(name, ContentFile(b"second"))
+        self.assertNotEqual(other, name)
+        with default_storage.open(name) as file:
+            self.assertEqual(file.read(), b"first")
+
+    def test_dedupe_media(self):
+        for directory in ("one", "two"):
+            os.makedirs(os.path.join(settings.MEDIA_ROOT, directory))
+            with open(os.path.join(settings.MEDIA_ROOT, directory, "a.jpg"), 'wb') as file:
+                file.write(b"image")
+        paths = [os.path.join(settings.MEDIA_ROOT, directory, "a.jpg") for directory in ("one", "two")]
+        call_command('dedupe_media')
+        self.assertFalse(os.path.samefile(*paths))
+        call_command('dedupe_media', '--apply')
+        self.assertTrue(os.path.samefile(*paths))
+        self.assertEqual(len(list(storage.iter_blobs())), 1)
+
+
+class RecipeItemsBulkTestCase(RecipeTestMixin, QueryCountTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.recipe = self.add_recipe()
+        self.measure = QuantityMeasure.objects.create(name="g")
+        self.client.force_login(self.recipe.published_by.profile.owner)
+
+    def write(self, items, payload):
+        return self.client.post('/recipe/api/recipes/{}/{}/bulk/'.format(self.recipe.pk, items), payload,
+                                content_type='application/json')
+
+    def create_steps(self, count):
+        return self.write('steps', {'create': [{'number': i, 'description': "step {}".format(i)}
+                                               for i in range(count)]})
+
+    def test_steps(self):
+        response = self.create_steps(30)
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['created'], len(response.data['steps'])), (30, 30))
+        steps = list(self.recipe.steps.order_by('number'))
+
+        response = self.write('steps', {
+            'create': [{'number': 30, 'description': "last"}],
+            'update': [{'id': step.pk, 'description': "updated"} for step in steps[:10]],
+            'delete': [step.pk for step in steps[10:20]],
+        })
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([response.data[key] for key in ('created', 'updated', 'deleted')], [1, 10, 10])
+        self.assertEqual(self.recipe.steps.count(), 21)
+        self.assertEqual(self.recipe.steps.filter(description="updated").count(), 10)
+        self.assertEqual(Step.objects.get(pk=steps[0].pk).number, 0)
+
+    def test_ingredients(self):
+        response = self.write('ingredients', {'create': [
+            {'ingredient': "ingredient {}".format(i), 'quantity': i, 'measure': self.measure.pk} for i in range(40)]})
+        self.assertEqual(response.status_code, 200, response.data)
+        ingredient = self.recipe.custom_contains.first()
+        response = self.write('ingredients', {'update': [{'id': ingredient.pk, 'quantity': 100, 'measure': None}]})
+        self.assertEqual(response.status_code, 200, response.data)
+        ingredient.refresh_from_db()
+        self.assertEqual((ingredient.quantity, ingredient.measure), (100, None))
+
+    def test_writes_run_a_fixed_number_of_queries(self):
+        self.assertEqual(self.count_queries(lambda: self.create_steps(1)),
+                         self.count_queries(lambda: self.create_steps(30)))
+
+    def test_invalid_batches_write_nothing(self):
+        self.create_steps(2)
+        other = self.add_recipe()
+        foreign = Step.objects.create(recipe=other, number=0, description="other")
+        for payload in ({'create': [{'number': 3, 'description': "new"}], 'delete': [foreign.pk]},
+                        {'create': [{'number': 3, 'description': "new"}, {'description': "no number"}]},
+                        {'update': [{'description': "no id"}]}):
+            response = self.write('steps', payload)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(self.recipe.steps.count(), 2)
+        response = self.write('ingredients', {'create': [{'ingredient': "salt", 'quantity': 1, 'measure': 0}]})
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_the_owner_writes(self):
+        self.client.force_login(self.add_client().owner)
+        self.assertEqual(self.create_steps(1).status_code, 403)
+
+    def test_list_posts_return_the_created_items(self):
+        response = self.client.post('/recipe/api/steps/', [{'number': i, 'description': "step {}".format(i),
+                                                             'recipe': self.recipe.pk} for i in range(2)],
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual([step['id'] for step in response.data],
+                         list(self.recipe.steps.order_by('pk').values_list('pk', flat=True)))
+
+
+class RecipeDetailsTestCase(RecipeTestMixin, QueryCountTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.recipe = self.add_recipe()
+        self.measure = QuantityMeasure.objects.create(name="g")
+        self.viewer = self.add_client()
+        self.client.force_login(self.viewer.owner)
+
+    def grow(self):
+        number = self.recipe.steps.count()
+        Step.objects.create(recipe=self.recipe, number=number, description="step")
+        CustomContains.objects.create(recipe=self.recipe, ingredient="salt", quantity=number, measure=self.measure)
+        client = self.add_client()
+        Like.objects.create(user=client, recipe=self.recipe)
+        StarsRate.objects.create(user=client, recipe=self.recipe, stars=4)
+        Comment.objects.create(user=client, recipe=self.recipe, comment="test")
+        self.add_recipe(self.recipe.published_by)
+
+    def test_full(self):
+        self.grow()
+        Like.objects.create(user=self.viewer, recipe=self.recipe)
+        StarsRate.objects.create(user=self.viewer, recipe=self.recipe, stars=2)
+        response = self.client.get('/recipe/api/recipes/{}/full/'.format(self.recipe.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['liked'], response.data['rate']), (True, 2))
+        self.assertEqual(response.data['recipe']['custom_contains'][0]['measure_name'], "g")
+        self.assertEqual([recipe['id'] for recipe in response.data['author_recipes']],
+                         [recipe.pk for recipe in self.recipe.published_by.recipes.order_by('-created_at')])
+        self.assertEqual((response.data['author']['likes'], response.data['author']['stars_avg']), (2, 3))
+        self.assertEqual(self.client.get('/recipe/api/recipes/0/full/').status_code, 404)
+        self.assertEqual(self.client.get('/recipe/api/recipes/abc/full/').status_code, 404)
+
+    def test_full_query(self):
+        url = '/recipe/api/recipes/{}/full/'.format(self.recipe.pk)
+        self.assertEqual(self.client.get(url, {'recipes': 0}).data['author_recipes'], [])
+        for recipes in (-1, 'abc'):
+            self.assertEqual(self.client.get(url, {'recipes': recipes}).status_code, 400)
+        # an author without a leaderboard score yet
+        ParticipantScore.objects.filter(pk=self.recipe.published_by_id).delete()
+        response = self.client.get(url)
+        self.assertEqual((response.data['author']['likes'], response.data['author']['stars_avg']), (0, None))
+
+    def test_full_runs_a_fixed_number_of_queries(self):
+        self.assertConstantQueries(lambda: self.client.get('/recipe/api/recipes/{}/full/'.format(self.recipe.pk)),
+                                   self.grow)
+
+    def test_page_runs_a_fixed_number_of_queries(self):
+        def get():
+            response = self.client.get('/recipe/recipes/{}/details/'.format(self.recipe.pk))
+            self.assertEqual(response.status_code, 200)
+
+        # caches the viewer's roles
+        get()
+        self.assertConstantQueries(get, self.grow)
+
+
+class RecipeFacetsTestCase(RecipeTestMixin, QueryCountTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.wilayas = [Wilaya.objects.create(name=name, matricule=i, code_postal=i)
+                        for i, name in enumerate(("alger", "oran"))]
+        self.cities = [City.objects.create(name=wilaya.name, code_postal=0, wilaya=wilaya) for wilaya in self.wilayas]
+        self.cuisines = [Cuisine.objects.create(name=name) for name in ("kabyle", "oranaise")]
+        self.authors = [self.add_participant() for _ in self.wilayas]
+        for author, city in zip(self.authors, self.cities):
+            author.profile.owner.lives_in = city
+            author.profile.owner.save()
+        self.clients = [self.add_client() for _ in range(3)]
+        # alger: 2 kabyle, 1 oranaise; oran: 1 oranaise. the home page shows their main pictures
+        kabyle, oranaise = self.cuisines
+        self.recipes = [self.add_recipe(author, cuisine=cuisine, main="recipe/main/test.jpg")
+                        for author, cuisine in ((self.authors[0], kabyle), (self.authors[0], kabyle),
+                                                (self.authors[0], oranaise), (self.authors[1], oranaise))]
+
+    def facet(self, recipe) -> RecipeFacet:
+        return RecipeFacet.objects.get(recipe=recipe)
+
+    def test_facets_follow_the_recipes(self):
+        recipe = self.recipes[0]
+        self.assertEqual((self.facet(recipe).wilaya, self.facet(recipe).cuisine), (self.wilayas[0], self.cuisines[0]))
+        Like.objects.create(user=self.clients[0], recipe=recipe)
+        StarsRate.objects.create(user=self.clients[0], recipe=recipe, stars=4)
+        rate = StarsRate.objects.create(user=self.clients[1], recipe=recipe, stars=1)
+        self.assertEqual((self.facet(recipe).likes_count, self.facet(recipe).stars_avg), (1, 2.5))
+        rate.delete()
+        self.assertEqual(self.facet(recipe).stars_avg, 4)
+        recipe.cuisine = self.cuisines[1]
+        recipe.save()
+        self.assertEqual(self.facet(recipe).cuisine, self.cuisines[1])
+        user = self.authors[0].profile.owner
+        user.lives_in = self.cities[1]
+        user.save()
+        self.assertEqual(self.facet(recipe).wilaya, self.wilayas[1])
+
+    def test_filter_and_sort(self):
+        Like.objects.create(user=self.clients[0], recipe=self.recipes[1])
+        StarsRate.objects.create(user=self.clients[0], recipe=self.recipes[2], stars=5)
+        self.assertEqual(list(facets.filter_recipes(wilaya=self.wilayas[0], order='recent')),
+                         self.recipes[2::-1])
+        self.assertEqual(list(facets.filter_recipes(cuisine=self.cuisines[0], order='popularity')),
+                         [self.recipes[1], self.recipes[0]])
+        self.assertEqual(list(facets.filter_recipes(order='rating'))[0], self.recipes[2])
+        self.assertEqual(list(facets.filter_recipes(wilaya=self.wilayas[1].pk, cuisine=self.cuisines[0].pk)), [])
+
+    def test_facet_counts(self):
+        self.assertEqual(facets.facet_counts(), {
+            'cuisine': {self.cuisines[0].pk: 2, self.cuisines[1].pk: 2},
+            'wilaya': {self.wilayas[0].pk: 3, self.wilayas[1].pk: 1},
+        })
+        # each facet is counted with the other filters
+        self.assertEqual(facets.facet_counts(wilaya=self.wilayas[1].pk, cuisine=self.cuisines[0].pk), {
+            'cuisine': {self.cuisines[1].pk: 1},
+            'wilaya': {self.wilayas[0].pk: 2},
+        })
+
+    def test_home_filter(self):
+        from restaurants.forms import FilterRecipeForm
+
+        def render():
+            form = FilterRecipeForm(data={'wilaya': self.wilayas[0].pk, 'popularity': True})
+            self.assertTrue(form.is_valid())
+            return [recipe.published_by.profile.owner.username for recipe in form.filter()]
+
+        self.assertEqual(len(render()), 3)
+        self.assertConstantQueries(render, lambda: self.add_recipe(self.authors[0]))
+        response = self.client.post('/', {'cuisine': self.cuisines[1].pk, 'recently_added': True})
+        self.assertEqual(response.json()['facets']['wilaya'], {str(self.wilayas[0].pk): 1, str(self.wilayas[1].pk): 1})
+
+    def test_api(self):
+        response = self.client.get('/recipe/api/recipes/filter/', {'wilaya': self.wilayas[0].pk, 'order': 'recent'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([recipe['id'] for recipe in response.data['results']],
+                         [recipe.pk for recipe in self.recipes[2::-1]])
+        self.assertEqual(sorted((row['id'], row['count']) for row in response.data['facets']['cuisine']),
+                         [(self.cuisines[0].pk, 2), (self.cuisines[1].pk, 1)])
+        self.assertEqual(self.client.get('/recipe/api/recipes/filter/', {'order': 'x'}).status_code, 400)
+
+    def test_reconcile_repairs_the_facets(self):
+        RecipeFacet.objects.filter(recipe=self.recipes[0]).update(likes_count=7, wilaya=None)
+        RecipeFacet.objects.filter(recipe=self.recipes[1]).delete()
+        with mock.patch('builtins.print'):
+            call_command('reconcile_recipe_counters')
+        self.assertEqual((self.facet(self.recipes[0]).likes_count, self.facet(self.recipes[0]).wilaya),
+                         (0, self.wilayas[0]))
+        self.assertEqual(self.facet(self.recipes[1]).cuisine, self.cuisines[0])
+
+
+@override_settings(RECIPE_LIKES_CACHE='default')
+class ViewerStateTestCase(RecipeTestMixin, QueryCountTestMixin, TestCase):
+    def setUp(self) -> None:
+        # the liked recipes are cached per user id, which the other tests reuse
+        cache.clear()
+        self.recipes = [self.add_recipe() for _ in range(3)]
+        self.viewer = self.add_client()
+        self.client.force_login(self.viewer.owner)
+
+    def test_viewer_state_follows_the_likes_and_rates(self):
+        ids = {'ids': [recipe.pk for recipe in self.recipes]}
+        Like.objects.create(user=self.viewer, recipe=self.recipes[0])
+        StarsRate.objects.create(user=self.viewer, recipe=self.recipes[1], stars=4)
+        response = self.client.get('/recipe/api/recipes/viewer-state/', ids)
+        self.assertEqual(response.data, {
+            self.recipes[0].pk: {'liked': True, 'starred': False, 'stars': None},
+            self.recipes[1].pk: {'liked': False, 'starred': True, 'stars': 4},
+            self.recipes[2].pk: {'liked': False, 'starred': False, 'stars': None},
+        })
+
+        # the cached likes are dropped by a like and an unlike
+        Like.objects.create(user=self.viewer, recipe=self.recipes[2])
+        Like.objects.get(user=self.viewer, recipe=self.recipes[0]).delete()
+        response = self.client.get('/recipe/api/recipes/viewer-state/', ids)
+        self.assertEqual([response.data[recipe.pk]['liked'] for recipe in self.recipes], [False, False, True])
+        response = self.client.get('/recipe/api/rating/like/check-like/', {'recipe': self.recipes[2].pk})
+        self.assertTrue(response.data['liked'])
+
+    def test_likes_are_dropped_from_the_cache_once_committed(self):
+        key = viewer.LIKED_KEY.format(self.viewer.owner.pk)
+        with mock.patch('recipe.viewer.transaction.on_commit') as on_commit:
+            Like.objects.create(user=self.viewer, recipe=self.recipes[0])
+            # cached by a concurrent request before the like is committed
+            cache.set(key, frozenset())
+            for call in on_commit.call_args_list:
+                call[0][0]()
+        self.assertEqual(viewer.get_liked_recipes(self.viewer.owner), {self.recipes[0].pk})
+
+    @override_settings(RECIPE_LIKES_CACHE=None)
+    def test_likes_arent_cached_without_a_shared_cache(self):
+        viewer.get_liked_recipes(self.viewer.owner)
+        self.assertIsNone(cache.get(viewer.LIKED_KEY.format(self.viewer.owner.pk)))
+        Like.objects.create(user=self.viewer, recipe=self.recipes[0])
+        self.assertEqual(viewer.get_liked_recipes(self.viewer.owner), {self.recipes[0].pk})
+
+    @override_settings(RECIPE_LIKES_CACHE=None)
+    def test_likes_dont_load_their_client_without_a_shared_cache(self):
+        with CaptureQueriesContext(connection) as queries:
+            Like.objects.create(user_id=self.viewer.pk, recipe=self.recipes[0]).delete()
+        self.assertFalse([query for query in queries if 'restaurants_client' in query['sql']])
+
+    def test_viewer_state_runs_a_fixed_number_of_queries(self):
+        def get():
+            response = self.client.get('/recipe/api/recipes/viewer-state/',
+                                       {'ids': [recipe.pk for recipe in Recipe.objects.all()]})
+            self.assertEqual(len(response.data), Recipe.objects.count())
+
+        def grow():
+            recipe = self.add_recipe()
+            Like.objects.create(user=self.viewer, recipe=recipe)
+            StarsRate.objects.create(user=self.viewer, recipe=recipe, stars=3)
+            # caches the liked recipes again
+            get()
+
+        get()
+        self.assertConstantQueries(get, grow)
+
+    def test_lists_include_the_viewer_state(self):
+        Like.objects.create(user=self.viewer, recipe=self.recipes[1])
+        response = self.client.get('/recipe/api/recipes/filter/', {'include': 'viewer_state'})
+        self.assertEqual({recipe['id']: recipe['viewer_state']['liked'] for recipe in response.data['results']},
+                         {self.recipes[0].pk: False, self.recipes[1].pk: True, self.recipes[2].pk: False})
+        response = self.client.get('/recipe/api/recipes/', {'include': 'viewer_state'})
+        self.assertTrue(all('viewer_state' in recipe for recipe in response.data))
+        self.assertNotIn('viewer_state', self.client.get('/recipe/api/recipes/').data[0])
+        self.assertEqual(self.client.get('/recipe/api/recipes/viewer-state/').status_code, 400)
@@ -0,0 +1,82 @@
+"""
+the viewer's state of a list of recipes: whether the user liked them, rated them and how many stars.
+the ids of the recipes a user liked are read in one query. with RECIPE_LIKES_CACHE, the alias of a cache shared by
+every worker process (memcached, redis...), they are loaded once and shared across requests for
+RECIPE_LIKES_CACHE_TIMEOUT seconds, a like or an unlike drops them once committed, see the Like receivers in
+recipe.models. a per process cache (locmem) would keep serving them stale to the other processes.
+the stars are read in one query on the (user, recipe) unique index of the stars rates, whatever the number of recipes.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+LIKED_KEY = 'recipe:liked:{}'
+
+
+def _timeout() -> int:
+    return getattr(settings, 'RECIPE_LIKES_CACHE_TIMEOUT', 300)
+
+
+def _cache():
+    alias = getattr(settings, 'RECIPE_LIKES_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def get_liked_recipes(user) -> frozenset:
+    """
+    :param user: a user, anonymous users like nothing
+    :return: the ids of the recipes the user liked
+    """
+    from recipe.models import Like
+
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    cache = _cache()
+    liked = cache.get(LIKED_KEY.format(user.pk)) if cache is not None else None
+    if liked is None:
+        liked = frozenset(Like.objects.filter(user__owner=user).values_list('recipe', flat=True))
+        if cache is not None:
+            cache.set(LIKED_KEY.format(user.pk), liked, _timeout())
+    return liked
+
+
+def invalidate_liked_recipes(*users) -> None:
+    """
+    drops the cached liked recipes of the given users now and once the current transaction commits, a request
+    reading them meanwhile would cache them as they were before it
+    :param users: users or user ids
+    """
+    cache = _cache()
+    if cache is None:
+        return
+    keys = [LIKED_KEY.format(getattr(user, 'pk', user)) for user in users]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_clients_liked_recipes(*clients) -> None:
+    """
+    invalidate_liked_recipes for the users of the clients, looked up only when the likes are cached
+    :param clients: the client ids, the likes' users
+    """
+    from restaurants.models import Client
+
+    if _cache() is None:
+        return
+    invalidate_liked_recipes(*Client.objects.filter(pk__in=clients).values_list('owner_id', flat=True))
+
+
+def get_viewer_state(user, recipe_ids) -> dict:
+    """
+    :param user: the viewer
+    :param recipe_ids: the recipes of a feed
+    :return: recipe id -> {'liked': bool, 'starred': bool, 'stars': the viewer's stars or None}
+    """
+    from recipe.models import StarsRate
+
+    liked = get_liked_recipes(user)
+    stars = {}
+    if user is not None and user.is_authenticated and recipe_ids:
+        stars = dict(StarsRate.objects.filter(user__owner=user, recipe__in=recipe_ids).values_list('recipe', 'stars'))
+    return {recipe_id: {'liked': recipe_id in liked, 'starred': recipe_id in stars, 'stars': stars.get(recipe_id)}
+            for recipe_id in recipe_ids}
@@ -2,7 +2,7 @@ import os
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required, permission_required
-from django.db.models import Sum, Q, Avg, Count
+from django.db.models import Q
 from django.http import Http404
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy
@@ -12,8 +12,8 @@ from django.utils.translation import gettext_lazy as _
 from django.views import View
 from django.views.generic import ListView, UpdateView, DeleteView, DetailView, CreateView
 
-from base_backend.models import Round
-from base_backend.utils import handle_uploaded_file
+from recipe import leaderboard
+from recipe.details import get_recipe_details
 from recipe.forms import CreateRecipeForm, RecipeSteps, CustomRecipeIngredient
 from recipe.models import Participant, Recipe, Ingredient, Like, CustomContains, Step, QuantityMeasure
 from restaurant.settings import MEDIA_URL
@@ -33,7 +33,7 @@ class GetStatsView(View):
         recipe_count = recipes.count()
         clients_count = clients.count()
         participants_rate = float(participant_count) / float(clients_count) * 100.0
-        ranking = participants.aggregate(stars=Sum('recipes__starsrate__stars')).order_by('-stars')
+        ranking = leaderboard.board(queryset=participants.with_scores())
 
         context = dict(participant_count=participant_count, participants=participants,
                        participants_rate=participants_rate, recipes=recipes, clients=clients,
@@ -58,8 +58,7 @@ class RecipesListView(ListView):
                       published_by__profile__owner__is_active=True)
         else:
             query = Q(published_by__profile__owner__is_active=True)
-        return Recipe.objects.filter(query).annotate(avg=Round(Avg('stars__stars'), 1)).annotate(
-            likes_=Count('likes')).annotate(comments_=Count('comments')).order_by('-created_at')
+        return Recipe.objects.filter(query).with_counters().order_by('-created_at')
 
 
 @method_decorator(login_required, name='dispatch')
@@ -92,21 +91,20 @@ class RecipeDetailView(DetailView):
     context_object_name = 'recipe'
     queryset = Recipe.objects.filter(published_by__profile__owner__is_active=True)
 
+    def get_object(self, queryset=None):
+        self.details = get_recipe_details(self.kwargs.get(self.pk_url_kwarg), self.request.user,
+                                          queryset=self.get_queryset() if queryset is None else queryset, reviews=True)
+        return self.details.recipe
+
     def get_context_data(self, **kwargs):
         context = super(RecipeDetailView, self).get_context_data(**kwargs)
         context['now'] = timezone.now()
-        try:
-            query = Q(user=self.request.user.client)
-        except AttributeError:
-            query = ~Q(user=None)
-        context['liked'] = self.get_object().likes.filter(query).exists()
-        context['rate'] = self.get_object().stars.filter(query).values_list('stars')
-        context['avg'] = self.get_object().stars.aggregate(avg=Round(Avg('stars'), 1)).get('avg', 0)
-        context['other'] = self.queryset.filter(published_by=self.get_object().published_by) \
-            .annotate(avg=Round(Avg('stars__stars'), 1)) \
-            .annotate(likes_=Count('likes'))
-        context['user_avg'] = Participant.objects.filter(pk=self.get_object().published_by.pk).annotate(
-            avg=Round(Avg('recipes__stars__stars'), 1)).annotate(likes_=Count('recipes__likes'))[0]
+        context['liked'] = self.details.liked
+        context['rate'] = self.details.rate
+        stars_avg = self.object.stars_avg
+        context['avg'] = round(stars_avg, 1) if stars_avg is not None else None
+        context['other'] = self.details.author_recipes
+        context['user_avg'] = self.details.author_summary
         context['measures'] = QuantityMeasure.objects.all()
         return context
 
@@ -313,7 +311,7 @@ class RecipeCreate(View):
             recipe.save()
             images = request.FILES.getlist('media')
             for image in images:
-                handle_uploaded_file(image, recipe.media + image.name)
+                recipe.add_picture(image)
             if self.ingredients_form.is_valid():
                 self.ingredients_form.instance = recipe
                 self.ingredients_form.save()
@@ -351,9 +349,7 @@ class ParticipantsListView(ListView):
     model = Participant
     context_object_name = "participants"
     template_name = 'rank.html'
-    queryset = Participant.objects.all().annotate(avg=Round(Avg('recipes__stars__stars'), 1)) \
-        .annotate(likes=Count('recipes__likes')).annotate(stars_sum=Sum('recipes__stars__stars'))
-    ordering = '-stars_sum'
+    queryset = leaderboard.board().select_related('profile__owner')
 
 
 @method_decorator(login_required, name='dispatch')
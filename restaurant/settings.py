@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'management',
     'restaurants',
     'rating',
+    'search',
     'rest_framework',
     'rest_framework.authtoken',
     'widget_tweaks',
@@ -125,10 +126,22 @@ AUTH_PASSWORD_VALIDATORS = [
 
 CACHES = {
     'default': {
-        'BACKEND': None,
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# home feed pools (restaurants.feed), in seconds
+HOME_FEED_REFRESH_INTERVAL = 300
+HOME_FEED_POOL_SIZE = 500
+# the alias of a cache shared by the worker processes to cache the users' group names in (base_backend.roles),
+# they are read from the database once per request while the caches are per process
+ROLES_CACHE = None
+ROLES_CACHE_TIMEOUT = 60
+# the alias of a cache shared by the worker processes to cache the users' liked recipes in (recipe.viewer),
+# they are read from the database while the caches are per process
+RECIPE_LIKES_CACHE = None
+RECIPE_LIKES_CACHE_TIMEOUT = 300
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.0/topics/i18n/
 
@@ -163,12 +176,30 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/uploads/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
 RESTAURANT_IMAGES_URL = MEDIA_URL + "restaurants/"
+# the uploads are hard links to blobs stored once per content (base_backend.storage), on MEDIA_ROOT's file system
+DEFAULT_FILE_STORAGE = 'base_backend.storage.ContentAddressedStorage'
+MEDIA_BLOBS_ROOT = os.path.join(MEDIA_ROOT, '.blobs')
+
+# the uploads' derivatives (base_backend.images) are generated by a pool of worker threads
+IMAGE_DERIVATIVES_ASYNC = True
+IMAGE_DERIVATIVES_WORKERS = 2
+IMAGE_DERIVATIVES_QUALITY = 80
 
 HOST_NAME = 'http://192.168.1.65'
 
 FIREBASE_CREDENTIALS = os.path.join(BASE_DIR, 'todo')  # TODO: implement the notifications service
 APP_NAME = "DZ Chief"
 
+# push notifications go through the outbox, drained by the send_notifications worker
+NOTIFICATIONS_TRANSPORT = 'notifications.transports.FirebaseTransport'  # FakeTransport to develop offline
+NOTIFICATIONS_MAX_ATTEMPTS = 5
+NOTIFICATIONS_RETRY_DELAY = 30  # seconds before the first retry, doubled at each attempt
+NOTIFICATIONS_LEASE = 300  # seconds a worker has to send the messages it claimed before they are claimed again
+# the comments are notified together (notifications.digests): the ones within the window in one message,
+# and a user gets one such message per interval at most
+NOTIFICATIONS_DIGEST_WINDOW = 300
+NOTIFICATIONS_DIGEST_INTERVAL = 900
+
 PHONE_VERIFICATION_OTP_TABLE = "restaurants.SmsVerification"
 PASSWORD_RESET_TABLE = "restaurants.PasswordReset"
 
@@ -179,9 +210,12 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
-    # 'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    # 'PAGE_SIZE': 10,
+    # opt-in: lists are only paginated when the client sends page_size, see base_backend.pagination
+    'DEFAULT_PAGINATION_CLASS': 'base_backend.pagination.PageNumberPagination',
+    'PAGE_SIZE': 20,
 }
+API_MAX_PAGE_SIZE = 100
+API_MAX_FEED_PAGE_SIZE = 50
 
 EMAIL_HOST = 'skylight-ds.com'
 EMAIL_PORT = '587'
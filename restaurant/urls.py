@@ -29,5 +29,6 @@ urlpatterns = [
                   path('', include('restaurants.urls')),
                   path('recipe/', include('recipe.urls')),
                   path('management/', include('management.urls')),
-                  path('rating/', include('rating.urls'))
+                  path('rating/', include('rating.urls')),
+                  path('search/', include('search.urls'))
               ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,4 +1,4 @@
-from django.db.models import Q, Avg
+from django.db.models import Q, F
 from django.http import JsonResponse
 from rest_framework import permissions
 from rest_framework.authtoken.models import Token
@@ -9,13 +9,17 @@ from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
 from base_backend import permissions as my_perms
+from base_backend.apis import QueryPlanMixin
+from base_backend.pagination import PaginatedActionsMixin, FeedCursorPagination, PageNumberPagination, \
+    RequiredPageNumberPagination
 from base_backend.utils import RequestDataFixer
+from restaurants import feed
 from restaurants.models import User, Cuisine, MealType, AppVersion, RestaurantType, Restaurant, Menu, Order, OrderLine, \
     Wilaya, City, Address, Phone
 from restaurants.serializers import UserSerializer, SmsConfirmationSerializer, CuisineSerializer, \
     RestaurantTypeSerializer, RestaurantSerializer, MenuSerializer, OrderLineSerializer, WilayaSerializer, \
     CitySerializer, OrderWRestaurantSerializer, MealTypesWithMenuSerializer, MealTypeSerializer, OrderSerializer, \
-    AddressSerializer, PhoneSerializer
+    AddressSerializer, PhoneSerializer, NearbyRestaurantSerializer, NearbySearchSerializer
 
 
 class LoginApi(ObtainAuthToken):
@@ -44,9 +48,12 @@ class LoginApi(ObtainAuthToken):
         )
 
 
-class UserViewSet(ModelViewSet):
+class UserViewSet(QueryPlanMixin, ModelViewSet):
     serializer_class = UserSerializer
     queryset = User.objects.filter(is_active=True)
+    query_plans = {
+        'default': UserSerializer.setup_eager_loading,
+    }
 
     def get_permissions(self):
         if self.action == 'create' or self.action == 'register':
@@ -107,7 +114,8 @@ class MealTypeViewSet(ModelViewSet):
 
     @action(['get'], detail=False, url_path="type-with-menus", )
     def get_types_with_menus(self, request, *args, **kwargs):
-        types = self.get_queryset().filter(menus__offered_by=request.query_params.get('restaurant', 0))
+        types = MealTypesWithMenuSerializer.setup_eager_loading(
+            self.get_queryset().filter(menus__offered_by=request.query_params.get('restaurant', 0)))
         types = self.get_serializer(types, many=True).data
         return Response(types)
 
@@ -118,45 +126,69 @@ class RestaurantTypeViewSet(ModelViewSet):
     queryset = RestaurantType.objects.all()
 
 
-class RestaurantViewSet(ModelViewSet):
+class RestaurantViewSet(QueryPlanMixin, PaginatedActionsMixin, ModelViewSet):
     serializer_class = RestaurantSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = FeedCursorPagination
     queryset = Restaurant.objects.all()
+    query_plans = {
+        'default': RestaurantSerializer.setup_eager_loading,
+        'get_restaurant_menus': None,
+    }
 
     def _get_recommended_restaurants(self) -> queryset:
         queryset = self.get_queryset()
-        recommended = queryset.all().annotate(rates_avg=Avg('rates__stars'))
+        recommended = queryset.order_by(F('rate').desc(nulls_last=True))
         return recommended
 
     def _get_special_restaurants(self) -> queryset:
         queryset = self.get_queryset()
-        special_offers_restaurants = queryset.filter(Q(menus__discount__gt=0) | Q(on_special_day=True))
+        special_offers_restaurants = queryset.filter(Q(menus__discount__gt=0) | Q(on_special_day=True)).distinct()
         return special_offers_restaurants
 
     @action(['get'], detail=False, url_path="get-home")
     def home(self, request, *args, **kwargs):
-        recommended = self._get_recommended_restaurants().order_by('?')[:5]
-        special = self._get_special_restaurants().order_by('?')[:5]
-        all_restaurants = self.get_queryset().order_by('?')[:5]
-        recommended = self.get_serializer(recommended, many=True).data
-        special = self.get_serializer(special, many=True).data
-        all_restaurants = self.get_serializer(all_restaurants, many=True).data
+        try:
+            seed = int(request.query_params.get('seed'))
+        except (TypeError, ValueError):
+            seed = feed.new_seed()
+        samples = {name: feed.sample(name, 5, seed=seed) for name in feed.POOLS}
+        restaurants = self.get_queryset().in_bulk({pk for ids in samples.values() for pk in ids})
         response = {
-            'recommended': recommended,
-            'special': special,
-            'all': all_restaurants
+            name: self.get_serializer([restaurants[pk] for pk in ids if pk in restaurants], many=True).data
+            for name, ids in samples.items()
         }
+        response['seed'] = seed
         return Response(response)
 
     @action(['get'], detail=False, url_path="special-offers")
     def special_offers(self, request, *args, **kwargs):
-        serializer = self.get_serializer(self._get_special_restaurants().order_by('-created_at'), many=True)
-        return Response(serializer.data)
+        return self.list_response(self._get_special_restaurants().order_by('-created_at', '-id'))
 
     @action(['get'], detail=False, url_path="recommended-offers")
     def recommended_offers(self, request, *args, **kwargs):
-        serializer = self.get_serializer(self._get_recommended_restaurants().order_by('-rates_avg'), many=True)
-        return Response(serializer.data)
+        # ranked by rate, not by creation date: page numbers instead of the cursor
+        return self.list_response(self._get_recommended_restaurants(), pagination_class=PageNumberPagination)
+
+    def get_serializer_class(self):
+        if self.action == 'nearby':
+            return NearbyRestaurantSerializer
+        return super(RestaurantViewSet, self).get_serializer_class()
+
+    @action(['get'], detail=False, url_path="nearby")
+    def nearby(self, request, *args, **kwargs):
+        search = NearbySearchSerializer(data=request.query_params)
+        search.is_valid(raise_exception=True)
+        ranked = Restaurant.objects.nearby(**search.validated_data)
+        paginator = RequiredPageNumberPagination()
+        page = dict(paginator.paginate_queryset(ranked, request, view=self))
+        restaurants = self.get_queryset().in_bulk(list(page))
+        results = []
+        for pk, distance in page.items():
+            if pk in restaurants:
+                restaurants[pk].distance = distance
+                results.append(restaurants[pk])
+        return paginator.get_paginated_response(self.get_serializer(results, many=True).data)
 
     @action(['get'], detail=True, url_path="restaurant-menus")
     def get_restaurant_menus(self, request, *args, **kwargs):
@@ -164,10 +196,14 @@ class RestaurantViewSet(ModelViewSet):
         return Response(categorized_menus)
 
 
-class MenuViewSet(ModelViewSet):
+class MenuViewSet(QueryPlanMixin, PaginatedActionsMixin, ModelViewSet):
     serializer_class = MenuSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = FeedCursorPagination
     queryset = Menu.objects.all()
+    query_plans = {
+        'default': MenuSerializer.setup_eager_loading,
+    }
 
     @action(['get'], detail=False, url_path="get-home")
     def home(self, request, *args, **kwargs):
@@ -185,22 +221,23 @@ class MenuViewSet(ModelViewSet):
     @action(['get'], detail=False, url_path="special-offers")
     def special_offers(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        special_offers = queryset.filter(~Q(discount=0)).order_by('-created_at')
-        serializer = self.get_serializer(special_offers, many=True)
-        return Response(serializer.data)
+        special_offers = queryset.filter(~Q(discount=0)).order_by('-created_at', '-id')
+        return self.list_response(special_offers)
 
     @action(['get'], detail=False, url_path="recommended-offers")
     def recommended_offers(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        recommended = queryset.all().order_by('-created_at')
-        serializer = self.get_serializer(recommended, many=True)
-        return Response(serializer.data)
+        recommended = queryset.all().order_by('-created_at', '-id')
+        return self.list_response(recommended)
 
 
-class OrderViewSet(ModelViewSet):
+class OrderViewSet(QueryPlanMixin, ModelViewSet):
     serializer_class = OrderWRestaurantSerializer
     permission_classes = [permissions.IsAuthenticated]
     queryset = Order.objects.all().order_by('-created_at')
+    query_plans = {
+        'default': OrderSerializer.setup_eager_loading,
+    }
 
     def get_serializer(self, *args, **kwargs):
         if self.action == "create":
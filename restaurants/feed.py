@@ -0,0 +1,96 @@
+"""
+Home feed engine.
+keeps precomputed candidate pools of restaurant ids (recommended, special, all) in the cache and samples
+the home screen from them in python, instead of asking the database to sort the whole restaurants table
+with ORDER BY RAND() on every request.
+pools are rebuilt lazily once HOME_FEED_REFRESH_INTERVAL expires (or by the refresh_home_feed command
+from a cron job), and are dropped by the signals in restaurants.models whenever a Restaurant, a Menu
+or a RateRestaurant changes.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q, F
+
+RECOMMENDED = 'recommended'
+SPECIAL = 'special'
+ALL = 'all'
+POOLS = (RECOMMENDED, SPECIAL, ALL)
+
+POOL_KEY = 'home-feed:pool:{}'
+
+
+def _refresh_interval() -> int:
+    return getattr(settings, 'HOME_FEED_REFRESH_INTERVAL', 300)
+
+
+def _pool_size() -> int:
+    return getattr(settings, 'HOME_FEED_POOL_SIZE', 500)
+
+
+def build_pool(name: str) -> list:
+    """
+    computes the restaurant ids of a pool straight from the database
+    :param name: one of POOLS
+    :return: a list of restaurant ids
+    """
+    from restaurants.models import Restaurant
+
+    if name == RECOMMENDED:
+        queryset = Restaurant.objects.order_by(F('rate_rollup__stars_avg').desc(nulls_last=True),
+                                               '-created_at')[:_pool_size()]
+    elif name == SPECIAL:
+        queryset = Restaurant.objects.filter(Q(menus__discount__gt=0) | Q(on_special_day=True)).distinct()
+    elif name == ALL:
+        queryset = Restaurant.objects.all()
+    else:
+        raise ValueError('unknown home feed pool: {}'.format(name))
+    return list(queryset.values_list('pk', flat=True))
+
+
+def refresh_pool(name: str) -> list:
+    """
+    rebuilds a pool and stores it in the cache for HOME_FEED_REFRESH_INTERVAL seconds
+    :param name: one of POOLS
+    :return: the fresh list of restaurant ids
+    """
+    ids = build_pool(name)
+    cache.set(POOL_KEY.format(name), ids, _refresh_interval())
+    return ids
+
+
+def get_pool(name: str) -> list:
+    """
+    returns the cached pool, rebuilding it if it expired or has been invalidated
+    :param name: one of POOLS
+    :return: a list of restaurant ids
+    """
+    ids = cache.get(POOL_KEY.format(name))
+    if ids is None:
+        ids = refresh_pool(name)
+    return ids
+
+
+def invalidate_pools(*names) -> None:
+    """
+    drops the given pools (all of them if none is given), the next read rebuilds them
+    """
+    cache.delete_many([POOL_KEY.format(name) for name in (names or POOLS)])
+
+
+def sample(name: str, count: int, seed=None) -> list:
+    """
+    picks `count` random restaurant ids from a pool, the same seed always gives the same sample
+    as long as the pool didn't change.
+    :param name: one of POOLS
+    :param count: how many ids to pick
+    :param seed: the per-request seed
+    :return: a list of restaurant ids
+    """
+    ids = get_pool(name)
+    return random.Random(seed).sample(ids, min(count, len(ids)))
+
+
+def new_seed() -> int:
+    return random.getrandbits(32)
@@ -1,16 +1,17 @@
-import os
+from django import forms
 
 
 
 from django.contrib.auth.models import Group
-from django.db.models import Avg, Count, QuerySet
+from django.db.models import QuerySet
 from django.forms import inlineformset_factory
 
-from base_backend.utils import handle_uploaded_file
 from delivery.models import DeliveryGuy, VehicleType
+from recipe import facets
 from recipe.models import Recipe
 from restaurants.models import User, City, Restaurant, Cuisine, RestaurantType, RestaurantMealTypes, Client, Address, \
     WorksAt, Wilaya, Menu, MealType, OfferType, Order, OrderLine
+from search import engine
 from django.utils.translation import gettext_lazy as _
 
 
@@ -278,7 +279,7 @@ class RegisterRestaurantForm(forms.ModelForm):
         restaurant = super(RegisterRestaurantForm, self).save(commit=True)
         if self.files.getlist('images', None):
             for image in self.files.getlist('images', None):
-                handle_uploaded_file(image, os.path.join(restaurant.images, image.name))
+                restaurant.add_image(image)
         return restaurant
 
 
@@ -315,6 +316,16 @@ class RestaurantSearchForm(forms.ModelForm):
         ),
         required=False
     )
+    radius = forms.FloatField(
+        widget=forms.NumberInput(
+            attrs={
+                'placeholder': _('Radius (meters)')
+            }
+        ),
+        required=False,
+        min_value=1,
+        max_value=50000
+    )
     open_at = forms.TimeField(
         widget=forms.TimeInput(
             attrs={
@@ -346,17 +357,15 @@ class RestaurantSearchForm(forms.ModelForm):
         queryset = Restaurant.objects.all()
         data = self.cleaned_data
         if data.get('name', None):
-            queryset = queryset.filter(name__icontains=self.cleaned_data.get('name', None))
-        if data.get('latitude', None):
-            queryset = queryset.filter(latitude__lte=(data.get('latitude', None) - 5),
-                                       latitude__gte=(data.get('latitude', None) - 5))
-        if data.get('latitude', None):
-            queryset = queryset.filter(longitude__lte=(data.get('longitude', None) - 5),
-                                       longitude__gte=(data.get('longitude', None) - 5))
+            queryset = queryset.filter(pk__in=engine.matching_ids('restaurant', data['name']))
+        if data.get('latitude', None) is not None and data.get('longitude', None) is not None:
+            nearby = Restaurant.objects.nearby(data['latitude'], data['longitude'], data.get('radius') or 5000)
+            queryset = queryset.filter(pk__in=[pk for pk, distance in nearby])
         if data.get('city', None):
             queryset = queryset.filter(city=data.get('city', None))
         if data.get('address', None):
-            queryset = queryset.filter(address__icontains=data.get('address', None))
+            # the restaurant documents hold the names too, and an address is often made of stop words and numbers
+            queryset = queryset.filter(address__icontains=data['address'])
         if data.get('open_at', None):
             queryset = queryset.filter(open_at__gte=data.get('open_at', None))
         if data.get('close_at', None):
@@ -406,24 +415,30 @@ class WorkAtForm(forms.ModelForm):
 class FilterRecipeForm(forms.Form):
     wilaya = forms.ModelChoiceField(queryset=Wilaya.objects.all(), required=False)
     cuisine = forms.ModelChoiceField(queryset=Cuisine.objects.all(), required=False)
+    type = forms.ModelChoiceField(queryset=MealType.objects.all(), required=False)
     popularity = forms.BooleanField(required=False)
     rating = forms.BooleanField(required=False)
     recently_added = forms.BooleanField(required=False)
 
-    def filter(self):
-        queryset = Recipe.objects.all().annotate(avg=Avg('stars')).annotate(likes_=Count('likes'))
+    def get_order(self):
         data = self.cleaned_data
-        if data.get('wilaya', None):
-            queryset = queryset.filter(published_by__profile__owner__lives_in__wilaya=data['wilaya'])
-        if data.get('cuisine', None):
-            queryset = queryset.filter(cuisine=data['cuisine'])
         if data.get('popularity', False):
-            queryset = queryset.order_by('-likes_')
+            return 'popularity'
         elif data.get('rating', False):
-            queryset = queryset.order_by('-avg')
+            return 'rating'
         elif data.get('recently_added'):
-            queryset = queryset.order_by('-created_at')
-        return queryset
+            return 'recent'
+        return None
+
+    def filter(self):
+        data = self.cleaned_data
+        queryset = Recipe.objects.with_counters().select_related('published_by__profile__owner')
+        return facets.filter_recipes(queryset, wilaya=data.get('wilaya'), cuisine=data.get('cuisine'),
+                                     meal_type=data.get('type'), order=self.get_order())
+
+    def facet_counts(self) -> dict:
+        data = self.cleaned_data
+        return facets.facet_counts(wilaya=data.get('wilaya'), cuisine=data.get('cuisine'), meal_type=data.get('type'))
 
 
 class   MenuForm(forms.ModelForm):
@@ -524,7 +539,7 @@ class MenuSearchForm(forms.ModelForm):
         data = self.cleaned_data
 
         if data.get('name', None):
-            queryset = queryset.filter(name__icontains=data.get('name', None))
+            queryset = queryset.filter(pk__in=engine.matching_ids('menu', data['name'], restaurant=owner))
         if data.get('price', None):
             queryset = queryset.filter(price__lte=data.get('price', None))
         if data.get('type', None):
@@ -0,0 +1,48 @@
+"""
+fills the denormalized Order totals (sub_total, discount_total, delivery_fees, total) of the orders created
+before they were stored, recomputing them from the order lines batch by batch.
+with --verify nothing is written: the stored totals are compared to a fresh computation, and the command
+fails listing the orders that don't match.
+"""
+import math
+
+from django.core.management import BaseCommand, CommandError
+
+from restaurants.models import Order
+from restaurants.pricing import price_orders
+
+TOLERANCE = 0.01
+
+
+class Command(BaseCommand):
+    help = 'Backfill the stored totals of the orders, or check them with --verify'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch-size', type=int, default=500, help='number of orders per batch')
+        parser.add_argument('--verify', action='store_true', help='only check the stored totals')
+
+    def handle(self, *args, **options):
+        queryset = Order.objects.select_related('restaurant').prefetch_related('lines__menu').order_by('pk')
+        processed, mismatches, last_pk = 0, [], 0
+        while True:
+            batch = list(queryset.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            stored = [[getattr(order, field) for field in Order.TOTAL_FIELDS] for order in batch]
+            price_orders(batch)
+            if options['verify']:
+                mismatches += [order.pk for order, values in zip(batch, stored)
+                               if not all(math.isclose(value, getattr(order, field), abs_tol=TOLERANCE)
+                                          for field, value in zip(Order.TOTAL_FIELDS, values))]
+            else:
+                Order.objects.bulk_update(batch, Order.TOTAL_FIELDS)
+            processed += len(batch)
+
+        if not options['verify']:
+            print('{} order(s) backfilled'.format(processed))
+        elif mismatches:
+            raise CommandError('{} of {} order(s) have wrong totals: {}'.format(
+                len(mismatches), processed, ', '.join(str(pk) for pk in mismatches)))
+        else:
+            print('{} order(s) verified'.format(processed))
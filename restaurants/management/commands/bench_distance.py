@@ -0,0 +1,37 @@
+"""
+micro-benchmark of the vectorized measure_many() against a loop of scalar measure() calls
+"""
+import random
+import time
+
+from django.core.management import BaseCommand
+
+from base_backend.tracking_funcs import measure, measure_many
+
+
+class Command(BaseCommand):
+    help = 'Compare measure_many() with a loop of measure() calls'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--points', type=int, default=10000, help='number of point pairs')
+        parser.add_argument('-r', '--repeat', type=int, default=20, help='number of timed runs')
+
+    def handle(self, *args, **options):
+        count = options['points']
+        generator = random.Random(0)
+        points = [[generator.uniform(19, 37) for _ in range(count)], [generator.uniform(-8, 12) for _ in range(count)],
+                  [generator.uniform(19, 37) for _ in range(count)], [generator.uniform(-8, 12) for _ in range(count)]]
+
+        scalar = self._best(lambda: [measure(*pair) for pair in zip(*points)], options['repeat'])
+        vectorized = self._best(lambda: measure_many(*points), options['repeat'])
+        print('{} pairs: measure() loop {:.2f} ms, measure_many() {:.2f} ms, x{:.1f}'
+              .format(count, scalar, vectorized, scalar / vectorized))
+
+    @staticmethod
+    def _best(function, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+        return min(timings)
@@ -0,0 +1,86 @@
+"""
+benchmarks the home feed engine against the legacy ORDER BY RAND() home queries
+the fake restaurants are created inside a transaction that is rolled back at the end,
+so it can be pointed at a copy of the production database.
+"""
+import statistics
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Q, Avg
+
+from rating.models import RateRestaurant
+from restaurants import feed
+from restaurants.models import Restaurant, User, City, Wilaya, Client
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare p50/p99 latency of the home feed pools against the legacy random queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-r', '--restaurants', type=int, default=10000, help='number of fake restaurants')
+        parser.add_argument('-i', '--iterations', type=int, default=200, help='number of timed home requests')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._populate(options['restaurants'])
+                feed.invalidate_pools()
+                legacy = self._time(self._legacy_home, options['iterations'])
+                pooled = self._time(self._pooled_home, options['iterations'])
+                raise Rollback
+        except Rollback:
+            feed.invalidate_pools()
+
+        for name, timings in (('legacy ORDER BY RAND()', legacy), ('home feed pools', pooled)):
+            print('{:<24} p50 {:8.2f} ms   p99 {:8.2f} ms'.format(name, self._percentile(timings, 50),
+                                                                  self._percentile(timings, 99)))
+
+    @staticmethod
+    def _populate(count):
+        owner = User.objects.create(username='bench_owner', phone='+213000000000', user_type='O')
+        client = Client.objects.create(owner=User.objects.create(username='bench_client', phone='+213000000001',
+                                                                 user_type='C'))
+        wilaya = Wilaya.objects.create(name='bench', matricule=0, code_postal=0)
+        city = City.objects.create(name='bench', code_postal=0, wilaya=wilaya)
+        Restaurant.objects.bulk_create([
+            Restaurant(name='bench {}'.format(i), registre_commerce='bench-rc-{}'.format(i),
+                       id_fiscale='bench-if-{}'.format(i), latitude=36.0, longitude=3.0, main_user=owner,
+                       address='bench', city=city, on_special_day=(i % 10 == 0))
+            for i in range(count)
+        ], batch_size=500)
+        rated = Restaurant.objects.filter(name__startswith='bench ').values_list('pk', flat=True)[:count // 5]
+        RateRestaurant.objects.bulk_create([
+            RateRestaurant(client=client, restaurant_id=pk, stars=pk % 5 + 1) for pk in rated
+        ], batch_size=500)
+
+    @staticmethod
+    def _legacy_home():
+        queryset = Restaurant.objects.all()
+        list(queryset.annotate(rates_avg=Avg('rates__stars')).order_by('?')[:5])
+        list(queryset.filter(Q(menus__discount__gt=0) | Q(on_special_day=True)).order_by('?')[:5])
+        list(queryset.order_by('?')[:5])
+
+    @staticmethod
+    def _pooled_home():
+        seed = feed.new_seed()
+        samples = [feed.sample(name, 5, seed=seed) for name in feed.POOLS]
+        Restaurant.objects.in_bulk({pk for ids in samples for pk in ids})
+
+    @staticmethod
+    def _time(function, iterations):
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    @staticmethod
+    def _percentile(timings, percentile):
+        return statistics.quantiles(timings, n=100)[percentile - 1]
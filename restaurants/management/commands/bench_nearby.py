@@ -0,0 +1,94 @@
+"""
+benchmarks the nearby restaurants query (RestaurantQuerySet.nearby: geohash cells prefilter, then exact distances)
+against ranking every restaurant, on 100k restaurants and a 5km radius by default, against a 20ms target.
+the fake restaurants are created inside a transaction that is rolled back at the end,
+so it can be pointed at a copy of the production database.
+"""
+import random
+import statistics
+import time
+
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from base_backend import geohash
+from base_backend.tracking_funcs import measure_many
+from restaurants.models import Restaurant, User, City, Wilaya
+
+# the fake restaurants are spread over the country, half of them around its main cities
+BOX = (19.0, -8.0, 37.0, 12.0)
+CITIES = [(36.75, 3.05), (35.69, -0.63), (36.36, 6.61), (36.19, 5.41), (36.90, 7.76)]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare p50/p99 latency of the nearby restaurants query against ranking every restaurant'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-r', '--restaurants', type=int, default=100000, help='number of fake restaurants')
+        parser.add_argument('-i', '--iterations', type=int, default=200, help='number of timed queries')
+        parser.add_argument('--radius', type=float, default=5000, help='the radius of the queries, in meters')
+        parser.add_argument('--target', type=float, default=20, help='the p99 latency target, in ms')
+
+    def handle(self, *args, **options):
+        generator = random.Random(0)
+        centers = [self._point(generator) for _ in range(options['iterations'])]
+        radius = options['radius']
+        try:
+            with transaction.atomic():
+                self._populate(options['restaurants'], generator)
+                scan = self._time(lambda center: self._scan(center, radius), centers[:max(len(centers) // 10, 2)])
+                nearby = self._time(lambda center: Restaurant.objects.nearby(*center, radius), centers)
+                raise Rollback
+        except Rollback:
+            pass
+
+        for name, timings in (('ranking every restaurant', scan), ('geohash prefilter', nearby)):
+            print('{:<26} p50 {:8.2f} ms   p99 {:8.2f} ms'.format(name, self._percentile(timings, 50),
+                                                                    self._percentile(timings, 99)))
+        p99 = self._percentile(nearby, 99)
+        print('{} restaurants, {:g}m radius: p99 {} the {:g} ms target'.format(
+            options['restaurants'], radius, 'within' if p99 <= options['target'] else 'OVER', options['target']))
+
+    @staticmethod
+    def _point(generator):
+        if generator.random() < 0.5:
+            latitude, longitude = generator.choice(CITIES)
+            return latitude + generator.gauss(0, 0.1), longitude + generator.gauss(0, 0.1)
+        return generator.uniform(BOX[0], BOX[2]), generator.uniform(BOX[1], BOX[3])
+
+    def _populate(self, count, generator):
+        owner = User.objects.create(username='bench_owner', phone='+213000000000', user_type='O')
+        wilaya = Wilaya.objects.create(name='bench', matricule=0, code_postal=0)
+        city = City.objects.create(name='bench', code_postal=0, wilaya=wilaya)
+        restaurants = []
+        for i in range(count):
+            latitude, longitude = self._point(generator)
+            # bulk_create doesn't go through Restaurant.save, the geohash is set here
+            restaurants.append(Restaurant(name='bench {}'.format(i), registre_commerce='bench-rc-{}'.format(i),
+                                          id_fiscale='bench-if-{}'.format(i), latitude=latitude, longitude=longitude,
+                                          geohash=geohash.encode(latitude, longitude), main_user=owner,
+                                          address='bench', city=city, images='bench-{}'.format(i)))
+        Restaurant.objects.bulk_create(restaurants, batch_size=500)
+
+    @staticmethod
+    def _scan(center, radius):
+        ids, latitudes, longitudes = zip(*Restaurant.objects.values_list('pk', 'latitude', 'longitude'))
+        distances = measure_many(center[0], center[1], latitudes, longitudes)
+        return sorted((distance, pk) for pk, distance in zip(ids, distances) if distance <= radius)
+
+    @staticmethod
+    def _time(function, centers):
+        timings = []
+        for center in centers:
+            start = time.perf_counter()
+            function(center)
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    @staticmethod
+    def _percentile(timings, percentile):
+        return statistics.quantiles(timings, n=100)[percentile - 1]
@@ -0,0 +1,20 @@
+"""
+removes the media blobs (base_backend.storage) no upload links to anymore, run it from a cron job.
+the blobs used in the last --grace hours are kept, an upload being stored may not be linked yet.
+"""
+from django.core.management import BaseCommand
+
+from base_backend.storage import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Remove the unreferenced media blobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=float, default=24, help='hours an unreferenced blob is kept')
+        parser.add_argument('--dry-run', action='store_true', help='only report the garbage')
+
+    def handle(self, *args, **options):
+        removed, freed = collect_garbage(grace=options['grace'] * 3600, dry_run=options['dry_run'])
+        print('{} blob(s) {}, {} bytes {}.'.format(removed, 'unreferenced' if options['dry_run'] else 'removed',
+                                                  freed, 'to free' if options['dry_run'] else 'freed'))
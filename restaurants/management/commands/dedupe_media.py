@@ -0,0 +1,70 @@
+"""
+reports how much of the uploads tree is duplicated content, and with --apply moves it to the content addressed
+blobs (base_backend.storage): every file becomes a hard link to the blob of its content, so each content is stored
+once. the names and urls don't change. the derivatives are left alone, they are regenerated from the originals.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from base_backend import storage
+from base_backend.images import DERIVATIVES_DIRECTORY
+
+
+class Command(BaseCommand):
+    help = 'Report the bytes saved by storing the uploads by content, and store them so with --apply'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--apply', action='store_true', help='link the uploads to their blobs')
+
+    @staticmethod
+    def hash_file(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(64 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def iter_uploads():
+        blobs_root = os.path.abspath(storage.get_blobs_root())
+        for directory, directories, names in os.walk(settings.MEDIA_ROOT):
+            directories[:] = [name for name in directories if name != DERIVATIVES_DIRECTORY and
+                              os.path.abspath(os.path.join(directory, name)) != blobs_root]
+            for name in names:
+                path = os.path.join(directory, name)
+                if not name.startswith('.') and os.path.isfile(path) and not os.path.islink(path):
+                    yield path
+
+    def handle(self, *args, **options):
+        files, total, disk, linked, contents, inodes = 0, 0, 0, 0, {}, set()
+        for path in self.iter_uploads():
+            stat = os.stat(path)
+            files, total = files + 1, total + stat.st_size
+            if (stat.st_dev, stat.st_ino) not in inodes:
+                inodes.add((stat.st_dev, stat.st_ino))
+                disk += stat.st_size
+            sha256 = self.hash_file(path)
+            contents.setdefault(sha256, stat.st_size)
+            if options['apply']:
+                extension = os.path.splitext(path)[1]
+                blob = storage.blob_path(sha256, extension)
+                if not os.path.exists(blob):
+                    os.makedirs(os.path.dirname(blob), exist_ok=True)
+                    try:
+                        # the first file of a content becomes its blob
+                        os.link(path, blob)
+                    except OSError:
+                        # the blobs are on another file system, nothing can be shared
+                        pass
+                elif not os.path.samefile(path, blob):
+                    storage.link_blob(blob, path)
+                    linked += 1
+        unique = sum(contents.values())
+        print('{} file(s), {} bytes, {} distinct content(s), {} bytes.'.format(files, total, len(contents), unique))
+        print('stored by content: {} bytes saved ({:.1f}%), {} bytes were already shared.'.format(
+            total - unique, 100.0 * (total - unique) / total if total else 0, total - disk))
+        if options['apply']:
+            print('{} duplicate file(s) linked to their blob.'.format(linked))
@@ -0,0 +1,49 @@
+"""
+generates the missing derivatives (base_backend.images) of the uploaded images: the recipes' and restaurants'
+pictures, and the recipes' main images, the steps' and menus' images, the restaurants' logos and the users' photos.
+the uploads get theirs from the worker pool, run it once to derive the existing uploads, and after changing the sizes
+with --overwrite. the generated sizes are recorded in the manifests and next to the image fields.
+"""
+import os
+
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand
+
+from base_backend.images import make_derivatives, generated_sizes, record_sizes, derivatives_column
+from recipe.models import Recipe, Step, RecipeImage
+from restaurants.models import Restaurant, Menu, User, RestaurantImage
+
+IMAGE_FIELDS = ((Recipe, 'main'), (Step, 'image'), (Menu, 'image'), (Restaurant, 'logo'), (User, 'photo'))
+
+
+class Command(BaseCommand):
+    help = 'Generate the missing thumbnail and medium WebP derivatives of the uploaded images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--overwrite', action='store_true', help='regenerate the existing derivatives too')
+
+    def paths(self):
+        """
+        :return: (path, model, column, pk) the generated sizes are recorded in
+        """
+        for model, field in IMAGE_FIELDS:
+            for pk, name in model.objects.exclude(**{field: ''}).exclude(**{field + '__isnull': True}) \
+                    .values_list('pk', field).iterator():
+                yield default_storage.path(name), model, derivatives_column(field), pk
+        for pk, directory, name in RecipeImage.objects.values_list('pk', 'recipe__media', 'name').iterator():
+            yield os.path.join(directory, name), RecipeImage, 'derivatives', pk
+        for pk, directory, name in RestaurantImage.objects.values_list('pk', 'restaurant__images', 'name').iterator():
+            yield os.path.join(directory, name), RestaurantImage, 'derivatives', pk
+
+    def handle(self, *args, **options):
+        derived, failed = 0, []
+        for path, model, column, pk in self.paths():
+            if not os.path.isfile(path):
+                continue
+            try:
+                derived += bool(make_derivatives(path, overwrite=options['overwrite']))
+            except Exception as exception:
+                failed.append('{}: {}'.format(path, exception))
+            record_sizes(model, column, generated_sizes(path), pk=pk)
+        print('{} image(s) derived, {} failed{}'.format(derived, len(failed),
+                                                       ''.join('\n  ' + failure for failure in failed)))
@@ -0,0 +1,57 @@
+"""
+indexes the recipes' and restaurants' media directories into their manifests (RecipeImage, RestaurantImage)
+the urls are read from the manifests, run it once after deploying them to index the existing uploads, and whenever
+files are copied into uploads/recipe/<pk>/ or uploads/restaurants/<pk>/ by hand. the files that disappeared
+are removed from the manifests.
+"""
+import os
+
+from django.core.management import BaseCommand
+
+from recipe.models import Recipe, RecipeImage
+from restaurants.models import Restaurant, RestaurantImage
+
+
+class Command(BaseCommand):
+    help = 'Index the recipes and restaurants media directories into the images manifests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='only report the changes')
+
+    @staticmethod
+    def list_directory(directory):
+        if not directory or not os.path.isdir(directory):
+            return set()
+        # skips the uploads being written (.upload-*) and the derivatives directory
+        return {name for name in os.listdir(directory)
+                if not name.startswith('.') and os.path.isfile(os.path.join(directory, name))}
+
+    def index(self, owners, directory_field, image_model, owner_field, dry_run):
+        """
+        :param owners: the recipes or restaurants
+        :param directory_field: the owner's field holding its media directory
+        :param image_model: the manifest model
+        :param owner_field: the manifest's foreign key to the owner
+        :return: (number of added images, number of removed images)
+        """
+        indexed = {}
+        for owner_id, name in image_model.objects.values_list(owner_field + '_id', 'name'):
+            indexed.setdefault(owner_id, set()).add(name)
+        added, removed = [], []
+        for owner_id, directory in owners.values_list('pk', directory_field).order_by('pk').iterator():
+            names, known = self.list_directory(directory), indexed.get(owner_id, set())
+            added += [image_model(**{owner_field + '_id': owner_id, 'name': name}) for name in sorted(names - known)]
+            removed += [(owner_id, name) for name in known - names]
+        if not dry_run:
+            image_model.objects.bulk_create(added, batch_size=500, ignore_conflicts=True)
+            for owner_id, name in removed:
+                image_model.objects.filter(**{owner_field + '_id': owner_id, 'name': name}).delete()
+        return len(added), len(removed)
+
+    def handle(self, *args, **options):
+        for label, owners, directory_field, image_model, owner_field in (
+                ('recipe', Recipe.objects.all(), 'media', RecipeImage, 'recipe'),
+                ('restaurant', Restaurant.objects.all(), 'images', RestaurantImage, 'restaurant')):
+            added, removed = self.index(owners, directory_field, image_model, owner_field, options['dry_run'])
+            print('{} images: {} {}, {} {}.'.format(label, added, 'to add' if options['dry_run'] else 'added',
+                                                    removed, 'to remove' if options['dry_run'] else 'removed'))
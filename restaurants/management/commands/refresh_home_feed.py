@@ -0,0 +1,24 @@
+"""
+rebuilds the home feed pools
+meant to be run from a cron job, so the first home request after a pool expires doesn't pay for the rebuild.
+"""
+from django.core.management import BaseCommand, CommandError
+
+from restaurants import feed
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the cached home feed pools (recommended, special, all)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pools', nargs='*',
+                            help='the pools to rebuild ({}), all of them by default'.format(', '.join(feed.POOLS)))
+
+    def handle(self, *args, **options):
+        names = options.get('pools') or feed.POOLS
+        unknown = set(names) - set(feed.POOLS)
+        if unknown:
+            raise CommandError('unknown pools: {}'.format(', '.join(sorted(unknown))))
+        for name in names:
+            ids = feed.refresh_pool(name)
+            print('{} pool: {} restaurants.'.format(name, len(ids)))
@@ -1,4 +1,10 @@
-from django.db.models import Manager, F
+from functools import reduce
+from operator import or_
+
+from django.db.models import Manager, F, Q, QuerySet
+
+from base_backend import geohash
+from base_backend.tracking_funcs import measure_many
 
 
 class CustomMenusManager(Manager):
@@ -40,3 +46,39 @@ class CustomMenusManager(Manager):
         for menu in all_menus:
             menus[menu.offer.type].append(menu)
         return menus
+
+
+class RestaurantQuerySet(QuerySet):
+
+    def in_bounding_box(self, latitude, longitude, radius):
+        """
+        cheap prefilter of a radius query: the restaurants whose geohash falls in one of the cells covering the
+        circle's bounding boxes (index range scans), trimmed to the boxes themselves.
+        :param latitude: the center latitude
+        :param longitude: the center longitude
+        :param radius: the radius in meters
+        :return: a queryset, a superset of the restaurants in the circle
+        """
+        boxes = []
+        for min_lat, min_lon, max_lat, max_lon in geohash.bounding_boxes(latitude, longitude, radius):
+            cells = geohash.covering_cells(min_lat, min_lon, max_lat, max_lon)
+            ranges = map(geohash.prefix_range, cells)
+            boxes.append(reduce(or_, (Q(geohash__gte=low, geohash__lt=high) for low, high in ranges)) &
+                         Q(latitude__range=(min_lat, max_lat), longitude__range=(min_lon, max_lon)))
+        return self.filter(reduce(or_, boxes))
+
+    def nearby(self, latitude, longitude, radius) -> list:
+        """
+        ranks the restaurants around a point, only the ids and coordinates are loaded
+        :param latitude: the center latitude
+        :param longitude: the center longitude
+        :param radius: the radius in meters
+        :return: a list of (restaurant id, distance in meters) sorted by distance
+        """
+        candidates = list(self.in_bounding_box(latitude, longitude, radius).values_list('pk', 'latitude', 'longitude'))
+        if not candidates:
+            return []
+        ids, latitudes, longitudes = zip(*candidates)
+        distances = measure_many(latitude, longitude, latitudes, longitudes)
+        ranked = [(pk, float(distance)) for pk, distance in zip(ids, distances) if distance <= radius]
+        return sorted(ranked, key=lambda item: item[1])
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:10
+
+from django.db import migrations, models
+
+from base_backend import geohash
+
+
+def index_restaurants(apps, schema_editor):
+    Restaurant = apps.get_model('restaurants', 'Restaurant')
+    for restaurant in Restaurant.objects.only('pk', 'latitude', 'longitude').iterator():
+        Restaurant.objects.filter(pk=restaurant.pk) \
+            .update(geohash=geohash.encode(restaurant.latitude, restaurant.longitude))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0020_auto_20200712_1234'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurant',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=12),
+        ),
+        migrations.RunPython(index_restaurants, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0022_order_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestaurantImage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=255)),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pictures', to='restaurants.Restaurant')),
+            ],
+            options={
+                'ordering': ('name',),
+                'unique_together': {('restaurant', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0023_restaurant_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restaurantimage',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
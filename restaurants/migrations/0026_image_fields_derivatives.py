@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0025_restaurant_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menu',
+            name='image_derivatives',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='logo_derivatives',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='photo_derivatives',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+    ]
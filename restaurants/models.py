@@ -2,19 +2,21 @@ import os
 from datetime import date
 from functools import reduce
 
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, Group
 from django.db import models
-from django.db.models import Sum, Count, Avg
-from django.db.models.signals import post_save, post_init
+from django.db.models.signals import post_save, post_init, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
-from base_backend.messaging import notify_user
-from base_backend.models import BaseModel, do_nothing, DeletableModel, Round, cascade
+from base_backend import geohash, roles, images
+from base_backend.messaging import notify_account
+from base_backend.models import BaseModel, do_nothing, DeletableModel, cascade
 from base_backend.tracking_funcs import measure
 from base_backend.validators import phone_validator
+from restaurants import feed, pricing
 from restaurant.settings import MEDIA_ROOT, RESTAURANT_IMAGES_URL
-from restaurants.managers import CustomMenusManager
+from restaurants.managers import CustomMenusManager, RestaurantQuerySet
+from restaurants.pricing import DELIVERY_FEES_PER_METER
 
 
 class User(AbstractUser):
@@ -46,6 +48,8 @@ class User(AbstractUser):
         blank=True,
         null=True
     )
+    # the generated sizes of base_backend.images.DERIVATIVES, space separated
+    photo_derivatives = models.CharField(max_length=100, blank=True, default='', editable=False)
     address = models.CharField(_("Address"), max_length=255)
     lives_in = models.ForeignKey('City', on_delete=do_nothing, null=True, blank=True)
     user_type = models.CharField(
@@ -72,6 +76,13 @@ class User(AbstractUser):
         before_dob = (today.month, today.day) < (dob.month, dob.day)
         return today.year - self.birth_date.year - before_dob
 
+    @property
+    def roles(self) -> frozenset:
+        """
+        the names of the user's groups, cached, see base_backend.roles
+        """
+        return roles.get_roles(self)
+
     @property
     def confirmed_phone(self) -> bool:
         return False
@@ -85,8 +96,7 @@ class User(AbstractUser):
         scores = None
         if self.client and self.client.is_participant and self.client.participant:
             from recipe.models import Participant
-            scores = Participant.objects.filter(pk=self.client.participant.pk) \
-                .annotate(likes_=Count("recipes__likes")).annotate(avg=Round(Avg('recipes__stars__stars'), 1))[0]
+            scores = Participant.objects.filter(pk=self.client.participant.pk).with_scores()[0]
         return scores
 
     @property
@@ -120,10 +130,13 @@ class Restaurant(DeletableModel):
     id_fiscale = models.CharField(max_length=150, unique=True)
     latitude = models.FloatField()
     longitude = models.FloatField()
+    geohash = models.CharField(max_length=12, db_index=True, blank=True, default='', editable=False)
     main_user = models.ForeignKey('User', on_delete=do_nothing)
     address = models.CharField(max_length=150)
     city = models.ForeignKey('City', on_delete=do_nothing)
     logo = models.ImageField(upload_to="logo/", null=True)
+    # the generated sizes of base_backend.images.DERIVATIVES, space separated
+    logo_derivatives = models.CharField(max_length=100, blank=True, default='', editable=False)
     images = models.CharField(max_length=255, unique=True, blank=True, null=True)
     phone = models.CharField(unique=True, null=True, blank=True, validators=[phone_validator], max_length=30)
     email = models.EmailField(unique=True, null=True, blank=True, )
@@ -138,24 +151,71 @@ class Restaurant(DeletableModel):
     types = models.ManyToManyField('RestaurantType', through='RestaurantTypes')
     meal_types = models.ManyToManyField('MealType', through='RestaurantMealTypes')
 
+    objects = RestaurantQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
     def save(self, **kwargs):
+        self.geohash = geohash.encode(self.latitude, self.longitude)
+        if kwargs.get('update_fields') is not None and {'latitude', 'longitude'} & set(kwargs['update_fields']):
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'geohash'}
         super(Restaurant, self).save(**kwargs)
         if not self.images:
             self.images = os.path.join(MEDIA_ROOT, 'restaurants', str(self.pk))
             os.makedirs(self.images, exist_ok=True)
-            super(Restaurant, self).save(**kwargs)
+            super(Restaurant, self).save(update_fields=['images'])
 
     @property
     def images_urls(self):
-        images_urls = []
-        if self.images:
-            images_names = os.listdir(self.images)
-            for name in images_names:
-                images_urls.append(RESTAURANT_IMAGES_URL + str(self.pk) + "/" + name)
-        return images_urls
+        """
+        read from the RestaurantImage manifest, prefetch 'pictures' when listing restaurants
+        """
+        return [picture.url for picture in self.pictures.all()]
+
+    @property
+    def images_sizes(self):
+        """
+        the images' urls per size, see base_backend.images.derivative_urls
+        """
+        return [picture.urls for picture in self.pictures.all()]
+
+    def add_image(self, file, name=None):
+        """
+        streams the uploaded file to the restaurant's images directory, adds it to the manifest and schedules its
+        derivatives. a file with the content of one of the restaurant's images is dropped.
+        :param file: the uploaded file
+        :param name: the file name, defaults to the uploaded file's name
+        :return: the RestaurantImage
+        """
+        return images.add_to_manifest(self.pictures, self.images, file, name)
+
+
+class RestaurantImage(BaseModel):
+    """
+    a picture of the restaurant's images directory, the manifest spares listing the directory to build the urls.
+    written by Restaurant.add_image, the index_media command indexes the files written without it
+    """
+    restaurant = models.ForeignKey('Restaurant', on_delete=cascade, related_name='pictures')
+    name = models.CharField(max_length=255)
+    sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+    # the generated sizes of base_backend.images.DERIVATIVES, space separated
+    derivatives = models.CharField(max_length=100, blank=True, default='')
+
+    class Meta:
+        unique_together = ('restaurant', 'name')
+        ordering = ('name',)
+
+    @property
+    def url(self):
+        return RESTAURANT_IMAGES_URL + str(self.restaurant_id) + "/" + self.name
+
+    @property
+    def urls(self):
+        return images.derivative_urls(self.url, self.derivatives.split())
+
+    def __str__(self):
+        return self.name
 
 
 class RestaurantType(BaseModel):
@@ -225,6 +285,8 @@ class Menu(BaseModel):
     description = models.TextField()
     price = models.FloatField()
     image = models.ImageField(upload_to='menu/')
+    # the generated sizes of base_backend.images.DERIVATIVES, space separated
+    image_derivatives = models.CharField(max_length=100, blank=True, default='', editable=False)
     offered_by = models.ForeignKey('Restaurant', on_delete=do_nothing, related_name='menus')
     type = models.ForeignKey('MealType', on_delete=do_nothing, related_name='menus')
     offer = models.ForeignKey('OfferType', on_delete=do_nothing, related_name='menus')
@@ -256,9 +318,19 @@ class OrderLine(BaseModel):
     comment = models.CharField(max_length=255, null=True)
     order = models.ForeignKey('Order', on_delete=cascade, related_name='lines')
 
-    def save(self, *args, **kwargs):
-        self.total = float(self.quantity) * self.menu.get_current_price
+    def save(self, *args, update_order=True, **kwargs):
+        """
+        :param update_order: recompute the order totals, callers saving several lines at once pass False
+        and call Order.update_totals once at the end
+        """
+        self.compute_total()
         super(OrderLine, self).save(*args, **kwargs)
+        if update_order:
+            self.order.update_totals()
+
+    def compute_total(self) -> float:
+        self.total = float(self.quantity) * self.menu.get_current_price
+        return self.total
 
     @property
     def discount_amount(self) -> float:
@@ -283,32 +355,76 @@ class Order(DeletableModel):
     building = models.IntegerField(null=True, blank=True)
     floor = models.IntegerField(null=True, blank=True)
 
-    @property
-    def total(self):
-        return self.sub_total - self.discount_total + self.delivery_fees
-
-    @property
-    def sub_total(self) -> float:
-        total = self.lines.all().aggregate(Sum("total")).get("total__sum")
-        return total
-
-    @property
-    def restaurant_discount(self):
-        return (self.sub_total * (float(self.restaurant.global_discount))) / 100.0
-
-    @property
-    def menus_discount(self):
-        return sum([x.discount_amount for x in self.lines.all()])
+    # denormalized at write time by update_totals, see restaurants.management.commands.backfill_order_totals
+    sub_total = models.FloatField(default=0.0, editable=False)
+    discount_total = models.FloatField(default=0.0, editable=False)
+    delivery_fees = models.FloatField(default=0.0, editable=False)
+    total = models.FloatField(default=0.0, editable=False)
 
-    @property
-    def discount_total(self) -> float:
-        return self.menus_discount + self.restaurant_discount
+    TOTAL_FIELDS = ('sub_total', 'discount_total', 'delivery_fees', 'total')
+    LOCATION_FIELDS = ('latitude', 'longitude', 'restaurant')
 
-    @property
-    def delivery_fees(self):
-        if not self.latitude or not self.longitude:
-            return 0
-        return measure(self.latitude, self.longitude, self.restaurant.latitude, self.restaurant.longitude) * 20.0
+    def save(self, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding:
+            self.delivery_fees = self.compute_delivery_fees()
+            self.total = self.sub_total - self.discount_total + self.delivery_fees
+        elif self.location_changed() or update_fields is not None and set(self.LOCATION_FIELDS) & set(update_fields):
+            # from the lines: the totals in memory miss the lines saved since the order was loaded
+            self.compute_totals()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | set(self.TOTAL_FIELDS)
+        elif update_fields is None:
+            # the totals in memory may be stale, they are only written with the lines (update_totals)
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.TOTAL_FIELDS
+                                       and field.attname not in deferred]
+        super(Order, self).save(**kwargs)
+        self._location = self.get_location()
+
+    def get_location(self) -> tuple:
+        """
+        :return: the values of the LOCATION_FIELDS the delivery fees are computed from, None for the deferred ones
+        """
+        return tuple(self.__dict__.get(field.attname) for field in map(self._meta.get_field, self.LOCATION_FIELDS))
+
+    def location_changed(self) -> bool:
+        return getattr(self, '_location', None) != self.get_location()
+
+    def compute_delivery_fees(self) -> float:
+        if not self.latitude or not self.longitude or not self.restaurant:
+            return 0.0
+        return measure(self.latitude, self.longitude, self.restaurant.latitude,
+                       self.restaurant.longitude) * DELIVERY_FEES_PER_METER
+
+    def compute_totals(self, lines=None, delivery_fees=None):
+        """
+        computes the totals in one pass over the lines, without saving them
+        :param lines: the order lines with their menu loaded, fetched in one query if not given
+        :param delivery_fees: the fees if they are already known (restaurants.pricing batches them)
+        :return: the order
+        """
+        if lines is None:
+            lines = self.lines.select_related('menu') if self.pk else []
+        sub_total = menus_discount = 0.0
+        for line in lines:
+            sub_total += line.total
+            menus_discount += line.discount_amount
+        restaurant_discount = sub_total * float(self.restaurant.global_discount) / 100.0 if self.restaurant else 0.0
+        self.sub_total = sub_total
+        self.discount_total = menus_discount + restaurant_discount
+        self.delivery_fees = self.compute_delivery_fees() if delivery_fees is None else delivery_fees
+        self.total = self.sub_total - self.discount_total + self.delivery_fees
+        return self
+
+    def update_totals(self, lines=None):
+        """
+        recomputes and stores the totals, through a queryset update so the status notifications don't fire
+        :param lines: the order lines with their menu loaded, fetched in one query if not given
+        """
+        self.compute_totals(lines)
+        Order.objects.filter(pk=self.pk).update(**{field: getattr(self, field) for field in self.TOTAL_FIELDS})
 
     def __str__(self):
         return "{0} {1}".format(self.number, self.client.__str__())
@@ -406,29 +522,96 @@ def send_sms_signal(sender, instance, created, raw, **kwargs):
 
 @receiver(post_save, sender=Order)
 def order_status_update(sender, instance, **kwargs):
+    restaurant_owner = instance.restaurant.main_user if instance.restaurant else None
     if kwargs.get('created', False):
-        notify_user(instance.restaurant.owner.notification_token,
-                    {'title': 'new order', 'message': 'You have a new order'})
+        notify_account(restaurant_owner, {'title': 'new order', 'message': 'You have a new order'})
     else:
         if instance.previous_status == instance.status:
             return
         elif instance.status == 'A':
-            notify_user(instance.client.owner.notification_token,
-                        {'title': 'Order accepted', 'message': 'Your order have been accepted'})
+            notify_account(instance.client.owner,
+                           {'title': 'Order accepted', 'message': 'Your order have been accepted'})
         elif instance.status == 'R':
             # TODO: notify the delivery and user
-            notify_user(instance.client.owner.notification_token,
-                        {'title': 'Order ready', 'message': 'Your order is ready'})
+            notify_account(instance.client.owner, {'title': 'Order ready', 'message': 'Your order is ready'})
         elif instance.status == 'Pi':
-            notify_user(instance.client.owner.notification_token,
-                        {'title': 'Order picked', 'message': 'Your order is picked'})
+            notify_account(instance.client.owner,
+                           {'title': 'Order picked', 'message': 'Your order is picked'})
         elif instance.status == 'D':
-            notify_user(instance.client.owner.notification_token,
-                        {'title': 'Order delivered', 'message': 'Your order has been delivered'})
-            notify_user(instance.restaurant.owner.notification_token,
-                        {'title': 'Order delivered', 'message': 'Your order has been delivered'})
+            notify_account(instance.client.owner,
+                           {'title': 'Order delivered', 'message': 'Your order has been delivered'})
+            notify_account(restaurant_owner,
+                           {'title': 'Order delivered', 'message': 'Your order has been delivered'})
+
+
+@receiver(post_delete, sender=OrderLine)
+def update_order_totals_on_line_delete(sender, instance, **kwargs):
+    # once per order however many of its lines are deleted, and not at all when the order is deleted with them
+    pricing.schedule_totals(instance.order_id)
 
 
 @receiver(post_init, sender=Order)
 def mark_order_previous_status(sender, instance, **kwargs):
     instance.previous_status = instance.previous_status
+    instance._location = instance.get_location()
+
+
+@receiver([post_save, post_delete], sender=Restaurant)
+def refresh_home_feed_on_restaurant_change(sender, instance, **kwargs):
+    feed.invalidate_pools()
+
+
+@receiver(post_init, sender=Menu)
+def mark_menu_previous_discount(sender, instance, **kwargs):
+    instance.previous_discount = instance.discount
+
+
+@receiver(post_save, sender=Menu)
+def refresh_home_feed_on_menu_discount(sender, instance, created, **kwargs):
+    if created or instance.previous_discount != instance.discount:
+        feed.invalidate_pools(feed.SPECIAL)
+    instance.previous_discount = instance.discount
+
+
+@receiver(post_delete, sender=Menu)
+def refresh_home_feed_on_menu_delete(sender, instance, **kwargs):
+    feed.invalidate_pools(feed.SPECIAL)
+
+
+@receiver([post_save, post_delete], sender='rating.RateRestaurant')
+def refresh_home_feed_on_rate_change(sender, instance, **kwargs):
+    feed.invalidate_pools(feed.RECOMMENDED)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_roles_on_groups_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            roles.invalidate_roles(instance)
+    elif action == 'pre_clear':
+        # instance is the group, the users losing it are only known before the clear
+        roles.invalidate_roles(*instance.user_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        roles.invalidate_roles(*pk_set)
+
+
+@receiver(post_save, sender=Group)
+def invalidate_roles_on_group_rename(sender, instance, created, raw, **kwargs):
+    if not created and not raw:
+        roles.invalidate_roles(*instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def mark_group_users(sender, instance, **kwargs):
+    # the users losing the group are only known before its memberships are deleted
+    instance._role_users = list(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def invalidate_roles_on_group_delete(sender, instance, **kwargs):
+    roles.invalidate_roles(*getattr(instance, '_role_users', ()))
+
+
+images.track_image_fields(User, 'photo')
+images.track_image_fields(Restaurant, 'logo')
+images.track_image_fields(Menu, 'image')
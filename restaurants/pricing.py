@@ -0,0 +1,84 @@
+"""
+Batch pricing of orders.
+Order.compute_totals computes one haversine per order; pricing many orders at once (the order totals
+backfill, the orders whose lines were deleted) computes all the delivery fees in a single vectorized measure_many()
+call instead.
+"""
+import threading
+
+from django.db import transaction
+
+from base_backend.tracking_funcs import measure_many
+
+DELIVERY_FEES_PER_METER = 20.0
+
+_local = threading.local()
+
+
+def compute_delivery_fees(orders) -> list:
+    """
+    :param orders: orders with their restaurant loaded (select_related('restaurant'))
+    :return: the delivery fees of each order, in the same order
+    """
+    fees = [0.0] * len(orders)
+    located = [i for i, order in enumerate(orders) if order.latitude and order.longitude and order.restaurant]
+    if located:
+        distances = measure_many([orders[i].latitude for i in located], [orders[i].longitude for i in located],
+                                 [orders[i].restaurant.latitude for i in located],
+                                 [orders[i].restaurant.longitude for i in located])
+        for i, distance in zip(located, distances):
+            fees[i] = float(distance) * DELIVERY_FEES_PER_METER
+    return fees
+
+
+def price_orders(orders) -> list:
+    """
+    computes the totals of many orders at once, without saving them
+    :param orders: orders with their restaurant and lines__menu loaded
+    :return: the orders
+    """
+    orders = list(orders)
+    for order, fees in zip(orders, compute_delivery_fees(orders)):
+        order.compute_totals(lines=order.lines.all(), delivery_fees=fees)
+    return orders
+
+
+def update_totals(order_ids) -> int:
+    """
+    recomputes and stores the totals of the orders in a fixed number of queries, the deleted orders are skipped
+    :param order_ids: the orders' pks
+    :return: the number of updated orders
+    """
+    from restaurants.models import Order
+
+    orders = price_orders(Order.objects.filter(pk__in=order_ids).select_related('restaurant')
+                          .prefetch_related('lines__menu'))
+    Order.objects.bulk_update(orders, Order.TOTAL_FIELDS)
+    return len(orders)
+
+
+def _pending() -> set:
+    if not hasattr(_local, 'pending'):
+        _local.pending = set()
+    return _local.pending
+
+
+def schedule_totals(*order_ids):
+    """
+    updates the totals of the orders once the current transaction commits, an order scheduled several times in the
+    transaction (its lines deleted at once, or with it) is updated once, by the first callback
+    :param order_ids: the orders' pks
+    """
+    keys = {pk for pk in order_ids if pk is not None}
+    if not keys:
+        return
+    _pending().update(keys)
+
+    def flush():
+        pending = _pending()
+        due = keys & pending
+        pending.difference_update(due)
+        if due:
+            update_totals(due)
+
+    transaction.on_commit(flush)
@@ -1,11 +1,14 @@
 from django.contrib.auth.models import Group
-from django.db.models import Sum, Avg
+from django.db import transaction
+from django.db.models import Sum, Prefetch, OuterRef, Subquery, F
 from rest_framework import serializers
 
+from base_backend.apis import ImageSizesField
 from base_backend.utils import activate_user_over_otp, phone_reconfirmation
 from delivery.models import DeliveryGuy, VehicleType
 
-from recipe.models import Participant
+from rating.models import RestaurantRateRollup
+from recipe.models import Participant, StarsRate
 from restaurants.models import (User, SmsVerification, Client, Restaurant, Menu, OrderLine, Order, Wilaya, City,
                                 Address, OfferType,
                                 Cuisine, MealType, RestaurantType, Phone)
@@ -31,6 +34,7 @@ class UserSerializer(serializers.ModelSerializer):
                                            required=False)
     client = serializers.SerializerMethodField()
     participant = serializers.SerializerMethodField()
+    photo_sizes = ImageSizesField(source='photo')
     stars = serializers.SerializerMethodField()
 
     def validate(self, attrs):
@@ -67,7 +71,7 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['phone', 'email', 'first_name', 'last_name', 'birth_date', 'gender', 'user_type', 'password',
                   'username', 'vehicle_type', 'client', 'participant', 'photo', 'gender', 'full_name', 'address',
-                  'stars']
+                  'stars', 'photo_sizes']
         extra_kwargs = {
             "password": {"write_only": True},
             'client': {'read_only': True},
@@ -77,18 +81,35 @@ class UserSerializer(serializers.ModelSerializer):
             'address': {'required': False},
         }
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        loads the groups with one prefetch query and the client id, participant id and stars sum as annotated
+        columns, so listing users runs the same queries whatever their number.
+        """
+        client = Client.objects.filter(owner=OuterRef('pk'))
+        stars = StarsRate.objects.filter(recipe__published_by=OuterRef('client__participant')).order_by() \
+            .values('recipe__published_by').annotate(stars_sum=Sum('stars')).values('stars_sum')
+        return queryset.prefetch_related('groups').annotate(
+            client_id=Subquery(client.values('pk')[:1]),
+            participant_id=Subquery(client.values('participant')[:1]),
+            stars_sum=Subquery(stars),
+        )
+
     def get_client(self, obj):
-        if Group.objects.get(name='client') in obj.groups.all():
-            return obj.client.id
+        if 'client' in obj.roles:
+            return obj.client_id if hasattr(obj, 'client_id') else obj.client.id
         return None
 
     def get_participant(self, obj):
-        if Group.objects.get(name='participant') in obj.groups.all():
-            return obj.client.participant.pk
+        if 'participant' in obj.roles:
+            return obj.participant_id if hasattr(obj, 'participant_id') else obj.client.participant.pk
         return None
 
     def get_stars(self, obj):
-        if Group.objects.get(name='participant') in obj.groups.all():
+        if 'participant' in obj.roles:
+            if hasattr(obj, 'stars_sum'):
+                return obj.stars_sum
             return obj.client.participant.recipes.aggregate(sum=Sum('stars__stars')).get('sum')
         return None
 
@@ -174,25 +195,43 @@ class RestaurantTypeSerializer(serializers.ModelSerializer):
 class MenuSerializer(serializers.ModelSerializer):
     type = MealTypeSerializer()
     offer = OfferTypeSerializer()
+    image_sizes = ImageSizesField(source='image')
+    rate = serializers.SerializerMethodField()
 
     class Meta:
         model = Menu
-        fields = ['number', 'name', 'description', 'price', 'image', 'offered_by', 'type', 'offer', 'discount']
+        fields = ['number', 'name', 'description', 'price', 'image', 'offered_by', 'type', 'offer', 'discount',
+                  'image_sizes', 'rate']
         extra_kwargs = {
             'discount': {'required': False}
         }
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('type', 'offer', 'rate_rollup')
+
+    def get_rate(self, obj):
+        rollup = getattr(obj, 'rate_rollup', None)
+        return rollup.stars_avg if rollup is not None else None
+
 
 class MenuForTypeSerializer(serializers.ModelSerializer):
     offer = OfferTypeSerializer()
+    image_sizes = ImageSizesField(source='image')
+    rate = serializers.SerializerMethodField()
 
     class Meta:
         model = Menu
-        fields = ['number', 'name', 'description', 'price', 'image', 'offered_by', 'type', 'offer', 'discount']
+        fields = ['number', 'name', 'description', 'price', 'image', 'offered_by', 'type', 'offer', 'discount',
+                  'image_sizes', 'rate']
         extra_kwargs = {
             'discount': {'required': False}
         }
 
+    def get_rate(self, obj):
+        rollup = getattr(obj, 'rate_rollup', None)
+        return rollup.stars_avg if rollup is not None else None
+
 
 class MealTypesWithMenuSerializer(serializers.ModelSerializer):
     menus = MenuForTypeSerializer(many=True)
@@ -201,16 +240,22 @@ class MealTypesWithMenuSerializer(serializers.ModelSerializer):
         model = MealType
         fields = ['type', 'id', 'menus']
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.prefetch_related(Prefetch('menus', queryset=Menu.objects.select_related('offer',
+                                                                                                 'rate_rollup')))
 
-class RestaurantSerializer(serializers.ModelSerializer):
-    from rating.serializers import RestaurantRateSerializer
 
+class RestaurantSerializer(serializers.ModelSerializer):
     cuisines = CuisineSerializer(many=True)
     meal_types = MealTypeSerializer(many=True)
     types = RestaurantTypeSerializer(many=True)
     menus = MenuSerializer(many=True, required=False)
     rate = serializers.SerializerMethodField()
-    rates = RestaurantRateSerializer(many=True)
+    # the latest rates and the summary of all of them, a restaurant doesn't carry its whole rating history
+    rates = serializers.SerializerMethodField()
+    rates_summary = serializers.SerializerMethodField()
+    logo_sizes = ImageSizesField(source='logo')
 
     def __init__(self, *args, **kwargs):
         # Don't pass the 'fields' arg up to the superclass
@@ -230,7 +275,7 @@ class RestaurantSerializer(serializers.ModelSerializer):
         model = Restaurant
         fields = ['id', 'name', 'registre_commerce', 'id_fiscale', 'latitude', 'longitude', 'main_user',
                   'address', 'city', 'cuisines', 'types', 'meal_types', 'menus', 'global_discount', 'on_special_day',
-                  'logo', 'open_at', 'close_at', 'rate', 'rates']
+                  'logo', 'open_at', 'close_at', 'rate', 'rates', 'rates_summary', 'logo_sizes']
         extra_kwargs = {
             'cuisines': {'read_only': True},
             'meal_types': {'read_only': True},
@@ -241,8 +286,52 @@ class RestaurantSerializer(serializers.ModelSerializer):
             'id_fiscale': {'write_only': True},
         }
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        loads everything the serializer nests in a fixed number of queries, whatever the number of restaurants:
+        one per many to many (through RestaurantCuisines, RestaurantTypes and RestaurantMealTypes), one for the
+        menus with their type, offer and rate, and the rating rollup, with the latest rates, as a joined row.
+        """
+        return queryset.select_related('rate_rollup').prefetch_related(
+            'cuisines', 'types', 'meal_types',
+            Prefetch('menus', queryset=MenuSerializer.setup_eager_loading(Menu.objects.all())),
+        ).annotate(rate=F('rate_rollup__stars_avg'))
+
+    @staticmethod
+    def get_rate_rollup(obj) -> RestaurantRateRollup:
+        # an unrated restaurant has no rollup, the empty one
+        return getattr(obj, 'rate_rollup', None) or RestaurantRateRollup()
+
     def get_rate(self, obj):
-        return obj.rates.aggregate(stars_avg=Avg('stars')).get('stars_avg', 0)
+        if hasattr(obj, 'rate'):
+            return obj.rate
+        return self.get_rate_rollup(obj).stars_avg
+
+    def get_rates(self, obj):
+        return self.get_rate_rollup(obj).recent
+
+    def get_rates_summary(self, obj):
+        return self.get_rate_rollup(obj).summary
+
+
+class NearbyRestaurantSerializer(RestaurantSerializer):
+    distance = serializers.FloatField(read_only=True)
+
+    class Meta(RestaurantSerializer.Meta):
+        fields = RestaurantSerializer.Meta.fields + ['distance']
+
+
+class NearbySearchSerializer(serializers.Serializer):
+    latitude = serializers.FloatField(min_value=-90, max_value=90)
+    longitude = serializers.FloatField(min_value=-180, max_value=180)
+    radius = serializers.FloatField(min_value=1, max_value=50000, default=5000, help_text='in meters')
+
+    def create(self, validated_data):
+        return None
+
+    def update(self, instance, validated_data):
+        return None
 
 
 class OrderLineSerializer(serializers.ModelSerializer):
@@ -261,8 +350,19 @@ class OrderLineSerializer(serializers.ModelSerializer):
         }
 
 
+class OrderLineCreateSerializer(OrderLineSerializer):
+    """
+    the lines of a new order reference their menu by id, OrderSerializer.validate_lines fetches all the menus
+    in one query instead of one query per line
+    """
+    menu = serializers.IntegerField(source='menu_id')
+
+    class Meta(OrderLineSerializer.Meta):
+        extra_kwargs = dict(OrderLineSerializer.Meta.extra_kwargs, order={'read_only': True})
+
+
 class OrderSerializer(serializers.ModelSerializer):
-    lines = OrderLineSerializer(many=True, required=False)
+    lines = OrderLineCreateSerializer(many=True, required=False)
     created_at = serializers.DateTimeField(read_only=True, format="%Y-%m-%d %H:%M")
     client_name = serializers.SerializerMethodField()
 
@@ -279,6 +379,7 @@ class OrderSerializer(serializers.ModelSerializer):
             'created_at': {'read_only': True},
             'delivery_fees': {'read_only': True},
             'discount_total': {'read_only': True},
+            'sub_total': {'read_only': True},
             'latitude': {'required': False},
             'longitude': {'required': False},
             'phone': {'required': False},
@@ -287,16 +388,40 @@ class OrderSerializer(serializers.ModelSerializer):
             'floor': {'required': False}
         }
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related('restaurant', 'client__owner').prefetch_related('lines__menu')
+
     def get_client_name(self, obj):
         return obj.client.owner.full_name
 
-    def create(self, validated_data):
-        lines = validated_data.pop('lines')
-        number = Order.generate_number()
-        order = Order.objects.create(number=number, **validated_data)
+    def validate_lines(self, lines):
+        menus = Menu.objects.in_bulk({line['menu_id'] for line in lines})
+        unknown = {line['menu_id'] for line in lines} - set(menus)
+        if unknown:
+            raise serializers.ValidationError('Unknown menu(s): {}'.format(', '.join(map(str, sorted(unknown)))))
         for line in lines:
-            OrderLine.objects.create(order=order, **line)
-        return order
+            line['menu'] = menus[line.pop('menu_id')]
+        return lines
+
+    def create(self, validated_data):
+        """
+        creates the order and its lines in a fixed number of queries whatever the number of lines: the line and
+        order totals are computed in memory from the menus loaded by validate_lines, the order is inserted once
+        and the lines in one bulk insert. the new order notification is sent after the commit.
+        """
+        lines = validated_data.pop('lines', [])
+        with transaction.atomic():
+            order = Order(number=Order.generate_number(), **validated_data)
+            lines = [OrderLine(order=order, **line) for line in lines]
+            for line in lines:
+                line.compute_total()
+            order.compute_totals(lines)
+            order.save()
+            for line in lines:
+                line.order = order
+            OrderLine.objects.bulk_create(lines)
+        return self.setup_eager_loading(Order.objects.all()).get(pk=order.pk)
 
 
 class OrderWRestaurantSerializer(OrderSerializer):
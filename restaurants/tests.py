@@ -1,12 +1,54 @@
+import random
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import cache
+from django.core.management import call_command, CommandError
 from django.forms import formset_factory
-from django.test import TestCase, RequestFactory
+from django.test import TestCase, RequestFactory, override_settings
 from django.urls import reverse
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
 
+from base_backend import geohash
+from base_backend.pagination import FeedCursorPagination
+from base_backend.testing import QueryCountTestMixin
+from base_backend.tracking_funcs import measure, measure_many
+from rating.models import RateRestaurant, RateMenu
+from recipe.models import Participant, Recipe, StarsRate
+from recipe.templatetags.extra import has_group
+from restaurants import feed, pricing
 from restaurants.forms import MenuForm, OrderLineForm
-from restaurants.models import (City, Client, MealType, Menu, OfferType, Restaurant, User, Wilaya, Order, OrderLine)
+from restaurants.models import (City, Client, MealType, Menu, OfferType, Restaurant, User, Wilaya, Order, OrderLine,
+                                Cuisine, RestaurantType, RestaurantCuisines, RestaurantTypes, RestaurantMealTypes)
 from restaurants.views import MenuCreateView, RestaurantListView
 
 
+class RestaurantTestMixin:
+    """
+    creates clients and restaurants, the restaurants share an owner and a city
+    """
+    restaurants_count = 0
+
+    def add_client(self) -> Client:
+        return Client.objects.create(owner=User.objects.create(username="Tester", first_name="tester_name",
+                                                               last_name="tester_name", phone="+213899136333",
+                                                               user_type="C"))
+
+    def add_restaurant(self, **kwargs) -> Restaurant:
+        owner, _ = User.objects.get_or_create(username="TesterRestaurantOwner", defaults=dict(
+            first_name="tester_name", last_name="tester_name", phone="+213899136334", user_type="O"))
+        wilaya, _ = Wilaya.objects.get_or_create(name="test", defaults=dict(matricule=1, code_postal=10))
+        city, _ = City.objects.get_or_create(wilaya=wilaya, name="test", defaults=dict(code_postal=19))
+        number = self.restaurants_count
+        self.restaurants_count += 1
+        fields = dict(name="test {}".format(number), registre_commerce="rc{}".format(number),
+                      id_fiscale="if{}".format(number), latitude=15.03, longitude=5.02, main_user=owner,
+                      address="dfqsdfqsdfqsdf", city=city, images="restaurant-{}".format(number))
+        fields.update(kwargs)
+        return Restaurant.objects.create(**fields)
+
+
 class OrderLineTestCase(TestCase):
 
     def setUp(self) -> None:
@@ -134,3 +176,419 @@ class RestaurantTestCase(TestCase):
         for restaurant in restaurants:
             if restaurant.logo:
                 self.assertTrue(isinstance(restaurant.logo.url, str))
+
+
+class HomeFeedTestCase(RestaurantTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.restaurants = [self.add_restaurant() for _ in range(8)]
+        OfferType.objects.create(type="test")
+        MealType.objects.create(type="test")
+        feed.invalidate_pools()
+
+    def test_sample_is_stable_for_a_seed(self):
+        self.assertEqual(feed.sample(feed.ALL, 5, seed=42), feed.sample(feed.ALL, 5, seed=42))
+        self.assertEqual(len(feed.sample(feed.ALL, 5, seed=42)), 5)
+        self.assertEqual(len(feed.sample(feed.ALL, 50, seed=42)), 8)
+
+    def test_pools_are_cached(self):
+        feed.get_pool(feed.ALL)
+        with self.assertNumQueries(0):
+            feed.get_pool(feed.ALL)
+
+    def test_menu_discount_refreshes_special_pool(self):
+        self.assertEqual(feed.get_pool(feed.SPECIAL), [])
+        menu = Menu.objects.create(number=1, name="test", description="test", price=100.0,
+                                   offered_by=self.restaurants[0], type_id=1, offer_id=1, discount=0)
+        self.assertEqual(feed.get_pool(feed.SPECIAL), [])
+        menu.discount = 10
+        menu.save()
+        self.assertEqual(feed.get_pool(feed.SPECIAL), [self.restaurants[0].pk])
+
+    def test_home_returns_every_pool(self):
+        response = self.client.get('/api/restaurants/get-home/', {'seed': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['seed'], 7)
+        self.assertEqual(len(response.data['all']), 5)
+        self.assertEqual(len(response.data['recommended']), 5)
+        self.assertEqual(response.data['special'], [])
+
+
+class RestaurantQueryPlanTestCase(QueryCountTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.owner = User.objects.create(username="TesterRestaurantOwner", first_name="tester_name",
+                                         last_name="tester_name", phone="+213899136334", user_type="O")
+        self.client_profile = Client.objects.create(
+            owner=User.objects.create(username="Tester", first_name="tester_name", last_name="tester_name",
+                                      phone="+213899136333", user_type="C"))
+        self.city = City.objects.create(wilaya=Wilaya.objects.create(name="test", matricule=1, code_postal=10),
+                                        name="test", code_postal=19)
+        self.cuisine = Cuisine.objects.create(name="test")
+        self.restaurant_type = RestaurantType.objects.create(type="test")
+        self.meal_type = MealType.objects.create(type="test")
+        self.offer = OfferType.objects.create(type="test")
+        self.count = 0
+        self.add_restaurant()
+
+    def add_restaurant(self):
+        self.count += 1
+        restaurant = Restaurant.objects.create(name="test", registre_commerce="rc{}".format(self.count),
+                                               id_fiscale="if{}".format(self.count), latitude=15.03, longitude=5.02,
+                                               main_user=self.owner, address="dfqsdfqsdfqsdf", city=self.city,
+                                               images="query-plan-{}".format(self.count), on_special_day=True)
+        RestaurantCuisines.objects.create(restaurant=restaurant, cuisine=self.cuisine)
+        RestaurantTypes.objects.create(restaurant=restaurant, type=self.restaurant_type)
+        RestaurantMealTypes.objects.create(restaurant=restaurant, type=self.meal_type)
+        for number in range(2):
+            Menu.objects.create(number=number, name="menu {}".format(number), description="test", price=100.0,
+                                offered_by=restaurant, type=self.meal_type, offer=self.offer, discount=10)
+            RateRestaurant.objects.create(client=self.client_profile, restaurant=restaurant, stars=number + 3)
+
+    def test_list_query_count_is_constant(self):
+        self.assertConstantQueries(lambda: self.client.get('/api/restaurants/'), self.add_restaurant)
+
+    def test_special_offers_query_count_is_constant(self):
+        self.assertConstantQueries(lambda: self.client.get('/api/restaurants/special-offers/'), self.add_restaurant)
+
+    def test_recommended_offers_query_count_is_constant(self):
+        self.assertConstantQueries(lambda: self.client.get('/api/restaurants/recommended-offers/'),
+                                   self.add_restaurant)
+
+    def test_types_with_menus(self):
+        restaurant = Restaurant.objects.get()
+        RateMenu.objects.create(client=self.client_profile, menu=restaurant.menus.get(number=0), stars=4)
+        response = self.client.get('/api/meal-types/type-with-menus/', {'restaurant': restaurant.pk})
+        self.assertEqual(response.status_code, 200)
+        menus = {menu['number']: menu for menu in response.data[0]['menus']}
+        self.assertEqual((menus[0]['rate'], menus[1]['rate']), (4, None))
+        self.assertConstantQueries(
+            lambda: self.client.get('/api/meal-types/type-with-menus/', {'restaurant': restaurant.pk}),
+            self.add_restaurant)
+
+    def test_rate_is_annotated(self):
+        response = self.client.get('/api/restaurants/')
+        self.assertEqual(response.data[0]['rate'], 3.5)
+        self.assertEqual(len(response.data[0]['menus']), 2)
+        self.assertEqual(response.data[0]['cuisines'], [{'name': 'test', 'id': self.cuisine.pk}])
+
+
+class PaginationTestCase(RestaurantTestMixin, TestCase):
+    def setUp(self) -> None:
+        for _ in range(5):
+            self.add_restaurant()
+
+    def test_lists_are_not_paginated_by_default(self):
+        response = self.client.get('/api/restaurants/')
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 5)
+
+    def test_cursor_pagination_walks_the_whole_list(self):
+        response = self.client.get('/api/restaurants/', {'page_size': 2})
+        names = [restaurant['name'] for restaurant in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            names += [restaurant['name'] for restaurant in response.data['results']]
+        self.assertEqual(names, ["test {}".format(i) for i in reversed(range(5))])
+
+    def test_page_size_is_capped(self):
+        request = Request(APIRequestFactory().get('/api/restaurants/', {'page_size': 1000}))
+        self.assertEqual(FeedCursorPagination().get_page_size(request), FeedCursorPagination.max_page_size)
+
+    def test_recommended_offers_use_page_numbers(self):
+        response = self.client.get('/api/restaurants/recommended-offers/', {'page_size': 2, 'page': 3})
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class NearbyRestaurantsTestCase(RestaurantTestMixin, TestCase):
+    def setUp(self) -> None:
+        # ~0m, ~1.1km, ~4.4km and ~11km north of the search center, plus one on the other side of the country
+        for latitude, longitude in [(36.75, 3.05), (36.76, 3.05), (36.79, 3.05), (36.85, 3.05), (35.69, -0.63)]:
+            self.add_restaurant(latitude=latitude, longitude=longitude)
+
+    def test_geohash_is_maintained_on_save(self):
+        restaurant = Restaurant.objects.get(name="test 0")
+        self.assertEqual(restaurant.geohash, geohash.encode(36.75, 3.05))
+        restaurant.latitude = 35.69
+        restaurant.longitude = -0.63
+        restaurant.save()
+        self.assertEqual(Restaurant.objects.get(pk=restaurant.pk).geohash, geohash.encode(35.69, -0.63))
+
+    def test_nearby_is_sorted_by_distance(self):
+        ranked = Restaurant.objects.nearby(36.75, 3.05, 5000)
+        self.assertEqual([Restaurant.objects.get(pk=pk).name for pk, distance in ranked],
+                         ["test 0", "test 1", "test 2"])
+        self.assertTrue(all(distance <= 5000 for pk, distance in ranked))
+
+    def test_nearby_api(self):
+        response = self.client.get('/api/restaurants/nearby/', {'latitude': 36.75, 'longitude': 3.05,
+                                                                'radius': 5000, 'page_size': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([restaurant['name'] for restaurant in response.data['results']], ["test 0", "test 1"])
+        self.assertAlmostEqual(response.data['results'][1]['distance'], 1113, delta=5)
+
+    def test_bounding_boxes_wrap_the_antimeridian(self):
+        (box,) = geohash.bounding_boxes(36.75, 3.05, 5000)
+        self.assertTrue(box[1] < 3.05 < box[3])
+        east, west = geohash.bounding_boxes(-17.0, 179.99, 5000)
+        self.assertEqual((east[3], west[1]), (180.0, -180.0))
+        # as wide on both sides of the center
+        self.assertAlmostEqual(179.99 - east[1], west[3] - (179.99 - 360))
+        # reaching a pole: every longitude
+        self.assertEqual(geohash.bounding_boxes(89.99, 3.05, 5000), [(89.99 - 5000 / geohash.METERS_PER_DEGREE,
+                                                                     -180.0, 90.0, 180.0)])
+
+    def test_nearby_wraps_the_antimeridian(self):
+        east = self.add_restaurant(latitude=-17.0, longitude=179.99)
+        west = self.add_restaurant(latitude=-17.0, longitude=-179.99)
+        ranked = Restaurant.objects.nearby(-17.0, 179.995, 5000)
+        self.assertEqual([pk for pk, distance in ranked], [east.pk, west.pk])
+
+    def test_nearby_api_validates_coordinates(self):
+        response = self.client.get('/api/restaurants/nearby/', {'latitude': 360, 'longitude': 3.05})
+        self.assertEqual(response.status_code, 400)
+
+
+class DeliveryFeesTestCase(RestaurantTestMixin, TestCase):
+    def setUp(self) -> None:
+        client = self.add_client()
+        restaurant = self.add_restaurant(latitude=36.75, longitude=3.05)
+        # bulk_create: the orders' post_save notification is not what is tested here
+        Order.objects.bulk_create([
+            Order(number=1, client=client, restaurant=restaurant, latitude=36.76, longitude=3.06),
+            Order(number=2, client=client, restaurant=restaurant, latitude=36.70, longitude=2.98),
+            Order(number=3, client=client, restaurant=restaurant),
+        ])
+
+    def test_measure_many_matches_measure(self):
+        generator = random.Random(0)
+        points = [[generator.uniform(-90, 90) for _ in range(200)], [generator.uniform(-180, 180) for _ in range(200)],
+                  [generator.uniform(-90, 90) for _ in range(200)], [generator.uniform(-180, 180) for _ in range(200)]]
+        for expected, distance in zip([measure(*pair) for pair in zip(*points)], measure_many(*points)):
+            self.assertAlmostEqual(expected, distance, delta=1e-6)
+
+    def test_price_orders_matches_the_scalar_fees(self):
+        expected = [order.compute_delivery_fees() for order in Order.objects.order_by('number')]
+        orders = Order.objects.select_related('restaurant').prefetch_related('lines__menu').order_by('number')
+        with self.assertNumQueries(2):
+            fees = [order.delivery_fees for order in pricing.price_orders(orders)]
+        self.assertEqual(fees[2], 0)
+        for expected_fees, order_fees in zip(expected, fees):
+            self.assertAlmostEqual(expected_fees, order_fees, places=6)
+
+
+class OrderTotalsTestCase(RestaurantTestMixin, TestCase):
+    def setUp(self) -> None:
+        client = self.add_client()
+        restaurant = self.add_restaurant(latitude=36.75, longitude=3.05, global_discount=10)
+        meal_type, offer = MealType.objects.create(type="test"), OfferType.objects.create(type="test")
+        self.menus = [Menu.objects.create(number=i, name="menu {}".format(i), description="test", price=100 * (i + 1),
+                                          image="menu.png", offered_by=restaurant, type=meal_type, offer=offer,
+                                          discount=10 * i) for i in range(2)]
+        # bulk_create: the orders' post_save notification is not what is tested here
+        Order.objects.bulk_create([Order(number=1, client=client, restaurant=restaurant, latitude=36.76,
+                                         longitude=3.06)])
+        self.order = Order.objects.get()
+
+    def add_lines(self, update_order=True):
+        for i, menu in enumerate(self.menus):
+            OrderLine(number=i, menu=menu, quantity=2, order=self.order).save(update_order=update_order)
+
+    def assertTotals(self, order):
+        # lines: 2 x 100 and 2 x (200 - 10%), then 10% restaurant discount
+        self.assertAlmostEqual(order.sub_total, 560)
+        self.assertAlmostEqual(order.discount_total, 40 + 56)
+        fees = measure(36.76, 3.06, 36.75, 3.05) * pricing.DELIVERY_FEES_PER_METER
+        self.assertAlmostEqual(order.delivery_fees, fees, places=4)
+        self.assertAlmostEqual(order.total, 560 - 96 + fees, places=4)
+
+    def test_saving_lines_updates_the_totals(self):
+        self.add_lines()
+        self.assertTotals(Order.objects.get())
+
+    @mock.patch('restaurants.pricing.transaction.on_commit', lambda function: function())
+    def test_deleting_a_line_updates_the_totals(self):
+        self.add_lines()
+        OrderLine.objects.get(menu=self.menus[1]).delete()
+        order = Order.objects.get()
+        self.assertAlmostEqual(order.sub_total, 200)
+        self.assertAlmostEqual(order.discount_total, 20)
+
+    def test_deleting_lines_updates_the_totals_once(self):
+        self.add_lines()
+        with mock.patch('restaurants.pricing.transaction.on_commit') as on_commit:
+            OrderLine.objects.all().delete()
+        with self.assertNumQueries(3):
+            # the order and its lines (none left), then the update
+            for call in on_commit.call_args_list:
+                call[0][0]()
+        order = Order.objects.get()
+        self.assertEqual((order.sub_total, order.discount_total), (0, 0))
+        self.assertAlmostEqual(order.total, order.delivery_fees)
+
+    def test_deleting_an_order_doesnt_update_its_totals(self):
+        self.add_lines()
+        with mock.patch('restaurants.pricing.transaction.on_commit') as on_commit:
+            self.order.delete()
+        with self.assertNumQueries(1):
+            for call in on_commit.call_args_list:
+                call[0][0]()
+
+    def test_moving_the_order_updates_the_fees(self):
+        self.add_lines()
+        self.order.refresh_from_db()
+        self.order.latitude, self.order.longitude = 36.75, 3.05
+        self.order.save(update_fields=['latitude', 'longitude'])
+        order = Order.objects.get()
+        self.assertEqual(order.delivery_fees, 0)
+        self.assertAlmostEqual(order.total, 560 - 96)
+
+    def test_saving_a_stale_order_keeps_the_totals(self):
+        self.add_lines()
+        # loaded before its lines were saved
+        self.order.status = 'A'
+        self.order.save()
+        self.assertTotals(Order.objects.get())
+        self.assertEqual(Order.objects.get().status, 'A')
+
+    def test_moving_a_stale_order_recomputes_the_totals(self):
+        self.add_lines()
+        self.order.latitude, self.order.longitude = 36.75, 3.05
+        self.order.save()
+        order = Order.objects.get()
+        self.assertEqual(order.delivery_fees, 0)
+        self.assertAlmostEqual(order.total, 560 - 96)
+
+    def test_backfill_and_verify(self):
+        self.add_lines(update_order=False)
+        with self.assertRaises(CommandError):
+            call_command('backfill_order_totals', '--verify')
+        call_command('backfill_order_totals')
+        self.assertTotals(Order.objects.get())
+        call_command('backfill_order_totals', '--verify')
+
+
+class OrderCreateTestCase(RestaurantTestMixin, QueryCountTestMixin, TestCase):
+    def setUp(self) -> None:
+        self.user = self.add_client().owner
+        self.restaurant = self.add_restaurant(latitude=36.75, longitude=3.05)
+        meal_type, offer = MealType.objects.create(type="test"), OfferType.objects.create(type="test")
+        Menu.objects.bulk_create([Menu(number=i, name="menu {}".format(i), description="test", price=100,
+                                       image="menu.png", offered_by=self.restaurant, type=meal_type, offer=offer,
+                                       discount=10) for i in range(50)])
+        self.menus = list(Menu.objects.values_list('pk', flat=True))
+        self.client.force_login(self.user)
+
+    def create_order(self, lines):
+        return self.client.post('/api/orders/', {
+            'restaurant': self.restaurant.pk, 'latitude': 36.76, 'longitude': 3.06,
+            'lines': [{'number': i, 'menu': menu, 'quantity': 2} for i, menu in enumerate(self.menus[:lines])],
+        }, content_type='application/json')
+
+    def test_create_order(self):
+        response = self.create_order(50)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data['lines']), 50)
+        order = Order.objects.get()
+        self.assertEqual(order.lines.count(), 50)
+        self.assertAlmostEqual(order.sub_total, 50 * 2 * 90)
+        self.assertAlmostEqual(response.data['total'], order.total)
+
+    def test_create_order_runs_a_fixed_number_of_queries(self):
+        self.assertEqual(self.count_queries(lambda: self.create_order(1)),
+                         self.count_queries(lambda: self.create_order(50)))
+
+    def test_create_order_with_an_unknown_menu(self):
+        self.menus.append(0)
+        response = self.create_order(51)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+
+@override_settings(ROLES_CACHE='default')
+class RolesTestCase(TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        self.client_group, self.owner_group = Group.objects.create(name='client'), Group.objects.create(name='owner')
+        self.user = User.objects.create(username="Tester", phone="+213899136333", user_type="C")
+        self.user.groups.add(self.client_group)
+
+    def test_roles_are_loaded_once(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.roles, {'client'})
+            self.assertTrue(has_group(user, 'client'))
+            self.assertFalse(has_group(user, 'owner'))
+
+    def test_roles_are_shared_across_instances(self):
+        self.assertEqual(self.user.roles, {'client'})
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(user.roles, {'client'})
+
+    def test_changing_groups_invalidates_the_roles(self):
+        self.assertEqual(self.user.roles, {'client'})
+        self.user.groups.add(self.owner_group)
+        self.assertEqual(self.user.roles, {'client', 'owner'})
+        self.owner_group.user_set.remove(self.user)
+        self.assertEqual(User.objects.get(pk=self.user.pk).roles, {'client'})
+        self.client_group.user_set.clear()
+        self.assertEqual(User.objects.get(pk=self.user.pk).roles, set())
+
+    def test_renaming_or_deleting_groups_invalidates_the_roles(self):
+        self.assertEqual(self.user.roles, {'client'})
+        self.client_group.name = 'customer'
+        self.client_group.save()
+        self.assertEqual(User.objects.get(pk=self.user.pk).roles, {'customer'})
+        self.client_group.delete()
+        self.assertEqual(User.objects.get(pk=self.user.pk).roles, set())
+
+    def test_anonymous_users_have_no_roles(self):
+        self.assertFalse(has_group(AnonymousUser(), 'client'))
+
+    @override_settings(ROLES_CACHE=None)
+    def test_revoked_roles_arent_cached_without_a_shared_cache(self):
+        self.assertEqual(self.user.roles, {'client'})
+        # revoked by another process, the receivers of this one don't run
+        User.groups.through.objects.filter(user=self.user).delete()
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.roles, set())
+        self.assertFalse(has_group(user, 'client'))
+
+
+class UserSerializerTestCase(QueryCountTestMixin, TestCase):
+    def setUp(self) -> None:
+        cache.clear()
+        Group.objects.create(name='client')
+        Group.objects.create(name='participant')
+        self.users = 0
+
+    def add_participant(self):
+        self.users += 1
+        user = User.objects.create(username="participant {}".format(self.users),
+                                   phone="+2138991363{:02}".format(self.users), user_type="C", is_active=True)
+        user.groups.add(Group.objects.get(name='client'))
+        client = Client.objects.create(owner=user, is_participant=True)
+        client.participant = Participant.objects.create(profile=client)
+        client.save()
+        recipe = Recipe.objects.create(published_by=client.participant, food_name="recipe", cost=10,
+                                       description="test", media="recipe {}".format(self.users))
+        StarsRate.objects.create(user=client, recipe=recipe, stars=self.users)
+        return user
+
+    def test_output_is_unchanged(self):
+        # imported here: UserSerializer reads the vehicle types when its module is imported
+        from restaurants.serializers import UserSerializer
+
+        user = self.add_participant()
+        expected = UserSerializer(User.objects.get(pk=user.pk)).data
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [expected])
+        self.assertEqual(response.data[0]['client'], user.client.pk)
+        self.assertEqual(response.data[0]['participant'], user.client.participant.pk)
+        self.assertEqual(response.data[0]['stars'], 1)
+
+    def test_users_list_runs_a_fixed_number_of_queries(self):
+        self.add_participant()
+        self.assertConstantQueries(lambda: self.client.get('/api/users/'), self.add_participant)
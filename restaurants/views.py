@@ -1,6 +1,5 @@
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.db.models import Avg, Count
 from django.forms import formset_factory
 from django.http import JsonResponse, HttpResponseRedirect
 from django.shortcuts import render, redirect, get_object_or_404
@@ -11,7 +10,7 @@ from django.utils.translation import gettext_lazy as _
 from django.views import View
 from django.views.generic import FormView, ListView, CreateView, DeleteView, DetailView, UpdateView
 
-from base_backend.models import Round
+from base_backend.roles import get_roles
 from base_backend.utils import activate_user_over_otp
 from recipe.models import Recipe, Participant
 from restaurants.forms import LoginForm, BaseRegistrationForm, OtpForm, FilterRecipeForm, OrderLineForm, MenuForm, \
@@ -26,13 +25,11 @@ class Home(View):
 
     def get(self, request):
         user_avg = None
-        if request.user.is_authenticated and 'client' in request.user.groups.all() and \
+        if request.user.is_authenticated and 'client' in request.user.roles and \
                 request.user.client.is_participant:
-            user_avg = Participant.objects.filter(pk=request.user.client.participant.pk) \
-                .annotate(likes_=Count("recipes__likes")).annotate(avg=Round(Avg('recipes__stars__stars'), 1))[0]
+            user_avg = Participant.objects.filter(pk=request.user.client.participant.pk).with_scores()[0]
 
-        recipes = Recipe.objects.all().annotate(avg=Round(Avg('stars__stars'), 1)).annotate(likes_=Count('likes')) \
-            .annotate(comments_=(Count('comments'))).order_by('-created_at')
+        recipes = Recipe.objects.with_counters().order_by('-created_at')
         wilayas = Wilaya.objects.all()
         cuisines = Cuisine.objects.all()
         restaurants = Restaurant.objects.all().order_by('?')[0:11]
@@ -52,7 +49,9 @@ class Home(View):
             data_filtered = filter_form.filter()
             html = render_to_string(template_name="list_recipe.html",
                                     context={"data": data_filtered})
-            return JsonResponse(data={'html': html})
+            counts = {facet: {str(pk): count for pk, count in facet_counts.items()}
+                      for facet, facet_counts in filter_form.facet_counts().items()}
+            return JsonResponse(data={'html': html, 'facets': counts})
         else:
             return JsonResponse(data={'html': "Empty"})
 
@@ -209,7 +208,7 @@ class RestaurantOfferTypeCreate(CreateView):
 # orders and order lines
 class OrdersMixin:
     def my_get_queryset(self):
-        groups = self.request.user.groups.all().values_list('name', flat=True)
+        groups = get_roles(self.request.user)
         if "client" in groups:
             return self.queryset.filter(visible=True, client=self.request.user)
         elif "owner" in groups:
@@ -229,14 +228,13 @@ class OrderCreateView(FormView):
     form_class = formset_factory(OrderLineForm, extra=2, min_num=1, validate_min=True)
 
     def form_valid(self, forms):
-        order = Order.objects.create(number=Order.generate_number(), client=self.request.user.client)
-        for form in forms:
-            line = form.save()
+        lines = [form.save() for form in forms if form.has_changed()]
+        order = Order.objects.create(number=Order.generate_number(), client=self.request.user.client,
+                                     restaurant=lines[0].menu.offered_by if lines else None)
+        for line in lines:
             line.order = order
-            line.save()
-            if not order.restaurant:
-                order.restaurant = line.menu.offered_by
-                order.save()
+            line.save(update_order=False)
+        order.update_totals(lines)
         return HttpResponseRedirect(self.get_success_url(), pk=order.pk)
 
 
@@ -307,7 +305,7 @@ class OrderLineUpdateView(UpdateView):
 class MenuViewsMixin:
 
     def my_form_kwargs(self):
-        groups = self.request.user.groups.all().values_list('name', flat=True)
+        groups = get_roles(self.request.user)
         if 'owner' in groups:
             self.kwargs['queryset'] = Restaurant.objects.filter(main_user=self.request.user)
         elif 'staff' in groups:
@@ -318,7 +316,7 @@ class MenuViewsMixin:
             self.kwargs['queryset'] = Restaurant.objects.all()
 
     def my_get_queryset(self):
-        groups = self.request.user.groups.all().values_list('name', flat=True)
+        groups = get_roles(self.request.user)
         if 'owner' in groups:
             if self.kwargs.get('pk', None):
                 self.queryset = Menu.objects.filter(offered_by__main_user=self.request.user,
@@ -442,7 +440,7 @@ class MenuDetailsView(DetailView, MenuViewsMixin):
 class RestaurantMixin:
 
     def my_get_queryset(self):
-        groups = self.request.user.groups.all().values_list('name', flat=True)
+        groups = get_roles(self.request.user)
         if 'owner' in groups:
             self.queryset = Restaurant.objects.filter(main_user=self.request.user)
         elif 'staff' in groups:
@@ -461,7 +459,7 @@ class RestaurantCreateView(CreateView):
 
     def get_form_kwargs(self):
         kwargs = super(RestaurantCreateView, self).get_form_kwargs()
-        groups = self.request.user.groups.all().values_list('name', flat=True)
+        groups = get_roles(self.request.user)
         if 'owner' in groups:
             kwargs['user_instance'] = self.request.user
         return kwargs
@@ -0,0 +1,4 @@
+# Register your models here.
+from base_backend.admin import register_app_models
+
+register_app_models(app_name='search')
@@ -0,0 +1,31 @@
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from search import engine
+from search.serializers import DocumentSerializer, SearchQuerySerializer, SuggestQuerySerializer
+
+
+class SearchApi(APIView):
+    """
+    the recipes, menus and restaurants matching ?q, ranked. filtered on ?kind (repeatable), ?cuisine, ?meal_type,
+    ?wilaya and ?restaurant
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        query = SearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(DocumentSerializer(engine.search(**query.get_search_arguments()), many=True).data)
+
+
+class SuggestApi(APIView):
+    """
+    the autocomplete of ?q being typed, takes the filters of SearchApi
+    """
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request):
+        query = SuggestQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(DocumentSerializer(engine.suggest(**query.get_search_arguments()), many=True).data)
@@ -0,0 +1,125 @@
+"""
+queries the search index (see search.indexer). a query is tokenized as the indexed texts are, the documents are
+ranked by the number of the query's tokens they contain, then by the weights of the matched terms. the documents
+are filtered on their columns, and on the cuisines, meal types and wilaya of the restaurants through their tables.
+"""
+from functools import reduce
+from operator import or_, add
+
+from django.db.models import Q, Sum, Max, Case, When, Value, IntegerField
+
+from search import text
+
+
+def parse_query(query, prefix=False) -> list:
+    """
+    :param query: the text typed by the user
+    :param prefix: the last token is being typed, it matches the terms it starts
+    :return: a Q on the postings' terms per token
+    """
+    tokens = text.tokenize(query)
+    if not prefix:
+        return [Q(term=token) for token in dict.fromkeys(tokens)]
+    # the stop words aren't dropped from what is being typed, "de" may become "dessert"
+    typed = text.tokenize(query, keep_stop_words=True)[-1:]
+    if tokens and typed and tokens[-1] == typed[0]:
+        tokens = tokens[:-1]
+    conditions = [Q(term=token) for token in dict.fromkeys(tokens)]
+    for token in typed:
+        conditions.append(reduce(or_, (Q(term__startswith=variant) for variant in text.prefix_variants(token))))
+    return conditions
+
+
+def filter_documents(documents, kinds=None, cuisine=None, meal_type=None, wilaya=None, restaurant=None):
+    """
+    :param documents: a Document queryset
+    :param kinds: the kinds of documents, all of them by default
+    :param cuisine: a Cuisine pk
+    :param meal_type: a MealType pk
+    :param wilaya: a Wilaya pk, the wilaya of the restaurant or of the recipe's author
+    :param restaurant: a Restaurant pk, its menus and itself
+    :return: the filtered queryset
+    """
+    from recipe.models import Recipe
+    from restaurants.models import RestaurantCuisines, RestaurantMealTypes, Restaurant
+
+    if kinds:
+        documents = documents.filter(kind__in=kinds)
+    if cuisine:
+        documents = documents.filter(
+            Q(cuisine=cuisine) |
+            Q(kind='restaurant', object_id__in=RestaurantCuisines.objects.filter(cuisine=cuisine).values('restaurant')))
+    if meal_type:
+        documents = documents.filter(
+            Q(meal_type=meal_type) |
+            Q(kind='restaurant', object_id__in=RestaurantMealTypes.objects.filter(type=meal_type).values('restaurant')))
+    if wilaya:
+        documents = documents.filter(
+            Q(restaurant__in=Restaurant.objects.filter(city__wilaya=wilaya).values('pk')) |
+            Q(kind='recipe', object_id__in=Recipe.objects.filter(published_by__score__wilaya=wilaya).values('pk')))
+    if restaurant:
+        documents = documents.filter(restaurant=restaurant)
+    return documents
+
+
+def search(query, prefix=False, match_all=False, limit=20, **filters) -> list:
+    """
+    :param query: the text typed by the user
+    :param prefix: see parse_query
+    :param match_all: only the documents containing every token of the query
+    :param limit: the maximal number of documents
+    :param filters: see filter_documents
+    :return: the ranked documents, each annotated with matched (the number of the query's tokens it contains)
+     and score (the weights of its matched terms)
+    """
+    from search.models import Document, Posting
+
+    conditions = parse_query(query, prefix)
+    if not conditions:
+        return []
+    matched = reduce(add, (Max(Case(When(condition, then=Value(1)), default=Value(0), output_field=IntegerField()))
+                           for condition in conditions))
+    ranked = Posting.objects.filter(reduce(or_, conditions),
+                                    document__in=filter_documents(Document.objects.all(), **filters)) \
+        .values('document').annotate(matched=matched, score=Sum('weight')) \
+        .order_by('-matched', '-score', 'document')
+    if match_all:
+        ranked = ranked.filter(matched=len(conditions))
+    ranked = list(ranked[:limit])
+    documents = Document.objects.in_bulk([row['document'] for row in ranked])
+    results = []
+    for row in ranked:
+        document = documents[row['document']]
+        document.matched, document.score = row['matched'], row['score']
+        results.append(document)
+    return results
+
+
+def suggest(query, limit=10, **filters) -> list:
+    """
+    the autocomplete: the documents containing every token of what is being typed, the last one as a prefix
+    :param query: the text being typed
+    :param limit: the maximal number of suggestions
+    :param filters: see filter_documents
+    :return: the ranked documents, see search
+    """
+    return search(query, prefix=True, match_all=True, limit=limit, **filters)
+
+
+def matching_ids(kind, query, **filters):
+    """
+    :param kind: the kind of the documents
+    :param query: the text typed by the user
+    :param filters: see filter_documents
+    :return: a queryset of the pks of the objects whose documents contain every token of the query, the last one
+     as a prefix, to filter the objects' querysets on
+    """
+    from search.models import Document, Posting
+
+    conditions = parse_query(query, prefix=True)
+    documents = filter_documents(Document.objects.all(), kinds=[kind], **filters)
+    if not conditions:
+        documents = documents.none()
+    for condition in conditions:
+        documents = documents.filter(pk__in=Posting.objects.filter(condition).values('document'))
+    return documents.values('object_id')
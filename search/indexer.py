@@ -0,0 +1,170 @@
+"""
+builds the search index: a document per recipe, menu and restaurant, and a posting per term of its texts.
+the receivers of search.models schedule the reindexing of what was saved or deleted once the transaction commits,
+each object being reindexed once however many of its parts were saved.
+"""
+import logging
+import threading
+from collections import Counter
+
+from django.db import transaction
+from django.utils.timezone import now
+
+from search import text
+
+# a term is weighted by the fields it occurs in, each occurrence in a field counts up to MAX_OCCURRENCES
+TITLE_WEIGHT = 8
+INGREDIENT_WEIGHT = 4
+DESCRIPTION_WEIGHT = 2
+STEP_WEIGHT = 1
+MAX_OCCURRENCES = 3
+BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+_local = threading.local()
+
+
+def recipe_documents(pks):
+    from recipe.models import Recipe
+
+    recipes = Recipe.objects.filter(pk__in=pks).prefetch_related('steps', 'custom_contains')
+    for recipe in recipes:
+        fields = [(recipe.food_name, TITLE_WEIGHT), (recipe.description, DESCRIPTION_WEIGHT)]
+        fields += [(contains.ingredient, INGREDIENT_WEIGHT) for contains in recipe.custom_contains.all()]
+        fields += [(step.description, STEP_WEIGHT) for step in recipe.steps.all()]
+        yield recipe.pk, dict(title=recipe.food_name, cuisine_id=recipe.cuisine_id, meal_type_id=recipe.type_id,
+                              restaurant_id=None), fields
+
+
+def menu_documents(pks):
+    from restaurants.models import Menu
+
+    for menu in Menu.objects.filter(pk__in=pks):
+        fields = [(menu.name, TITLE_WEIGHT), (menu.description, DESCRIPTION_WEIGHT)]
+        yield menu.pk, dict(title=menu.name, cuisine_id=menu.cuisine_id, meal_type_id=menu.type_id,
+                            restaurant_id=menu.offered_by_id), fields
+
+
+def restaurant_documents(pks):
+    from restaurants.models import Restaurant
+
+    for restaurant in Restaurant.objects.filter(pk__in=pks):
+        fields = [(restaurant.name, TITLE_WEIGHT), (restaurant.address, DESCRIPTION_WEIGHT)]
+        # the cuisines and meal types of a restaurant are many, it is filtered on them through their tables
+        yield restaurant.pk, dict(title=restaurant.name, cuisine_id=None, meal_type_id=None,
+                                  restaurant_id=restaurant.pk), fields
+
+
+BUILDERS = {
+    'recipe': recipe_documents,
+    'menu': menu_documents,
+    'restaurant': restaurant_documents,
+}
+# the recipes' ingredients index, see search.ingredients
+INGREDIENTS = 'ingredients'
+KINDS = list(BUILDERS) + [INGREDIENTS]
+
+
+def weigh_terms(fields) -> dict:
+    """
+    :param fields: [(text, weight)]
+    :return: term -> weight
+    """
+    weights = Counter()
+    for value, weight in fields:
+        for term, occurrences in Counter(text.tokenize(value)).items():
+            weights[term] += weight * min(occurrences, MAX_OCCURRENCES)
+    return weights
+
+
+def index(kind, pks) -> int:
+    """
+    (re)indexes the objects, the documents of those that don't exist anymore are removed
+    :param kind: a key of BUILDERS, or INGREDIENTS
+    :param pks: the objects' pks
+    :return: the number of indexed documents
+    """
+    from search.models import Document, Posting
+
+    if kind == INGREDIENTS:
+        from search import ingredients
+        return ingredients.index(pks)
+    pks = set(pks)
+    built = {pk: (columns, weigh_terms(fields)) for pk, columns, fields in BUILDERS[kind](pks)}
+    with transaction.atomic():
+        Document.objects.filter(kind=kind, object_id__in=pks - set(built)).delete()
+        indexed = Document.objects.filter(kind=kind, object_id__in=built)
+        existing = {document.object_id: document for document in indexed}
+        for pk, (columns, _) in built.items():
+            document = existing.get(pk) or Document(kind=kind, object_id=pk)
+            for column, value in columns.items():
+                setattr(document, column, value)
+            document.title = document.title[:150]
+            document.indexed_at = now()
+            existing.setdefault(pk, document)
+        Document.objects.bulk_create([document for document in existing.values() if document.pk is None])
+        Document.objects.bulk_update([document for document in existing.values() if document.pk is not None],
+                                     ['title', 'cuisine', 'meal_type', 'restaurant', 'indexed_at'])
+        # bulk_create doesn't set the pks on every backend
+        documents = {document.object_id: document for document in indexed.all()}
+        Posting.objects.filter(document__in=list(documents.values())).delete()
+        Posting.objects.bulk_create(
+            [Posting(term=term, document=documents[pk], weight=weight)
+             for pk, (_, weights) in built.items() for term, weight in weights.items()],
+            batch_size=BATCH_SIZE)
+    return len(built)
+
+
+def _pending() -> set:
+    if not hasattr(_local, 'pending'):
+        _local.pending = set()
+    return _local.pending
+
+
+def schedule(kind, *pks):
+    """
+    reindexes the objects once the current transaction commits. an object scheduled several times in the
+    transaction is reindexed by the first callback only. a failure is logged, it doesn't fail the committed request
+    :param kind: a key of BUILDERS, or INGREDIENTS
+    :param pks: the objects' pks
+    """
+    keys = {(kind, pk) for pk in pks if pk is not None}
+    if not keys:
+        return
+    _pending().update(keys)
+
+    def flush():
+        pending = _pending()
+        due = keys & pending
+        pending.difference_update(due)
+        for due_kind in {due_kind for due_kind, _ in due}:
+            due_pks = [pk for key_kind, pk in due if key_kind == due_kind]
+            try:
+                index(due_kind, due_pks)
+            except Exception:
+                # the write is committed, the index catches up with the rebuild_search_index command
+                logger.exception('could not index the %s %s', due_kind, due_pks)
+
+    transaction.on_commit(flush)
+
+
+def rebuild(kind, batch_size=BATCH_SIZE) -> int:
+    """
+    reindexes every object of the kind, and removes the documents of the deleted ones
+    :param kind: a key of BUILDERS, or INGREDIENTS
+    :param batch_size: the number of objects indexed per transaction
+    :return: the number of indexed documents
+    """
+    from recipe.models import Recipe
+    from restaurants.models import Menu, Restaurant
+    from search.models import Document, IngredientPosting, RecipeIngredients
+
+    model = {'recipe': Recipe, 'menu': Menu, 'restaurant': Restaurant, INGREDIENTS: Recipe}[kind]
+    pks = list(model.objects.order_by('pk').values_list('pk', flat=True))
+    if kind == INGREDIENTS:
+        # the ingredients index is updated by differences with what was indexed, it is rebuilt from scratch
+        IngredientPosting.objects.all().delete()
+        RecipeIngredients.objects.all().delete()
+    else:
+        Document.objects.filter(kind=kind).exclude(object_id__in=model.objects.values('pk')).delete()
+    return sum(index(kind, pks[start:start + batch_size]) for start in range(0, len(pks), batch_size))
@@ -0,0 +1,184 @@
+"""
+the ingredients index: "what can I cook with these". an ingredient's name (Contains.ingredient, CustomContains) is
+normalized by the search tokenizer into a term ("Tomates fraîches" -> "tomate fraiche"), and each term is mapped to
+the sorted ids of the recipes containing it, packed in one binary column (IngredientPosting). the "#size:<n>" terms
+map the recipes to their numbers of ingredients.
+a lookup reads the postings of its terms and of the sizes it needs, and answers by set operations in memory:
+the recipes containing every required ingredient, and the recipes missing at most n ingredients of a list.
+the receivers of search.models reindex a recipe when its ingredients change, once the transaction commits.
+"""
+import sys
+from array import array
+from collections import Counter, namedtuple, defaultdict
+
+from django.db import transaction, IntegrityError
+
+from search import text
+
+SIZE_TERM = '#size:{}'
+MAX_TERM_LENGTH = 150
+
+Match = namedtuple('Match', ['recipe_id', 'matched', 'missing'])
+
+
+def ingredient_term(name) -> str:
+    return ' '.join(text.tokenize(name))[:MAX_TERM_LENGTH]
+
+
+def pack(ids) -> bytes:
+    """
+    :param ids: recipe ids
+    :return: the sorted ids as little endian unsigned 32 bits integers
+    """
+    packed = array('I', sorted(ids))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack(data) -> array:
+    ids = array('I')
+    ids.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        ids.byteswap()
+    return ids
+
+
+def recipe_terms(pks) -> dict:
+    """
+    :param pks: recipe pks
+    :return: recipe pk -> its ingredients terms, for the existing recipes
+    """
+    from recipe.models import Recipe, Contains, CustomContains
+
+    terms = {pk: set() for pk in Recipe.objects.filter(pk__in=pks).values_list('pk', flat=True)}
+    for recipe_id, name in CustomContains.objects.filter(recipe__in=terms).values_list('recipe', 'ingredient'):
+        terms[recipe_id].add(ingredient_term(name))
+    for recipe_id, name in Contains.objects.filter(recipe__in=terms).values_list('recipe', 'ingredient__name'):
+        terms[recipe_id].add(ingredient_term(name))
+    for recipe_terms_set in terms.values():
+        recipe_terms_set.discard('')
+        if recipe_terms_set:
+            recipe_terms_set.add(SIZE_TERM.format(len(recipe_terms_set)))
+    return terms
+
+
+def index(pks, retries=2) -> int:
+    """
+    updates the postings of the ingredients the recipes gained or lost since they were last indexed.
+    the deleted recipes are removed from the index
+    :param pks: recipe pks
+    :param retries: the number of times the update is retried when a new term is created concurrently
+    :return: the number of indexed recipes
+    """
+    pks = set(pks)
+    terms = recipe_terms(pks)
+    while True:
+        try:
+            with transaction.atomic():
+                return _write_postings(pks, terms)
+        except IntegrityError:
+            # a term new to the index was added by the indexing of another recipe meanwhile, it is updated now
+            if not retries:
+                raise
+            retries -= 1
+
+
+def _write_postings(pks, terms) -> int:
+    """
+    the writes of index, in its transaction
+    :param terms: recipe pk -> its ingredients terms, see recipe_terms
+    """
+    from search.models import IngredientPosting, RecipeIngredients
+
+    indexed = {row.recipe_id: row
+               for row in RecipeIngredients.objects.select_for_update().filter(recipe_id__in=pks)}
+    added, removed = defaultdict(set), defaultdict(set)
+    for pk in pks:
+        old = set(indexed[pk].terms.split('\n')) - {''} if pk in indexed else set()
+        new = terms.get(pk, set())
+        for term in new - old:
+            added[term].add(pk)
+        for term in old - new:
+            removed[term].add(pk)
+    changed = set(added) | set(removed)
+    postings = {posting.term: posting
+                for posting in IngredientPosting.objects.select_for_update().filter(term__in=changed)}
+    for term in changed:
+        posting = postings.setdefault(term, IngredientPosting(term=term))
+        posting.recipes = pack((set(unpack(posting.recipes)) - removed[term]) | added[term])
+    IngredientPosting.objects.filter(pk__in=[posting.pk for posting in postings.values()
+                                             if posting.pk is not None and not posting.recipes]).delete()
+    IngredientPosting.objects.bulk_update([posting for posting in postings.values()
+                                           if posting.pk is not None and posting.recipes], ['recipes'])
+    IngredientPosting.objects.bulk_create([posting for posting in postings.values()
+                                           if posting.pk is None and posting.recipes])
+
+    RecipeIngredients.objects.filter(recipe_id__in=[pk for pk in indexed if not terms.get(pk)]).delete()
+    rows = [RecipeIngredients(recipe_id=pk, terms='\n'.join(sorted(recipe_terms_set)))
+            for pk, recipe_terms_set in terms.items() if recipe_terms_set]
+    RecipeIngredients.objects.bulk_update([row for row in rows if row.recipe_id in indexed], ['terms'])
+    RecipeIngredients.objects.bulk_create([row for row in rows if row.recipe_id not in indexed])
+    return len(terms)
+
+
+def load_postings(terms) -> dict:
+    """
+    :param terms: ingredients or size terms
+    :return: term -> set of recipe ids, empty for the unknown terms
+    """
+    from search.models import IngredientPosting
+
+    postings = {term: set() for term in terms}
+    for term, recipes in IngredientPosting.objects.filter(term__in=postings).values_list('term', 'recipes'):
+        postings[term] = set(unpack(recipes))
+    return postings
+
+
+def lookup(have=(), require=(), missing=None, limit=None) -> list:
+    """
+    :param have: the ingredients at hand, as typed
+    :param require: the ingredients the recipes must contain, as typed. they are at hand too
+    :param missing: the maximal number of the recipes' ingredients that aren't at hand, no maximum by default
+    :param limit: the maximal number of recipes
+    :return: the matching recipes as Match(recipe_id, matched, missing), by fewest missing ingredients, then most
+     matched ingredients, then newest recipe
+    """
+    require = {ingredient_term(name) for name in require} - {''}
+    have = ({ingredient_term(name) for name in have} - {''}) | require
+    if not have:
+        return []
+    postings = load_postings(have)
+    if require:
+        candidates = set.intersection(*(postings[term] for term in require))
+    else:
+        candidates = set.union(*postings.values())
+    matched = Counter()
+    for term in have:
+        for recipe_id in postings[term] & candidates:
+            matched[recipe_id] += 1
+    if not matched:
+        return []
+    # a recipe matching m ingredients has m + missing of them at most
+    sizes = load_sizes(max(matched.values()) + missing if missing is not None else None)
+    matches = []
+    for size, recipes in sizes.items():
+        for recipe_id in recipes & candidates:
+            if missing is None or size - matched[recipe_id] <= missing:
+                matches.append(Match(recipe_id, matched[recipe_id], size - matched[recipe_id]))
+    matches.sort(key=lambda match: (match.missing, -match.matched, -match.recipe_id))
+    return matches[:limit] if limit is not None else matches
+
+
+def load_sizes(largest=None) -> dict:
+    """
+    :param largest: the largest number of ingredients needed, all of them by default
+    :return: number of ingredients -> set of the ids of the recipes having that many
+    """
+    from search.models import IngredientPosting
+
+    if largest is not None:
+        terms = [SIZE_TERM.format(size) for size in range(1, largest + 1)]
+        return {int(term.split(':')[1]): recipes for term, recipes in load_postings(terms).items()}
+    return {int(term.split(':')[1]): set(unpack(recipes)) for term, recipes in
+            IngredientPosting.objects.filter(term__startswith=SIZE_TERM.format('')).values_list('term', 'recipes')}
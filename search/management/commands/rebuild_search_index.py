@@ -0,0 +1,21 @@
+"""
+rebuilds the search index from the recipes, menus and restaurants, and the recipes' ingredients index.
+the receivers of search.models keep them up to date, run it once after deploying the search app, and after writes
+that skip the signals (queryset updates, raw sql). the documents of the deleted objects are removed.
+"""
+from django.core.management import BaseCommand
+
+from search import indexer
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the search index and the ingredients index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', action='append', choices=indexer.KINDS,
+                            help='the kinds of documents to rebuild, all of them by default')
+        parser.add_argument('--batch-size', type=int, default=indexer.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        for kind in options['kind'] or indexer.KINDS:
+            print('{}: {} documents indexed'.format(kind, indexer.rebuild(kind, options['batch_size'])))
@@ -0,0 +1,46 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('restaurants', '0024_restaurant_image_sha256'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Document',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('recipe', 'recipe'), ('menu', 'menu'), ('restaurant', 'restaurant')], max_length=10)),
+                ('object_id', models.IntegerField()),
+                ('title', models.CharField(max_length=150)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+                ('cuisine', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='restaurants.Cuisine')),
+                ('meal_type', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='restaurants.MealType')),
+                ('restaurant', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='restaurants.Restaurant')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Posting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('weight', models.IntegerField()),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='search.Document')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='posting',
+            index=models.Index(fields=['term', 'document'], name='search_post_term_8d8621_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='document',
+            unique_together={('kind', 'object_id')},
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientPosting',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=150, unique=True)),
+                ('recipes', models.BinaryField(default=b'')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RecipeIngredients',
+            fields=[
+                ('recipe_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('terms', models.TextField(default='')),
+            ],
+        ),
+    ]
@@ -0,0 +1,109 @@
+from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from base_backend.models import cascade
+from search import indexer
+
+
+class Document(models.Model):
+    """
+    an indexed recipe, menu or restaurant, with the columns the searches are filtered on.
+    kept up to date by the receivers below, rebuilt by the rebuild_search_index command. see search.engine
+    """
+    RECIPE = 'recipe'
+    MENU = 'menu'
+    RESTAURANT = 'restaurant'
+    KINDS = (
+        (RECIPE, 'recipe'),
+        (MENU, 'menu'),
+        (RESTAURANT, 'restaurant'),
+    )
+    kind = models.CharField(max_length=10, choices=KINDS)
+    object_id = models.IntegerField()
+    title = models.CharField(max_length=150)
+    cuisine = models.ForeignKey('restaurants.Cuisine', on_delete=models.SET_NULL, null=True, blank=True,
+                                db_constraint=False, related_name='+')
+    meal_type = models.ForeignKey('restaurants.MealType', on_delete=models.SET_NULL, null=True, blank=True,
+                                  db_constraint=False, related_name='+')
+    # the restaurant offering the menu, the restaurant itself for a restaurant
+    restaurant = models.ForeignKey('restaurants.Restaurant', on_delete=models.SET_NULL, null=True, blank=True,
+                                   db_constraint=False, related_name='+')
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('kind', 'object_id')
+
+    def __str__(self):
+        return "{} {}: {}".format(self.kind, self.object_id, self.title)
+
+
+class Posting(models.Model):
+    """
+    one row per term of a document, weight sums the weights of the fields the term occurs in
+    """
+    term = models.CharField(max_length=64)
+    document = models.ForeignKey('Document', on_delete=cascade, related_name='postings')
+    weight = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'document']),
+        ]
+
+    def __str__(self):
+        return "{} in {}".format(self.term, self.document_id)
+
+
+class IngredientPosting(models.Model):
+    """
+    the recipes containing an ingredient, as a packed array of their sorted ids. the "#size:<n>" terms list the
+    recipes having n ingredients. see search.ingredients
+    """
+    term = models.CharField(max_length=150, unique=True)
+    recipes = models.BinaryField(default=b'')
+
+    def __str__(self):
+        return "{} in {} recipes".format(self.term, len(self.recipes) // 4)
+
+
+class RecipeIngredients(models.Model):
+    """
+    the ingredients terms of a recipe as last indexed, to know which postings to update when they change
+    """
+    recipe_id = models.IntegerField(primary_key=True)
+    terms = models.TextField(default='')
+
+    def __str__(self):
+        return "ingredients of the recipe {}".format(self.recipe_id)
+
+
+@receiver([post_save, post_delete], sender='recipe.Recipe')
+def index_recipe(sender, instance, **kwargs):
+    indexer.schedule(Document.RECIPE, instance.pk)
+
+
+@receiver([post_save, post_delete], sender='recipe.Step')
+def index_recipe_step(sender, instance, **kwargs):
+    indexer.schedule(Document.RECIPE, instance.recipe_id)
+
+
+@receiver([post_save, post_delete], sender='recipe.CustomContains')
+def index_recipe_custom_ingredient(sender, instance, **kwargs):
+    indexer.schedule(Document.RECIPE, instance.recipe_id)
+    indexer.schedule(indexer.INGREDIENTS, instance.recipe_id)
+
+
+@receiver([post_save, post_delete], sender='recipe.Contains')
+def index_recipe_ingredient(sender, instance, **kwargs):
+    indexer.schedule(indexer.INGREDIENTS, instance.recipe_id)
+
+
+@receiver([post_save, post_delete], sender='restaurants.Menu')
+def index_menu(sender, instance, **kwargs):
+    indexer.schedule(Document.MENU, instance.pk)
+
+
+@receiver([post_save, post_delete], sender='restaurants.Restaurant')
+def index_restaurant(sender, instance, **kwargs):
+    indexer.schedule(Document.RESTAURANT, instance.pk)
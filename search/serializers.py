@@ -0,0 +1,39 @@
+from rest_framework import serializers
+
+from search.models import Document
+
+
+class DocumentSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(source='object_id', read_only=True)
+    matched = serializers.IntegerField(read_only=True)
+    score = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Document
+        fields = ['kind', 'id', 'title', 'cuisine', 'meal_type', 'restaurant', 'matched', 'score']
+
+
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=150)
+    kind = serializers.MultipleChoiceField(choices=Document.KINDS, required=False)
+    cuisine = serializers.IntegerField(required=False)
+    meal_type = serializers.IntegerField(required=False)
+    wilaya = serializers.IntegerField(required=False)
+    restaurant = serializers.IntegerField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+    def get_search_arguments(self) -> dict:
+        data = dict(self.validated_data)
+        data['query'] = data.pop('q')
+        data['kinds'] = data.pop('kind', None)
+        return data
+
+    def create(self, validated_data):
+        return None
+
+    def update(self, instance, validated_data):
+        return None
+
+
+class SuggestQuerySerializer(SearchQuerySerializer):
+    limit = serializers.IntegerField(min_value=1, max_value=20, default=10)
@@ -0,0 +1,292 @@
+import io
+from contextlib import redirect_stdout
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from recipe.models import Recipe, Step, CustomContains, Contains, Ingredient, IngredientType
+from recipe.tests import RecipeTestMixin
+from restaurants.forms import RestaurantSearchForm, MenuSearchForm
+from restaurants.models import User, Wilaya, City, Restaurant, Menu, MealType, OfferType, Cuisine, RestaurantCuisines
+from search import engine, text, ingredients
+from search.models import Document, Posting, IngredientPosting, RecipeIngredients
+
+
+class TokenizerTestCase(TestCase):
+    def test_folds_case_accents_and_elisions(self):
+        self.assertEqual(text.tokenize("La Crêpe d'Épinards"), ['crepe', 'epinard'])
+
+    def test_unifies_transliterations(self):
+        self.assertEqual(text.tokenize('Shorba'), text.tokenize('chorba'))
+        self.assertEqual(text.tokenize('tadjine'), text.tokenize('tajine'))
+        self.assertEqual(text.tokenize("m'hajeb"), ['mhajeb'])
+
+    def test_normalizes_arabic(self):
+        self.assertEqual(text.tokenize('شُرْبَة'), text.tokenize('شربه'))
+        self.assertEqual(text.tokenize('بالدجاج'), text.tokenize('دجاج'))
+        self.assertEqual(text.tokenize('في'), [])
+
+
+class SearchTestCase(RecipeTestMixin, TestCase):
+    def setUp(self) -> None:
+        # the index is updated once the transaction commits, never in a TestCase
+        patcher = mock.patch('search.indexer.transaction.on_commit', lambda function: function())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.wilaya = Wilaya.objects.create(name="alger", matricule=16, code_postal=16000)
+        self.city = City.objects.create(wilaya=self.wilaya, name="alger", code_postal=16000)
+        oran = Wilaya.objects.create(name="oran", matricule=31, code_postal=31000)
+        self.other_city = City.objects.create(wilaya=oran, name="oran", code_postal=31000)
+        self.chorba = self.add_recipe(food_name="Chorba frik", description="la soupe du ramadan")
+        Step.objects.create(recipe=self.chorba, number=1, description="faire revenir l'agneau")
+        CustomContains.objects.create(recipe=self.chorba, ingredient="frik", quantity=1)
+        self.tajine = self.add_recipe(food_name="Tajine zitoune", description="poulet aux olives")
+        Step.objects.create(recipe=self.tajine, number=1, description="servir avec une chorba")
+
+    def add_restaurant(self, name, city=None, **kwargs) -> Restaurant:
+        number = Restaurant.objects.count()
+        owner = User.objects.create(username="owner {}".format(number), phone="+2137991363{:02}".format(number),
+                                    user_type="O")
+        return Restaurant.objects.create(name=name, registre_commerce="rc {}".format(number),
+                                         id_fiscale="if {}".format(number), latitude=36.7, longitude=3.05,
+                                         main_user=owner, city=city or self.city,
+                                         images="search-test-{}".format(number), **kwargs)
+
+    def add_menu(self, restaurant, name, **kwargs) -> Menu:
+        return Menu.objects.create(number=Menu.objects.count(), name=name, description=kwargs.pop('description', ''),
+                                   price=100, image='menu/test.jpg', offered_by=restaurant,
+                                   type=kwargs.pop('type', None) or MealType.objects.get_or_create(type="test")[0],
+                                   offer=OfferType.objects.get_or_create(type="test")[0], **kwargs)
+
+    def test_indexes_the_recipes_texts(self):
+        self.assertEqual([(document.kind, document.object_id) for document in engine.search('agneau')],
+                         [('recipe', self.chorba.pk)])
+        # the ingredients and the steps are indexed
+        self.assertTrue(Posting.objects.filter(document__object_id=self.chorba.pk, term='frik').exists())
+
+    def test_ranks_by_matched_tokens_then_weights(self):
+        # in the title of one, in a step of the other
+        self.assertEqual([document.object_id for document in engine.search('shorba')], [self.chorba.pk, self.tajine.pk])
+        # the tajine contains both tokens
+        self.assertEqual([document.object_id for document in engine.search('chorba olives')],
+                         [self.tajine.pk, self.chorba.pk])
+        self.assertEqual([document.object_id for document in engine.search('chorba olives', match_all=True)],
+                         [self.tajine.pk])
+
+    def test_suggests_on_a_prefix(self):
+        self.assertEqual([document.title for document in engine.suggest('tadj')], ["Tajine zitoune"])
+        self.assertEqual([document.title for document in engine.suggest('chorba fr')], ["Chorba frik"])
+        self.assertEqual(engine.suggest('chorba fx'), [])
+
+    def test_follows_the_updates_and_deletions(self):
+        self.chorba.food_name = "Harira"
+        self.chorba.save()
+        self.assertEqual(Document.objects.get(kind='recipe', object_id=self.chorba.pk).title, "Harira")
+        self.assertEqual([document.object_id for document in engine.search('chorba')], [self.tajine.pk])
+        Step.objects.filter(recipe=self.tajine).delete()
+        self.assertEqual(engine.search('chorba'), [])
+        pk = self.tajine.pk
+        self.tajine.delete()
+        self.assertFalse(Document.objects.filter(kind='recipe', object_id=pk).exists())
+        self.assertFalse(Posting.objects.filter(document__object_id=pk, document__kind='recipe').exists())
+
+    def test_reindexes_a_recipe_once_per_transaction(self):
+        with mock.patch('search.indexer.index') as index, \
+                mock.patch('search.indexer.transaction.on_commit') as on_commit:
+            Step.objects.create(recipe=self.chorba, number=2, description="ajouter le frik")
+            Step.objects.create(recipe=self.chorba, number=3, description="servir")
+            for call in on_commit.call_args_list:
+                call[0][0]()
+        index.assert_called_once_with('recipe', [self.chorba.pk])
+
+    def test_bulk_writes_are_indexed(self):
+        from recipe.serializers import StepsBulkWriteSerializer
+
+        serializer = StepsBulkWriteSerializer(data={'create': [{'number': 2, 'description': "parsemer de coriandre"}]},
+                                              context={'recipe': self.chorba})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertEqual([document.object_id for document in engine.search('coriandre')], [self.chorba.pk])
+
+    def test_list_posts_are_indexed(self):
+        response = APIClient().post('/recipe/api/steps/', [{'number': 2, 'description': "parsemer de coriandre",
+                                                            'recipe': self.chorba.pk}], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([document.object_id for document in engine.search('coriandre')], [self.chorba.pk])
+
+    def test_indexing_failures_dont_fail_the_writes(self):
+        with mock.patch('search.indexer.index', side_effect=RuntimeError), \
+                self.assertLogs('search.indexer', 'ERROR'):
+            Step.objects.create(recipe=self.chorba, number=2, description="parsemer de coriandre")
+        self.assertEqual(engine.search('coriandre'), [])
+
+    def test_filters(self):
+        couscous = Cuisine.objects.create(name="couscous")
+        dinner = MealType.objects.create(type="dinner")
+        restaurant = self.add_restaurant("Chorba house", address="rue didouche")
+        RestaurantCuisines.objects.create(restaurant=restaurant, cuisine=couscous)
+        elsewhere = self.add_restaurant("Chorba d'Oran", city=self.other_city)
+        menu = self.add_menu(restaurant, "Chorba du jour", cuisine=couscous, type=dinner)
+        self.add_menu(elsewhere, "Chorba beida")
+
+        def found(**filters):
+            return {(document.kind, document.object_id) for document in engine.search('chorba', **filters)}
+
+        self.assertEqual(found(kinds=['restaurant']), {('restaurant', restaurant.pk), ('restaurant', elsewhere.pk)})
+        self.assertEqual(found(cuisine=couscous.pk), {('restaurant', restaurant.pk), ('menu', menu.pk)})
+        self.assertEqual(found(meal_type=dinner.pk), {('menu', menu.pk)})
+        self.assertEqual(found(restaurant=restaurant.pk), {('restaurant', restaurant.pk), ('menu', menu.pk)})
+        # a recipe is in the wilaya of its author
+        author = self.chorba.published_by.profile.owner
+        author.lives_in = self.city
+        author.save()
+        self.assertEqual(found(wilaya=self.wilaya.pk),
+                         {('restaurant', restaurant.pk), ('menu', menu.pk), ('recipe', self.chorba.pk)})
+
+    def test_search_forms_use_the_index(self):
+        restaurant = self.add_restaurant("Le Tajine d'or", address="12 rue Larbi Ben M'hidi")
+        self.add_restaurant("Pizzeria", address="rue Hassiba")
+        form = RestaurantSearchForm(data={'name': 'tadjine'})
+        form.is_valid()
+        self.assertEqual(list(form.search()), [restaurant])
+        form = RestaurantSearchForm(data={'address': "Ben M'hidi"})
+        form.is_valid()
+        self.assertEqual(list(form.search()), [restaurant])
+        form = RestaurantSearchForm(data={'address': "Le"})
+        form.is_valid()
+        self.assertEqual(list(form.search()), [])
+        form = RestaurantSearchForm(data={'address': "12"})
+        form.is_valid()
+        self.assertEqual(list(form.search()), [restaurant])
+        menu = self.add_menu(restaurant, "Tajine aux pruneaux")
+        self.add_menu(self.add_restaurant("Autre"), "Tajine aux pruneaux")
+        form = MenuSearchForm(data={'name': 'pruneau'})
+        form.is_valid()
+        self.assertEqual(list(form.search(restaurant.pk)), [menu])
+
+    def test_apis(self):
+        client = APIClient()
+        response = client.get('/search/api/', {'q': 'chorba', 'kind': 'recipe'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['id'] for result in response.data], [self.chorba.pk, self.tajine.pk])
+        self.assertEqual(response.data[0]['title'], "Chorba frik")
+        response = client.get('/search/api/suggest/', {'q': 'taj'})
+        self.assertEqual([result['id'] for result in response.data], [self.tajine.pk])
+        self.assertEqual(client.get('/search/api/').status_code, 400)
+
+    def test_rebuild_command(self):
+        Recipe.objects.filter(pk=self.chorba.pk).update(food_name="Harira")
+        Document.objects.create(kind='menu', object_id=0, title="deleted")
+        with redirect_stdout(io.StringIO()):
+            call_command('rebuild_search_index')
+        self.assertEqual([document.object_id for document in engine.search('harira')], [self.chorba.pk])
+        self.assertFalse(Document.objects.filter(kind='menu', object_id=0).exists())
+
+
+class IngredientIndexTestCase(RecipeTestMixin, TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch('search.indexer.transaction.on_commit', lambda function: function())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.omelette = self.add_cooked("Omelette", "oeufs", "sel", "Beurre")
+        self.quiche = self.add_cooked("Quiche", "Œufs", "lardons", "crème fraîche", "pâte brisée", "sel")
+        self.salad = self.add_cooked("Salade", "tomates", "huile d'olive", "sel")
+
+    def add_cooked(self, name, *names) -> Recipe:
+        recipe = self.add_recipe(food_name=name)
+        for ingredient in names:
+            CustomContains.objects.create(recipe=recipe, ingredient=ingredient, quantity=1)
+        return recipe
+
+    def found(self, **kwargs):
+        return [(match.recipe_id, match.matched, match.missing) for match in ingredients.lookup(**kwargs)]
+
+    def test_pack(self):
+        self.assertEqual(list(ingredients.unpack(ingredients.pack([7, 3, 2 ** 31]))), [3, 7, 2 ** 31])
+        self.assertEqual(len(ingredients.pack(range(10))), 40)
+
+    def test_indexes_the_normalized_ingredients(self):
+        self.assertEqual(set(ingredients.unpack(IngredientPosting.objects.get(term='oeuf').recipes)),
+                         {self.omelette.pk, self.quiche.pk})
+        self.assertEqual(RecipeIngredients.objects.get(recipe_id=self.salad.pk).terms.split('\n'),
+                         ['#size:3', 'huile olive', 'sel', 'tomate'])
+
+    def test_requires_every_ingredient(self):
+        self.assertEqual(self.found(require=['oeuf', 'SEL']), [(self.omelette.pk, 2, 1), (self.quiche.pk, 2, 3)])
+        self.assertEqual(self.found(require=['oeuf', 'tomate']), [])
+
+    def test_missing_at_most(self):
+        have = ['oeufs', 'sel', 'beurre', 'tomate']
+        self.assertEqual(self.found(have=have, missing=0), [(self.omelette.pk, 3, 0)])
+        self.assertEqual(self.found(have=have, missing=1), [(self.omelette.pk, 3, 0), (self.salad.pk, 2, 1)])
+        self.assertEqual(self.found(have=have, require=['tomates'], missing=1), [(self.salad.pk, 2, 1)])
+        self.assertEqual(len(self.found(have=have)), 3)
+        self.assertEqual(self.found(have=['caviar']), [])
+
+    def test_follows_the_ingredients_changes(self):
+        contains = CustomContains.objects.get(recipe=self.omelette, ingredient="Beurre")
+        contains.ingredient = "fromage"
+        contains.save()
+        self.assertEqual(self.found(require=['fromage']), [(self.omelette.pk, 1, 2)])
+        self.assertEqual(self.found(require=['beurre']), [])
+        self.assertFalse(IngredientPosting.objects.filter(term='beurre').exists())
+        contains.delete()
+        self.assertEqual(self.found(have=['oeuf', 'sel'], missing=0), [(self.omelette.pk, 2, 0)])
+        # the structured ingredients are indexed too
+        Contains.objects.create(recipe=self.salad, quantity=1, ingredient=Ingredient.objects.create(
+            name="Oignon", type=IngredientType.objects.create(type="legume")))
+        self.assertEqual(self.found(require=['oignons']), [(self.salad.pk, 1, 3)])
+        pk = self.salad.pk
+        self.salad.delete()
+        self.assertEqual(self.found(require=['sel']), [(self.omelette.pk, 1, 1), (self.quiche.pk, 1, 4)])
+        self.assertFalse(RecipeIngredients.objects.filter(recipe_id=pk).exists())
+
+    def test_bulk_writes_are_indexed(self):
+        from recipe.serializers import CustomContainsBulkWriteSerializer
+
+        serializer = CustomContainsBulkWriteSerializer(
+            data={'create': [{'ingredient': "persil", 'quantity': 1}]}, context={'recipe': self.salad})
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertEqual(self.found(require=['persil']), [(self.salad.pk, 1, 3)])
+
+    def test_list_posts_are_indexed(self):
+        response = APIClient().post('/recipe/api/recipes/custom-contain/',
+                                    [{'ingredient': "persil", 'quantity': 1, 'recipe': self.salad.pk}], format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.found(require=['persil']), [(self.salad.pk, 1, 3)])
+
+    def test_retries_when_a_term_is_added_concurrently(self):
+        write_postings = ingredients._write_postings
+        calls = []
+
+        def race(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise IntegrityError('UNIQUE constraint failed: search_ingredientposting.term')
+            return write_postings(*args)
+
+        with mock.patch('search.ingredients._write_postings', side_effect=race):
+            CustomContains.objects.create(recipe=self.salad, ingredient="persil", quantity=1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.found(require=['persil']), [(self.salad.pk, 1, 3)])
+
+    def test_rebuild(self):
+        IngredientPosting.objects.all().delete()
+        RecipeIngredients.objects.create(recipe_id=0, terms='#size:1\ngone')
+        with redirect_stdout(io.StringIO()):
+            call_command('rebuild_search_index', '--kind', 'ingredients')
+        self.assertEqual(self.found(require=['lardon']), [(self.quiche.pk, 1, 4)])
+        self.assertFalse(RecipeIngredients.objects.filter(recipe_id=0).exists())
+
+    def test_api(self):
+        response = APIClient().get('/recipe/api/recipes/by-ingredients/',
+                                   {'have': ['oeufs', 'sel', 'beurre', 'tomate'], 'missing': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(recipe['id'], recipe['missing']) for recipe in response.data],
+                         [(self.omelette.pk, 0), (self.salad.pk, 1)])
+        self.assertEqual(response.data[0]['food_name'], "Omelette")
+        self.assertEqual(APIClient().get('/recipe/api/recipes/by-ingredients/').status_code, 400)
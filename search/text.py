@@ -0,0 +1,92 @@
+"""
+the tokenizer of the search index, applied the same way to the indexed texts and to the queries.
+the texts are french, arabic, or arabic words written in latin letters (chorba, m'hajeb, tajine...):
+- the case, the accents and the ligatures are folded: "Crêpe" -> "crepe", "Œuf" -> "oeuf"
+- the arabic diacritics and tatweel are dropped, and the alef, ya and ta marbuta variants are unified
+- the elisions are split: "l'agneau" -> "agneau", "m'hajeb" -> "mhajeb"
+- the common spellings of the transliterations are unified: "chorba"/"shorba", "tadjine"/"tajine"
+- the latin plurals are folded: "tomates" -> "tomate"
+- the arabic definite article and its attached prepositions are dropped: "بالدجاج" -> "دجاج"
+- the french and arabic stop words and the one letter tokens are dropped
+"""
+import re
+import unicodedata
+
+MAX_TERM_LENGTH = 64
+
+STOP_WORDS = {
+    'au', 'aux', 'avec', 'ce', 'ces', 'dans', 'de', 'des', 'du', 'en', 'et', 'la', 'le', 'les', 'leur', 'ou', 'par',
+    'pour', 'sa', 'se', 'ses', 'son', 'sur', 'un', 'une', 'est', 'il', 'elle', 'on', 'qui', 'que', 'the', 'and',
+    'of', 'with', 'في', 'من', 'على', 'الى', 'عن', 'مع', 'و',
+}
+# elided articles and pronouns: l', d', qu'...
+ELISION = re.compile(r"\b(?:[ldjn]|qu)['’]")
+# the letters of an elided transliteration stay together: m'hajeb -> mhajeb
+APOSTROPHES = re.compile(r"['’`]")
+# not decomposed by NFKD
+LIGATURES = str.maketrans({'œ': 'oe', 'æ': 'ae'})
+ARABIC_DIACRITICS = re.compile('[ً-ٰٟـ]')
+ARABIC_LETTERS = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ى': 'ي', 'ة': 'ه', 'ؤ': 'و', 'ئ': 'ي',
+})
+# applied in order on the folded latin tokens
+TRANSLITERATIONS = (
+    ('dj', 'j'),
+    ('sh', 'ch'),
+    ('kh', 'k'),
+)
+ARABIC_ARTICLES = ('وبال', 'بال', 'وال', 'فال', 'كال', 'ال', 'لل')
+TOKEN = re.compile(r'\w+')
+
+
+def fold(text) -> str:
+    """
+    lower case, without accents nor arabic diacritics, with the arabic letters variants unified
+    """
+    text = unicodedata.normalize('NFKD', text.lower().translate(LIGATURES))
+    text = ''.join(character for character in text if not unicodedata.combining(character))
+    return ARABIC_DIACRITICS.sub('', text).translate(ARABIC_LETTERS)
+
+
+def normalize_token(token) -> str:
+    if token.isascii():
+        for spelling, canonical in TRANSLITERATIONS:
+            token = token.replace(spelling, canonical)
+        if len(token) > 3 and token[-1] in 'sx' and token[-2] != 's':
+            token = token[:-1]
+    else:
+        for article in ARABIC_ARTICLES:
+            if token.startswith(article) and len(token) - len(article) > 1:
+                token = token[len(article):]
+                break
+    return token[:MAX_TERM_LENGTH]
+
+
+def tokenize(text, keep_stop_words=False) -> list:
+    """
+    :param text: the text to index or the query
+    :param keep_stop_words: keeps the stop words, for a prefix being typed ("de" of "dessert")
+    :return: the normalized tokens, in the order of the text
+    """
+    if not text:
+        return []
+    text = APOSTROPHES.sub('', ELISION.sub(' ', fold(text)))
+    tokens = []
+    for token in TOKEN.findall(text):
+        if len(token) < 2 or token.isdigit() or (not keep_stop_words and token in STOP_WORDS):
+            continue
+        tokens.append(normalize_token(token))
+    return tokens
+
+
+def prefix_variants(token) -> set:
+    """
+    the prefixes of the indexed terms a token being typed may be: "tad" may be the start of "tadjine", indexed
+    as "tajine", so "ta" is a variant
+    :param token: a normalized token
+    :return: the prefixes to look up, token included
+    """
+    variants = {token}
+    if token.isascii() and len(token) > 2 and any(token.endswith(spelling[0]) for spelling, _ in TRANSLITERATIONS):
+        variants.add(token[:-1])
+    return variants
@@ -0,0 +1,15 @@
+from django.urls import path, include
+
+from . import apis
+
+app_name = 'search'
+
+extra_urls = [
+    path('', apis.SearchApi.as_view(), name='search'),
+    path('suggest/', apis.SuggestApi.as_view(), name='suggest'),
+]
+
+urlpatterns = [
+    # api urls
+    path('api/', include(extra_urls)),
+]